@@ -0,0 +1,41 @@
+"""
+Benchmarks re-rendering a 10 container dashboard after one of its columns
+changes, with and without a ChartCache: building the charts
+(convert_to_charts), and building them and writing out the spec (to_dict).
+
+  python -m benchmarks.bench_chart_cache [num_values]
+"""
+import sys
+import time
+
+from specmetric.renderer import AltairRenderer, VegaLiteRenderer
+from specmetric.chart_cache import ChartCache
+from specmetric.position_calculators.layout_cache import LayoutCache
+from benchmarks.bench_parallel_charts import make_dashboard
+
+
+def render(renderer_class, containers, data_dict, **options):
+  # no layout cache, so the chart cache is all that is reused
+  renderer = renderer_class(containers, data_dict, layout_cache=LayoutCache(maxsize=0), **options)
+  start = time.perf_counter()
+  chart = renderer.convert_to_charts()
+  built = time.perf_counter()
+  chart.to_dict()
+  return (built - start, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+  num_values = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+  (containers, data_dict) = make_dashboard(10, num_values)
+  print("10 containers x {} values, re-rendered after one column changed".format(num_values))
+  for renderer_class in (AltairRenderer, VegaLiteRenderer):
+    cache = ChartCache()
+    render(renderer_class, containers, data_dict, chart_cache=cache)
+    data_dict['x4'] = data_dict['x4'] + 1
+    uncached = render(renderer_class, containers, data_dict)
+    cached = render(renderer_class, containers, data_dict, chart_cache=cache)
+    single = render(renderer_class, containers[4:5], data_dict)
+    for (i, step) in enumerate(['convert_to_charts', '+ to_dict']):
+      print("  {:<17} {:<18} uncached {:>6.3f}s   cached {:>6.3f}s   changed container alone {:>6.3f}s".format(
+        renderer_class.__name__, step, uncached[i], cached[i], single[i]))
+    print("  {}".format(cache.stats()))
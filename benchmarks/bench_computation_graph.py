@@ -0,0 +1,53 @@
+"""
+Compares building a large tree out of ComputationNode objects against
+ComputationGraph.from_records, in time and traced memory.
+
+  python -m benchmarks.bench_computation_graph
+"""
+import random
+import time
+import tracemalloc
+
+from specmetric.computation_tree import ComputationNode, ComputationGraph
+
+
+def random_records(num_nodes, seed=0):
+  """
+  Spreadsheet-style node records for a random tree, parents listed first
+  """
+  rng = random.Random(seed)
+  records = [{'name': 'n0', 'parent': None, 'function': 'scalar_sum', 'input_data': [], 'output_data': 'n0'}]
+  for i in range(1, num_nodes):
+    records.append({'name': 'n{}'.format(i), 'parent': 'n{}'.format(rng.randrange(i)), 'function': 'scalar', 'input_data': [], 'output_data': 'n{}'.format(i)})
+  return records
+
+def build_nodes(records):
+  # the loop the spreadsheet app used to run
+  nodes = {}
+  for r in records:
+    parent = nodes[r['parent']] if r['parent'] else None
+    nodes[r['name']] = ComputationNode(r['name'], parent, r['function'], input_data=r['input_data'], output_data=r['output_data'])
+  return nodes
+
+def build_graph(records):
+  return ComputationGraph.from_records(records, function_type='function')
+
+def measure(name, build, records):
+  tracemalloc.start()
+  start = time.perf_counter()
+  result = build(records)
+  elapsed = time.perf_counter() - start
+  memory = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  print("{:<38} {:8.3f}s {:10.1f} MB".format(name, elapsed, memory / 1e6))
+  return result
+
+
+if __name__ == '__main__':
+  for num_nodes in [10000, 1000000]:
+    records = random_records(num_nodes)
+    measure("ComputationNode x {}".format(num_nodes), build_nodes, records)
+    measure("ComputationGraph x {}".format(num_nodes), build_graph, records)
+    shuffled = list(records)
+    random.Random(1).shuffle(shuffled)
+    measure("ComputationGraph x {} (shuffled)".format(num_nodes), build_graph, shuffled)
@@ -0,0 +1,41 @@
+"""
+Benchmarks COUNTIFS(A, "B*", C, "Yes", D, ">=500") over num_rows rows:
+matching row by row in Python, against compiled masks, computed and then
+from a MaskCache.
+
+  python -m benchmarks.bench_criteria [num_rows]
+"""
+import sys
+import time
+
+import numpy as np
+
+from specmetric.columns import column
+from specmetric.criteria import Criterion, MaskCache, criteria_mask
+
+
+def make_columns(num_rows):
+  rng = np.random.default_rng(0)
+  return {
+    'A': column(np.array(['Art', 'Biology', 'Business', 'Chemistry', 'Dance', 'Economics'], dtype=object)[rng.integers(0, 6, num_rows)]),
+    'C': column(np.array(['Yes', 'No'], dtype=object)[rng.integers(0, 2, num_rows)]),
+    'D': column(rng.integers(0, 1000, num_rows).astype(float)),
+  }
+
+
+if __name__ == '__main__':
+  num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  columns = make_columns(num_rows)
+  pairs = ['A', 'B*', 'C', 'Yes', 'D', '>=500']
+  print("COUNTIFS over {} rows, {}".format(num_rows, pairs))
+
+  start = time.perf_counter()
+  criteria = [(columns[name].values.tolist(), Criterion(criterion)) for (name, criterion) in zip(pairs[::2], pairs[1::2])]
+  count = sum(all(c.matches(values[i]) for (values, c) in criteria) for i in range(num_rows))
+  print("  row by row     {:>8.3f}s   {} matching".format(time.perf_counter() - start, count))
+
+  cache = MaskCache()
+  for label in ('masks', 'cached masks'):
+    start = time.perf_counter()
+    mask = criteria_mask(pairs, columns.get, lambda criterion: criterion, lambda name: name, cache)
+    print("  {:<14} {:>8.3f}s   {} matching".format(label, time.perf_counter() - start, int(mask.sum())))
@@ -0,0 +1,65 @@
+"""
+Benchmarks composing the charts of a dashboard, with flatten_charts and
+with the old fold of + and |, as the number of containers grows.
+
+  python -m benchmarks.bench_flatten_charts
+"""
+import sys
+import time
+
+from specmetric.renderer import AltairRenderer
+from benchmarks.bench_parallel_charts import make_dashboard
+
+
+def fold_charts(charts):
+  # the old flatten_charts, for reference
+  result_chart = None
+  for cs in charts:
+    curr = None
+    for c in cs:
+      if curr:
+        curr = curr + c
+      else:
+        curr = c
+
+    if result_chart:
+      result_chart = result_chart | curr
+    else:
+      result_chart = curr
+
+  return result_chart
+
+
+def depth(spec):
+  if isinstance(spec, dict):
+    return 1 + max((depth(v) for v in spec.values()), default=0)
+  if isinstance(spec, (list, tuple)):
+    return 1 + max((depth(v) for v in spec), default=0)
+  return 0
+
+
+def best_time(f, repeat=3):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    f()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+if __name__ == '__main__':
+  sizes = [int(n) for n in sys.argv[1:]] or [10, 50, 100, 200, 400]
+  for num_containers in sizes:
+    (containers, data_dict) = make_dashboard(num_containers, 20)
+    renderer = AltairRenderer(containers, data_dict)
+    categorical_color_scale = renderer.alt.Scale(scheme='category10')
+    crosslinker = renderer.alt.selection_single(fields=['id'], on='mouseover', empty='none')
+    charts = [renderer.build_chart(spec, categorical_color_scale, crosslinker) for spec in containers]
+
+    assert fold_charts(charts).to_dict() == renderer.flatten_charts(charts).to_dict()
+    fold = best_time(lambda: fold_charts(charts))
+    flat = best_time(lambda: renderer.flatten_charts(charts))
+    renderer.columns = 4
+    spec = renderer.flatten_charts(charts).to_dict()
+    print("{:>4} containers   fold {:>7.3f}s   flatten_charts {:>7.3f}s   depth with 4 columns {}".format(
+      num_containers, fold, flat, depth(spec)))
@@ -0,0 +1,30 @@
+"""
+Benchmarks compiling the formulas of a filled-down column of num_rows
+cells into node records, parsing each formula against reusing the template
+the column shares.
+
+  python -m benchmarks.bench_formula [num_rows]
+"""
+import sys
+import time
+
+from specmetric.formula import compile_cells, FormulaCache
+
+
+def compile_column(num_rows, cache):
+  formulas = {'D{}'.format(row): '=B{0}-C{0}'.format(row) for row in range(2, num_rows + 2)}
+  start = time.perf_counter()
+  for address in formulas:
+    compile_cells(address, formulas.get, cache=cache)
+  return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+  num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  print("{} cells of '=B2-C2', filled down".format(num_rows))
+  uncached = compile_column(num_rows, None)
+  cache = FormulaCache()
+  cached = compile_column(num_rows, cache)
+  print("  parsed every time   {:>7.3f}s   {:>6.1f}us per cell".format(uncached, uncached / num_rows * 1e6))
+  print("  one template        {:>7.3f}s   {:>6.1f}us per cell".format(cached, cached / num_rows * 1e6))
+  print("  {}".format(cache.stats()))
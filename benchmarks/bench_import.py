@@ -0,0 +1,70 @@
+"""
+Measures how long it takes a fresh interpreter to import specmetric modules,
+from the cumulative times reported by python -X importtime.  Each module is
+timed with a cold rules cache (YAML parsed, cache written) and a warm one,
+and the slowest imports it pulls in are listed.
+
+  python -m benchmarks.bench_import
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MODULES = [
+  'specmetric.rules_config',
+  'specmetric.computation_tree',
+  'specmetric.parser',
+  'specmetric.renderer',
+]
+
+
+def importtime(code, cache_dir):
+  """
+  Runs code in a fresh interpreter under -X importtime, and returns
+  (name, depth, cumulative microseconds) for every module it imported, in
+  the order importtime reports them: dependencies before their importer
+  """
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  env = dict(os.environ, PYTHONPATH=root, SPECMETRIC_CACHE_DIR=cache_dir)
+  result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True, check=True)
+  entries = []
+  for line in result.stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    (_, cumulative_us, name) = line[len('import time:'):].split('|')
+    # importtime indents a module two spaces per level of nesting
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    entries.append((name.strip(), depth, int(cumulative_us)))
+  return entries
+
+
+def dependencies(entries, module):
+  """
+  Cumulative time of module, and the (time, name) of everything it imported
+  """
+  for (i, (name, depth, cumulative_us)) in enumerate(entries):
+    if name == module:
+      below = []
+      for (dep_name, dep_depth, dep_us) in reversed(entries[:i]):
+        if dep_depth <= depth:
+          break
+        below.append((dep_us, dep_name))
+      return (cumulative_us, below)
+  raise ValueError("{} was not imported".format(module))
+
+
+def time_module(module, repeat=5):
+  code = 'import {}'.format(module)
+  with tempfile.TemporaryDirectory() as cache_dir:
+    (cold, _) = dependencies(importtime(code, cache_dir), module)
+    runs = [dependencies(importtime(code, cache_dir), module) for _ in range(repeat)]
+  warm = statistics.median(t for (t, _) in runs)
+  slowest = sorted(runs[-1][1], reverse=True)[:3]
+  print("{:<30} cold {:>8.1f}ms   warm {:>8.1f}ms   slowest: {}".format(module, cold / 1000, warm / 1000, ', '.join('{} {:.1f}ms'.format(name, t / 1000) for (t, name) in slowest)))
+
+
+if __name__ == '__main__':
+  for module in MODULES:
+    time_module(module)
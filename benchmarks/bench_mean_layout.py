@@ -0,0 +1,94 @@
+"""
+Benchmarks the mean_chart layout (MeanLayout and square_offsets), and checks
+that its coordinates are bit for bit those of the original row by row
+pandas layout.
+
+  python -m benchmarks.bench_mean_layout
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from specmetric.position_calculators.mean_layout import MeanLayout, square_offsets
+
+
+def reference_mean_layout(values, ids, padding=3):
+  """
+  The original mean_chart layout from AltairRenderer.build_chart, kept as a
+  reference
+  """
+  mean_value = np.mean(values)
+  median_value = np.median(values)
+  values_df = pd.DataFrame(data={'val': values, 'is_mean': False, 'is_median': False}, index=ids)
+  values_df.loc[len(values_df)] = [mean_value, True, False]
+  values_df.loc[len(values_df)] = [median_value, False, True]
+  values_df = values_df.sort_values(by='val')
+  values_df['id'] = values_df.index.values
+  values_df = values_df.reset_index(drop=True)
+  values_df['x'] = values_df.index.values
+  values_df['sqrtval'] = np.sqrt(values_df['val'])
+  values_df['squarex'] = 0.
+  for i in range(1, len(values_df)):
+    values_df.loc[i, 'squarex'] = values_df.loc[i-1, 'squarex'] + values_df.loc[i-1, 'sqrtval'] + padding
+  return values_df
+
+
+def vectorized_mean_layout(values, ids, padding=3):
+  layout = MeanLayout(values)
+  (squarex, sqrtval) = square_offsets(layout.values[0], padding=padding)
+  return pd.DataFrame(data={
+    'val': layout.values[0],
+    'is_mean': layout.order[0] == layout.num_values,
+    'is_median': layout.order[0] == layout.num_values + 1,
+    'id': layout.take(0, ids, layout.num_values, layout.num_values + 1),
+    'x': np.arange(layout.num_values + 2),
+    'sqrtval': sqrtval,
+    'squarex': squarex,
+  })
+
+
+def check_reference(num_values, seed=0):
+  rng = np.random.default_rng(seed)
+  # rounded, so there are plenty of ties
+  values = np.round(rng.exponential(50, num_values), 1)
+  ids = np.arange(num_values)
+  start = time.perf_counter()
+  expected = reference_mean_layout(values, ids)
+  reference_time = time.perf_counter() - start
+  start = time.perf_counter()
+  actual = vectorized_mean_layout(values, ids)
+  vectorized_time = time.perf_counter() - start
+  # equal values can be drawn in either order, so the ids are only checked
+  # against the values they are drawn at
+  summaries = np.append(values, [np.mean(values), np.median(values)])
+  matches = [np.array_equal(expected[column].to_numpy(dtype=actual[column].dtype), actual[column].to_numpy()) for column in ['val', 'x', 'sqrtval', 'squarex']]
+  matches.append(np.array_equal(summaries[actual['id'].to_numpy(dtype=int)], actual['val'].to_numpy()))
+  matches.append(expected['is_mean'].sum() == actual['is_mean'].sum() == 1)
+  if not all(matches):
+    print("MISMATCH for {} values".format(num_values))
+    sys.exit(1)
+  print("{:>10} values   reference {:>9.3f}s   vectorized {:>9.3f}s   identical".format(num_values, reference_time, vectorized_time))
+
+
+def time_layout(num_values, num_attrs=1, repeat=3):
+  rng = np.random.default_rng(num_values)
+  values = rng.exponential(50, (num_attrs, num_values))
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    layout = MeanLayout(values)
+    for row in range(num_attrs):
+      square_offsets(layout.values[row])
+      layout.colors(row, 'attr')
+    best = min(best, time.perf_counter() - start)
+  print("{:>10} values x {} attributes   {:>9.3f}s   ({:.1f} ns per value)".format(num_values, num_attrs, best, best / (num_values * num_attrs) * 1e9))
+
+
+if __name__ == '__main__':
+  for num_values in [100, 2000, 10000]:
+    check_reference(num_values)
+  for num_values in [10000, 1000000, 10000000]:
+    time_layout(num_values)
+  time_layout(1000000, num_attrs=4)
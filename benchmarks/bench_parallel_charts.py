@@ -0,0 +1,65 @@
+"""
+Benchmarks AltairRenderer.convert_to_charts on a dashboard of 20 containers
+over large vectors, serially and with thread and process pools of up to
+os.cpu_count() workers.
+
+  python -m benchmarks.bench_parallel_charts [num_values]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from specmetric.renderer import AltairRenderer
+from specmetric.computation_tree import ComputationNode
+from specmetric.visualization_container import VisualizationContainer
+
+
+def make_dashboard(num_containers, num_values, seed=0):
+  rng = np.random.default_rng(seed)
+  data_dict = {'ids': np.arange(num_values)}
+  containers = []
+  for i in range(num_containers):
+    (x, y) = ('x{}'.format(i), 'y{}'.format(i))
+    data_dict[x] = np.round(rng.exponential(50, num_values), 1) + 0.1
+    data_dict[y] = np.round(rng.exponential(50, num_values), 1) + 0.1
+    # a mix of the charts that carry a value per row
+    kind = i % 3
+    if kind == 0:
+      (chart, encodings) = ('scatter_y_equals_x', {x: {'mark': 'point', 'channels': 'vector-location', 'preference': 'x'}, y: {'mark': 'point', 'channels': 'vector-location', 'preference': 'y'}})
+    elif kind == 1:
+      (chart, encodings) = ('mean_chart', {x: {'mark': 'line', 'channels': 'vector-location'}})
+    else:
+      (chart, encodings) = ('spacefilling', {x: {'mark': 'square', 'channels': 'vector-location'}, y: {'mark': 'square', 'channels': 'vector-location'}})
+    vc = VisualizationContainer(ComputationNode('fake', None, 'scalar'))
+    vc.valid_chart = chart
+    vc.encodings = encodings
+    containers.append(vc)
+  return containers, data_dict
+
+
+def time_convert(renderer, repeat=3, **options):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    renderer.convert_to_charts(**options)
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+if __name__ == '__main__':
+  num_values = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  (containers, data_dict) = make_dashboard(20, num_values)
+  # a cache would make every run after the first one nearly free
+  from specmetric.position_calculators.layout_cache import LayoutCache
+  renderer = AltairRenderer(containers, data_dict, layout_cache=LayoutCache(maxsize=0))
+
+  serial = time_convert(renderer)
+  print("20 containers x {} values   serial {:>8.3f}s".format(num_values, serial))
+  workers = 1
+  while workers <= (os.cpu_count() or 1):
+    for executor in ['thread', 'process']:
+      elapsed = time_convert(renderer, executor=executor, max_workers=workers)
+      print("{:>8} x {:>2} workers   {:>8.3f}s   ({:.2f}x)".format(executor, workers, elapsed, serial / elapsed))
+    workers *= 2
@@ -0,0 +1,267 @@
+"""
+Benchmarks ComputationTreeParser.visualizeDFG, and checks that it produces
+the same containers, in the same order, as the original recursive parser.
+
+  python -m benchmarks.bench_parser
+"""
+import random
+import re
+import sys
+import time
+
+from specmetric.parser import ComputationTreeParser
+from specmetric.computation_tree import ComputationNode
+from specmetric.visualization_container import VisualizationContainer
+from specmetric.rules_config import grammatical_expressions
+from specmetric.parse_cache import ParseCache
+from specmetric.incremental_parser import IncrementalParser
+
+
+def reference_mergeFamily(parent_node, visualization_container_list, compositions, grammatical_expressions, parent_depth=0):
+  """
+  The original implementation of mergeFamily, kept as a reference
+  """
+  unmerged_child_containers = []
+  child_encodings = {}
+  for child_container in visualization_container_list:
+    child_encodings = child_encodings | child_container.encodings
+  parent_container = VisualizationContainer(parent_node, child_encodings=child_encodings, compositions=compositions, grammatical_expressions=grammatical_expressions, lowest_depth=parent_depth)
+  while(len(visualization_container_list) > 0):
+    child_container = visualization_container_list.pop()
+    if child_container.lowest_depth < parent_container.lowest_depth:
+      child_container.lowest_depth = parent_container.lowest_depth
+    if child_container.parent_mergeable(parent_node):
+      child_container.merge_parent(parent_node)
+      for node in parent_container.computation_nodes:
+        child_container.add_node(node)
+      child_container.encodings = child_container.encodings | parent_container.encodings
+      child_container.root_node = parent_container.root_node
+      parent_container = child_container
+    else:
+      unmerged_child_containers.append(child_container)
+  unmerged_child_containers.append(parent_container)
+  return unmerged_child_containers
+
+def recursive_visualizeDFG(parser):
+  """
+  The original recursive implementation of visualizeDFG, kept as a reference
+  """
+  def parseDFTree(tree, depth=0):
+    new_depth = depth + 1
+    if tree.is_leaf():
+      return [VisualizationContainer(tree, compositions=parser.compositions, grammatical_expressions=parser.grammatical_expressions, lowest_depth=new_depth)]
+    child_container_heads = []
+    resolved_child_tails = []
+    for child_node in tree.children:
+      child_containers = parseDFTree(child_node, depth=new_depth)
+      child_container_heads.append(child_containers.pop())
+      resolved_child_tails = resolved_child_tails + child_containers
+    return sorted(resolved_child_tails + reference_mergeFamily(tree, child_container_heads, parser.compositions, parser.grammatical_expressions, parent_depth=new_depth), key=lambda x: (-1 * x.lowest_depth))
+
+  return parseDFTree(parser.computation_tree)
+
+
+def summarize(containers):
+  return [(c.valid_chart, c.root_node.name, c.lowest_depth, c.encodings, [n.name for n in c.computation_nodes]) for c in containers]
+
+
+def scalar_sum_tree():
+  sum_node = ComputationNode('sum', None, 'scalar_sum', input_data=['a', 'b'], output_data='aplusb')
+  ComputationNode('literal_a', sum_node, 'scalar', output_data='a')
+  ComputationNode('literal_b', sum_node, 'scalar', output_data='b')
+  return sum_node
+
+def scatter_tree():
+  diff_node = ComputationNode('diff', None, 'vector_diff', input_data=['a', 'b'], output_data='aminusb')
+  ComputationNode('literal_a', diff_node, 'vector', output_data='a')
+  ComputationNode('literal_b', diff_node, 'vector', output_data='b')
+  return diff_node
+
+def r2_tree(suffix=''):
+  """
+  The r2 tree from tests/test_parser.py, with suffix added to every variable name
+  """
+  v = lambda name: name + suffix
+  minus_scalar = ComputationNode('minus_scalar', None, 'scalar_diff', input_data=[v('one'), v('ss_res_ss_tot_ratio')], output_data=v('r2'))
+  ComputationNode('one', minus_scalar, 'scalar', input_data=[], output_data=v('one'))
+  ratio = ComputationNode('ratio', minus_scalar, 'scalar_ratio', input_data=[v('ss_res'), v('ss_tot')], output_data=v('ss_res_ss_tot_ratio'))
+  vector_sum_ss_tot = ComputationNode('ss_tot', ratio, 'vector_sum', input_data=[v('y_i_minus_y_bar_squared')], output_data=v('ss_tot'))
+  vector_sum_ss_res = ComputationNode('ss_res', ratio, 'vector_sum',input_data=[v('y_i_minus_y_hat_i_squared')], output_data=v('ss_res'))
+  square_variances = ComputationNode('square_variances', vector_sum_ss_tot, 'vector_square', input_data=[v('y_i_minus_y_bar')], output_data=v('y_i_minus_y_bar_squared'))
+  square_residuals = ComputationNode('square_residuals', vector_sum_ss_res, 'vector_square', input_data=[v('y_i_minus_y_hat_i')], output_data=v('y_i_minus_y_hat_i_squared'))
+  vector_difference_variances = ComputationNode('vector_difference_variances', square_variances, 'vector_diff', input_data=[v('y_i'), v('y_bar_vector')], output_data=v('y_i_minus_y_bar'))
+  vector_difference_residuals = ComputationNode('vector_difference_residuals', square_residuals, 'vector_diff', input_data=[v('y_i'), v('y_hat_i')], output_data=v('y_i_minus_y_hat_i'))
+  ComputationNode('literal_yi_var', vector_difference_variances, 'vector', output_data=v('y_i'))
+  broadcast = ComputationNode('broadcast_mean', vector_difference_variances, 'broadcast', input_data=[v('y_bar_scalar'), v('y_i')], output_data=v('y_bar_vector'))
+  mean_y = ComputationNode('mean_y', broadcast, 'mean', input_data=[v('y_i')], output_data=v('y_bar_scalar'))
+  ComputationNode('literal_yi_mean', mean_y, 'vector', output_data=v('y_i'))
+  ComputationNode('literal_yi_res', vector_difference_residuals, 'vector', output_data=v('y_i'))
+  ComputationNode('literal_yhat', vector_difference_residuals, 'vector', output_data=v('y_hat_i'))
+  return minus_scalar
+
+def random_tree(num_nodes, max_children=3, seed=0, prefix='v'):
+  """
+  Random tree over the default grammar.  Variable names are drawn from a small
+  pool so that encodings collide and containers merge.
+  """
+  rng = random.Random(seed)
+  function_types = sorted(grammatical_expressions.keys())
+  names = ['{}{}'.format(prefix, i) for i in range(8)]
+  def make_node(i, parent):
+    return ComputationNode('n{}'.format(i), parent, rng.choice(function_types), input_data=rng.sample(names, 2), output_data=rng.choice(names))
+  root = make_node(0, None)
+  open_nodes = [root]
+  for i in range(1, num_nodes):
+    parent = rng.choice(open_nodes)
+    node = make_node(i, parent)
+    open_nodes.append(node)
+    if len(parent.children) >= max_children:
+      open_nodes.remove(parent)
+  return root
+
+def chain_tree(num_nodes):
+  root = ComputationNode('n0', None, 'vector_square', input_data=['v'], output_data='v')
+  node = root
+  for i in range(1, num_nodes):
+    node = ComputationNode('n{}'.format(i), node, 'vector_square', input_data=['v'], output_data='v')
+  return root
+
+def wide_tree(num_nodes):
+  root = ComputationNode('root', None, 'scalar_sum', input_data=['a', 'b'], output_data='c')
+  for i in range(1, num_nodes):
+    ComputationNode('n{}'.format(i), root, 'scalar', output_data='s{}'.format(i))
+  return root
+
+
+def dashboard_tree(num_metrics):
+  """
+  A composite dashboard of metrics that each rebuild the same squared
+  residuals, the way the notebook builds them
+  """
+  root = ComputationNode('dashboard', None, 'scalar_sum', input_data=['m0', 'm1'], output_data='dashboard')
+  for i in range(num_metrics):
+    metric = ComputationNode('m{}'.format(i), root, ['vector_sum', 'mean'][i % 2], input_data=['y_i_minus_y_hat_i_squared'], output_data='m{}'.format(i))
+    square_residuals = ComputationNode('square_residuals', metric, 'vector_square', input_data=['y_i_minus_y_hat_i'], output_data='y_i_minus_y_hat_i_squared')
+    vector_difference_residuals = ComputationNode('vector_difference_residuals', square_residuals, 'vector_diff', input_data=['y_i', 'y_hat_i'], output_data='y_i_minus_y_hat_i')
+    ComputationNode('literal_yi', vector_difference_residuals, 'vector', output_data='y_i')
+    ComputationNode('literal_yhat', vector_difference_residuals, 'vector', output_data='y_hat_i')
+  return root
+
+
+def check_equivalence():
+  trees = [('scalar_sum', scalar_sum_tree), ('scatter', scatter_tree), ('r2', r2_tree)]
+  trees += [('random_{}'.format(seed), lambda seed=seed: random_tree(200, seed=seed)) for seed in range(50)]
+  for name, build in trees:
+    try:
+      expected = summarize(recursive_visualizeDFG(ComputationTreeParser(build())))
+    except Exception as e:
+      expected = type(e)
+    try:
+      parser = ComputationTreeParser(build(), share_subexpressions=False, cache=None)
+      parser.visualizeDFG()
+      actual = summarize(parser.visualization_containers)
+    except Exception as e:
+      actual = type(e)
+    assert actual == expected, "visualizeDFG differs from the recursive parser on {}".format(name)
+  print("visualizeDFG matches the recursive parser on {} trees".format(len(trees)))
+
+
+def check_cache():
+  """
+  A tree parsed from the cache must match an uncached parse, after renaming
+  """
+  def renamed(summary):
+    return re.sub(r"(['-])v(\d)", r"\1w\2", repr(summary))
+
+  cache = ParseCache()
+  for seed in range(50):
+    for num_nodes in [10, 50, 1000]:
+      expected = ComputationTreeParser(random_tree(num_nodes, seed=seed), cache=None)
+      expected.visualizeDFG()
+      ComputationTreeParser(random_tree(num_nodes, seed=seed), cache=cache).visualizeDFG()
+      actual = ComputationTreeParser(random_tree(num_nodes, seed=seed, prefix='w'), cache=cache)
+      actual.visualizeDFG()
+      assert repr(summarize(actual.visualization_containers)) == renamed(summarize(expected.visualization_containers)), "cached parse differs on seed {}".format(seed)
+  print("cached parses match uncached parses, cache stats: {}".format(cache.stats()))
+
+
+def time_cache(name, build, count):
+  trees = [build(i) for i in range(count)]
+  timings = []
+  for cache in [ParseCache(), None]:
+    start = time.perf_counter()
+    for tree in trees:
+      ComputationTreeParser(tree, cache=cache).visualizeDFG()
+    timings.append(time.perf_counter() - start)
+  print("{:<24} cached {:8.3f}s   uncached {:8.3f}s".format(name, timings[0], timings[1]))
+
+
+def time_parse(name, build, reference=True):
+  tree = build()
+  parser = ComputationTreeParser(tree, cache=None)
+  start = time.perf_counter()
+  parser.visualizeDFG()
+  elapsed = time.perf_counter() - start
+  line = "{:<24} iterative {:8.3f}s".format(name, elapsed)
+  if reference:
+    start = time.perf_counter()
+    try:
+      recursive_visualizeDFG(ComputationTreeParser(tree))
+      line += "   recursive {:8.3f}s".format(time.perf_counter() - start)
+    except RecursionError:
+      line += "   recursive RecursionError"
+  print(line)
+
+
+def time_sharing(name, build):
+  tree = build()
+  for share in [False, True]:
+    parser = ComputationTreeParser(tree, share_subexpressions=share, cache=None)
+    start = time.perf_counter()
+    parser.visualizeDFG()
+    elapsed = time.perf_counter() - start
+    print("{:<24} share_subexpressions={:<5} {:8.3f}s {:6d} containers".format(name, str(share), elapsed, len(parser.visualization_containers)))
+
+
+def time_incremental(name, build, num_edits=20, seed=0):
+  """
+  Times re-parsing after an edit to a random node, with an IncrementalParser
+  against a full parse.  Setting a node's function type re-resolves its path
+  to the root even if the type stays the same.
+  """
+  tree = build()
+  start = time.perf_counter()
+  ComputationTreeParser(tree, share_subexpressions=False, cache=None).visualizeDFG()
+  full = time.perf_counter() - start
+
+  parser = IncrementalParser(tree)
+  start = time.perf_counter()
+  parser.visualizeDFG()
+  initial = time.perf_counter() - start
+
+  rng = random.Random(seed)
+  nodes = list(parser.labels)
+  start = time.perf_counter()
+  for _ in range(num_edits):
+    node = rng.choice(nodes)
+    parser.set_function_type(node, node.function_type)
+    parser.visualizeDFG()
+  edit = (time.perf_counter() - start) / num_edits
+  print("{:<24} full parse {:8.3f}s   incremental first parse {:8.3f}s   per edit {:8.4f}s".format(name, full, initial, edit))
+
+
+if __name__ == '__main__':
+  check_equivalence()
+  check_cache()
+  time_cache('1000 r2 trees', lambda i: r2_tree('_model{}'.format(i)), 1000)
+  time_cache('100 random x 2k nodes', lambda i: random_tree(2000, prefix='model{}_'.format(i)), 100)
+  time_sharing('dashboard 1k metrics', lambda: dashboard_tree(1000))
+  time_parse('random 10k', lambda: random_tree(10000))
+  time_parse('chain 2k', lambda: chain_tree(2000))
+  time_parse('wide 10k', lambda: wide_tree(10000))
+  time_parse('random 100k', lambda: random_tree(100000), reference=False)
+  time_parse('chain 100k', lambda: chain_tree(100000), reference=False)
+  time_parse('wide 100k', lambda: wide_tree(100000), reference=False)
+  time_incremental('random 100k', lambda: random_tree(100000))
+  time_incremental('chain 5k', lambda: chain_tree(5000))
+  time_incremental('wide 10k', lambda: wide_tree(10000))
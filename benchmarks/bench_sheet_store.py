@@ -0,0 +1,58 @@
+"""
+Benchmarks reading a sheet of num_rows rows into a SheetStore, in memory
+and kept on disk, and then resolving a column range of it, against the
+client sending the same range as a JSON list.
+
+  python -m benchmarks.bench_sheet_store [num_rows]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from specmetric.sheet_store import SheetStore
+
+
+def write_sheet(path, num_rows):
+  rng = np.random.default_rng(0)
+  majors = np.array(list('ABCDEF'))[rng.integers(0, 6, num_rows)]
+  counts = rng.integers(0, 1000, num_rows)
+  shares = rng.random(num_rows).round(4)
+  with open(path, 'w') as fp:
+    fp.write('Major,Count,Share\n')
+    for row in zip(majors, counts, shares):
+      fp.write('{},{},{}\n'.format(*row))
+
+
+def timed(f):
+  start = time.perf_counter()
+  result = f()
+  return (time.perf_counter() - start, result)
+
+
+if __name__ == '__main__':
+  num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'sheet.csv')
+    write_sheet(path, num_rows)
+    address = 'C2:C{}'.format(num_rows + 1)
+    print("{} rows, {:.1f}MB of CSV".format(num_rows, os.path.getsize(path) / 1e6))
+
+    (seconds, sheet) = timed(lambda: SheetStore.from_csv(path))
+    print("  read into memory          {:>8.3f}s".format(seconds))
+    (seconds, _) = timed(lambda: SheetStore.from_csv(path, directory=os.path.join(directory, 'sheets')))
+    print("  read and kept on disk     {:>8.3f}s".format(seconds))
+    (seconds, sheet) = timed(lambda: SheetStore.from_csv(path, directory=os.path.join(directory, 'sheets')))
+    print("  mapped back from disk     {:>8.3f}s   (hashing the CSV included)".format(seconds))
+
+    (seconds, values) = timed(lambda: sheet.resolve(address))
+    print("  resolve {:<17} {:>8.6f}s   numbers {}".format(address, seconds, values.dtype))
+    (seconds, values) = timed(lambda: sheet.resolve('A2:A{}'.format(num_rows + 1)))
+    print("  resolve the text column   {:>8.3f}s".format(seconds))
+
+    body = json.dumps(sheet.resolve(address).tolist())
+    (seconds, _) = timed(lambda: json.loads(body))
+    print("  the range sent as JSON    {:>8.3f}s to parse, {:.1f}MB".format(seconds, len(body) / 1e6))
@@ -0,0 +1,75 @@
+"""
+Benchmarks the batched treemap layout (treemap.squarify_bars) against the
+squarify package, one bar at a time, and checks that the rectangles are bit
+for bit the same.
+
+  python -m benchmarks.bench_treemap
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import squarify
+
+from specmetric.position_calculators.treemap import squarify_bars
+
+
+def reference_squarify_within_bar(ids, values, width, height, pad=True):
+  """
+  squarify_within_bar as it was written on the squarify package, with its
+  values sorted largest first, kept as a reference
+  """
+  df = pd.Series(data=values, index=ids).sort_values(ascending=False, kind='stable')
+  sizes = squarify.normalize_sizes(df.values, width, height)
+  if pad:
+    rects = squarify.padded_squarify(sizes, 0, 0, width, height)
+  else:
+    rects = squarify.squarify(sizes, 0, 0, width, height)
+  return pd.DataFrame(rects, index=df.index)
+
+
+def make_bars(num_values, num_bars, seed=0):
+  rng = np.random.default_rng(seed)
+  # rounded, so there are plenty of ties
+  return [np.round(rng.exponential(50, num_values), 1) + 0.1 for _ in range(num_bars)]
+
+
+def check_reference(num_values, num_bars=3, width=50, height=100):
+  bars = make_bars(num_values, num_bars)
+  ids = np.arange(num_values)
+  start = time.perf_counter()
+  expected = [reference_squarify_within_bar(ids, values, width, height) for values in bars]
+  reference_time = time.perf_counter() - start
+  start = time.perf_counter()
+  rects = squarify_bars(bars, width, height)
+  batched_time = time.perf_counter() - start
+
+  for (bar, squares) in enumerate(expected):
+    actual = rects[rects['bar'] == bar]
+    matches = [np.array_equal(squares[column].to_numpy(), actual[column]) for column in ['x', 'y', 'dx', 'dy']]
+    matches.append(np.array_equal(squares.index.to_numpy(), ids[actual['index']]))
+    if not all(matches):
+      print("MISMATCH for {} values, bar {}".format(num_values, bar))
+      sys.exit(1)
+  print("{:>8} values x {} bars   squarify {:>8.3f}s   batched {:>8.4f}s   identical".format(num_values, num_bars, reference_time, batched_time))
+
+
+def time_layout(num_values, num_bars, repeat=3):
+  bars = make_bars(num_values, num_bars, seed=num_values)
+  heights = np.linspace(50, 400, num_bars)
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    squarify_bars(bars, 50, heights)
+    best = min(best, time.perf_counter() - start)
+  print("{:>8} values x {} bars   {:>8.3f}s   ({:.0f} ns per value)".format(num_values, num_bars, best, best / (num_values * num_bars) * 1e9))
+
+
+if __name__ == '__main__':
+  # squarify recurses once per row, so it is only run on small enough bars
+  sys.setrecursionlimit(100000)
+  for num_values in [100, 1000, 10000]:
+    check_reference(num_values)
+  for num_values in [1000, 10000, 50000, 1000000]:
+    time_layout(num_values, num_bars=4)
@@ -0,0 +1,56 @@
+"""
+Benchmarks end-to-end spec generation (convert_to_charts, then to_json) with
+AltairRenderer and VegaLiteRenderer: the time it takes, and the peak memory
+allocated along the way, on the chart types of the renderer tests.
+
+  python -m benchmarks.bench_vegalite [num_values]
+"""
+import sys
+import time
+import tracemalloc
+
+from specmetric.renderer import AltairRenderer, VegaLiteRenderer
+from specmetric.position_calculators.layout_cache import LayoutCache
+from benchmarks.bench_parallel_charts import make_dashboard
+
+
+def spec_generation(renderer_class, containers, data_dict):
+  # the same (warm) layouts for both, so only the spec building differs
+  renderer = renderer_class(containers, data_dict, layout_cache=layout_cache)
+  return renderer.convert_to_charts().to_json()
+
+
+def time_spec_generation(renderer_class, containers, data_dict, repeat=3):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    spec_generation(renderer_class, containers, data_dict)
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def peak_allocations(renderer_class, containers, data_dict):
+  tracemalloc.start()
+  spec_generation(renderer_class, containers, data_dict)
+  (_, peak) = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return peak
+
+
+layout_cache = LayoutCache()
+
+if __name__ == '__main__':
+  sizes = [int(sys.argv[1])] if len(sys.argv) > 1 else [100, 2000, 20000]
+  for num_values in sizes:
+    (containers, data_dict) = make_dashboard(20, num_values)
+    spec_generation(AltairRenderer, containers, data_dict)
+    results = {}
+    for renderer_class in (AltairRenderer, VegaLiteRenderer):
+      results[renderer_class] = (
+        time_spec_generation(renderer_class, containers, data_dict),
+        peak_allocations(renderer_class, containers, data_dict)
+      )
+    (altair_time, altair_peak) = results[AltairRenderer]
+    (vegalite_time, vegalite_peak) = results[VegaLiteRenderer]
+    print("20 containers x {:>6} values   altair {:>7.3f}s {:>7.1f}MB   vegalite {:>7.3f}s {:>7.1f}MB   {:>5.1f}x faster".format(
+      num_values, altair_time, altair_peak / 1e6, vegalite_time, vegalite_peak / 1e6, altair_time / vegalite_time))
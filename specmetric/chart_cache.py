@@ -0,0 +1,103 @@
+"""
+Charts of visualization containers, kept between renders.
+
+A container's charts only depend on what kind of chart it is, its
+encodings, the renderer's input variables and the columns it reads, so
+when one cell of a sheet changes, the charts of every container that doesn't
+read it can be reused as they are.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from specmetric.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+class ChartCache:
+  """
+  LRU of up to maxsize containers' charts, keyed by chart_key
+  """
+
+  def __init__(self, maxsize=64):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __getstate__(self):
+    # a copy sent to another process starts out empty
+    return {'maxsize': self.maxsize}
+
+  def __setstate__(self, state):
+    self.__init__(**state)
+
+  def get(self, key):
+    with self._lock:
+      charts = self._entries.get(key)
+      if charts is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._entries.move_to_end(key)
+      return list(charts)
+
+  def put(self, key, charts):
+    with self._lock:
+      self._entries[key] = tuple(charts)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'size': len(self._entries),
+      'maxsize': self.maxsize,
+      'hit_rate': (self.hits / lookups) if lookups else 0.0
+    }
+
+
+def chart_key(backend, valid_chart, encodings, input_vars, column_fingerprints, extra=None):
+  """
+  Fingerprint of everything a container's charts are built from:
+  column_fingerprints maps the names of the columns it reads (or None for
+  names that aren't there) to column_fingerprint of each, and extra is
+  anything else they depend on, as JSON
+  """
+  digest = hashlib.blake2b(digest_size=20)
+  digest.update(json.dumps([backend, valid_chart, encodings, list(input_vars), extra], sort_keys=True, default=repr).encode('utf-8'))
+  for name in sorted(column_fingerprints):
+    digest.update(repr((name, column_fingerprints[name])).encode('utf-8'))
+  return digest.hexdigest()
+
+
+def column_fingerprint(column):
+  """
+  Fingerprint of a Column's values and which of them are blank
+  """
+  values = np.ascontiguousarray(column.values)
+  digest = hashlib.blake2b(digest_size=20)
+  digest.update(repr((values.dtype.str, values.shape)).encode('utf-8'))
+  digest.update(values.data if values.dtype.kind != 'O' else repr(values.tolist()).encode('utf-8'))
+  if column.valid is not None:
+    digest.update(b'valid')
+    digest.update(np.packbits(column.valid).data)
+  return digest.hexdigest()
@@ -0,0 +1,201 @@
+"""
+Columns for a renderer's data_dict that are only loaded when a chart uses
+them.
+
+A ColumnStore is a read-only mapping from variable names to columns.  It
+holds on to where each column comes from, and loads it the first time it is
+looked up, which AltairRenderer only does for the variables a container
+encodes (and ids and input variables).  Loaded columns are kept up to a
+memory budget, least recently used first out.
+
+Columns come from
+  - columns: a dict of names to values, or to functions of no arguments
+    that return the values, like NpyColumn
+  - providers: objects with names() and load(name), for files that hold many
+    columns, like ParquetColumns, FeatherColumns and CsvColumns
+"""
+from collections import OrderedDict
+from collections.abc import Mapping
+import threading
+
+from specmetric.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+class ColumnStore(Mapping):
+  """
+  Mapping of names to columns, loaded from columns or providers on first
+  lookup and kept while they fit in memory_budget bytes
+  """
+
+  def __init__(self, columns=None, providers=(), memory_budget=512 * 1024 * 1024):
+    self.sources = dict(columns or {})
+    self.providers = list(providers)
+    self.memory_budget = memory_budget
+    self.hits = 0
+    self.loads = 0
+    self.evictions = 0
+    self._loaded = OrderedDict()
+    self._loaded_bytes = 0
+    self._provider_names = None
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    # a copy sent to another process loads its own columns
+    return {'columns': self.sources, 'providers': self.providers, 'memory_budget': self.memory_budget}
+
+  def __setstate__(self, state):
+    self.__init__(**state)
+
+  def __getitem__(self, name):
+    with self._lock:
+      if name in self._loaded:
+        self.hits += 1
+        self._loaded.move_to_end(name)
+        return self._loaded[name][0]
+      values = self._load(name)
+      self.loads += 1
+      size = column_bytes(values)
+      self._loaded[name] = (values, size)
+      self._loaded_bytes += size
+      # the column just loaded stays, even if it is over budget on its own
+      while self._loaded_bytes > self.memory_budget and len(self._loaded) > 1:
+        (_, (_, evicted_size)) = self._loaded.popitem(last=False)
+        self._loaded_bytes -= evicted_size
+        self.evictions += 1
+      return values
+
+  def __contains__(self, name):
+    # without loading anything
+    return name in self.sources or name in self._names_by_provider()
+
+  def __iter__(self):
+    yield from self.sources
+    for name in self._names_by_provider():
+      if name not in self.sources:
+        yield name
+
+  def __len__(self):
+    return len(set(self.sources) | set(self._names_by_provider()))
+
+  def loaded(self):
+    """
+    Names of the columns in memory, least recently used first
+    """
+    return list(self._loaded)
+
+  def stats(self):
+    lookups = self.hits + self.loads
+    return {
+      'hits': self.hits,
+      'loads': self.loads,
+      'evictions': self.evictions,
+      'size': len(self._loaded),
+      'bytes': self._loaded_bytes,
+      'memory_budget': self.memory_budget,
+      'hit_rate': (self.hits / lookups) if lookups else 0.0
+    }
+
+  def _names_by_provider(self):
+    if self._provider_names is None:
+      names = {}
+      for provider in self.providers:
+        for name in provider.names():
+          # the first provider of a name wins
+          names.setdefault(name, provider)
+      self._provider_names = names
+    return self._provider_names
+
+  def _load(self, name):
+    if name in self.sources:
+      source = self.sources[name]
+      return source() if callable(source) else source
+    provider = self._names_by_provider().get(name)
+    if provider is None:
+      raise KeyError(name)
+    return provider.load(name)
+
+
+def column_bytes(values):
+  """
+  Memory held by values.  Memory mapped arrays count for nothing, since the
+  operating system can drop their pages whenever it needs to.
+  """
+  if isinstance(values, np.memmap) or (isinstance(values, np.ndarray) and isinstance(values.base, np.memmap)):
+    return 0
+  size = getattr(values, 'nbytes', None)
+  if size is not None:
+    return int(size)
+  # a list, by its pointers and (at least) a float or small string each
+  return 32 * len(values)
+
+
+class NpyColumn:
+  """
+  A column saved with numpy.save, memory mapped rather than read
+  """
+
+  def __init__(self, path):
+    self.path = path
+
+  def __call__(self):
+    return np.load(self.path, mmap_mode='r')
+
+
+class ParquetColumns:
+  """
+  The columns of a Parquet file, each read on its own (needs pyarrow)
+  """
+
+  def __init__(self, path):
+    self.path = path
+
+  def names(self):
+    import pyarrow.parquet as pq
+    return pq.read_schema(self.path).names
+
+  def load(self, name):
+    import pyarrow.parquet as pq
+    return pq.read_table(self.path, columns=[name], memory_map=True).column(name)
+
+
+class FeatherColumns:
+  """
+  The columns of a Feather (Arrow IPC) file, each read on its own, and
+  memory mapped if the file is not compressed (needs pyarrow)
+  """
+
+  def __init__(self, path):
+    self.path = path
+
+  def names(self):
+    import pyarrow as pa
+    with pa.memory_map(self.path) as source:
+      return pa.ipc.open_file(source).schema.names
+
+  def load(self, name):
+    import pyarrow.feather as feather
+    return feather.read_table(self.path, columns=[name], memory_map=True).column(name)
+
+
+class CsvColumns:
+  """
+  The columns of a CSV file with a header row, each parsed on its own, and
+  only for data rows start to stop (counting from 0, after the header)
+  """
+
+  def __init__(self, path, start=0, stop=None, **read_csv_options):
+    self.path = path
+    self.start = start
+    self.stop = stop
+    self.read_csv_options = read_csv_options
+
+  def names(self):
+    return [str(name) for name in pd.read_csv(self.path, nrows=0, **self.read_csv_options).columns]
+
+  def load(self, name):
+    nrows = None if self.stop is None else max(self.stop - self.start, 0)
+    skiprows = range(1, self.start + 1) if self.start else None
+    data = pd.read_csv(self.path, usecols=[name], skiprows=skiprows, nrows=nrows, **self.read_csv_options)
+    return data[name].to_numpy()
@@ -0,0 +1,142 @@
+"""
+Columns of a renderer's data_dict.
+
+data_dict values can be lists, NumPy arrays, masked arrays, pandas Series or
+Arrow arrays.  column() wraps each of them as a Column: an array of values
+and a validity mask saying which of them are there at all.  Arrays are used
+as they are, masked and Arrow arrays through their data buffers, so nothing
+is turned into Python objects until a chart's dataset is written out.
+
+An entry is blank if it is masked, null, NaN, None or an empty string (the
+header and empty cells of a spreadsheet column).
+"""
+from specmetric.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+class Column:
+  """
+  values, a 1-d array, with valid, a boolean array of the entries that are
+  not blank, or None if none of them are
+  """
+
+  __slots__ = ('values', 'valid')
+
+  def __init__(self, values, valid=None):
+    self.values = values
+    self.valid = valid
+
+  def __len__(self):
+    return len(self.values)
+
+  def compress(self, valid=None):
+    """
+    The values where valid (by default, the column's own valid) is true.
+    Values of an object column are given the type they have in common once
+    blanks are gone, so ['', 1, 2] compresses to integers.
+    """
+    valid = self.valid if valid is None else valid
+    values = self.values if valid is None else self.values[valid]
+    if values.dtype.kind == 'O':
+      values = pd.Series(values, dtype=object, copy=False).infer_objects().to_numpy()
+    return values
+
+  def rows(self, positions):
+    """
+    Rows of the column at positions among its valid values, as in compress()
+    """
+    return positions if self.valid is None else np.flatnonzero(self.valid)[positions]
+
+  def filled(self, rows=None):
+    """
+    The values at rows (by default, all of them), with blanks as NaN in
+    numeric columns and None in any other
+    """
+    values = self.values if rows is None else self.values[rows]
+    if self.valid is None:
+      return values
+    valid = self.valid if rows is None else self.valid[rows]
+    if valid.all():
+      return values
+    if values.dtype.kind in 'iubf':
+      values = values.astype(float)
+      values[~valid] = np.nan
+    else:
+      values = values.astype(object)
+      values[~valid] = None
+    return values
+
+  def numbers(self):
+    """
+    The values as floats, with blanks and anything that isn't a number (a
+    column's header, say) as NaN
+    """
+    values = self.filled()
+    if values.dtype.kind in 'iubf':
+      return values.astype(float, copy=False)
+    return pd.to_numeric(pd.Series(values, dtype=object, copy=False), errors='coerce').to_numpy(dtype=float)
+
+
+def column(values):
+  """
+  values, a data_dict entry, as a Column
+  """
+  if isinstance(values, Column):
+    return values
+  if isinstance(values, np.ma.MaskedArray):
+    mask = np.ma.getmask(values)
+    data = values.data
+    valid = None if (mask is np.ma.nomask or not mask.any()) else ~mask
+    return Column(data, _both(valid, _not_blank(data)))
+  if _is_arrow(values):
+    if hasattr(values, 'combine_chunks'):
+      # a ChunkedArray, which is only copied if it has several chunks
+      values = values.chunk(0) if values.num_chunks == 1 else values.combine_chunks()
+    # zero copy unless there are nulls, or the values are not numbers
+    data = values.to_numpy(zero_copy_only=False)
+    valid = None if values.null_count == 0 else values.is_valid().to_numpy(zero_copy_only=False)
+    return Column(data, _both(valid, _not_blank(data)))
+  if not isinstance(values, np.ndarray):
+    # a Series infers the type of a list without turning mixed numbers and
+    # strings into strings, like an array would
+    values = pd.Series(values).to_numpy()
+  return Column(values, _not_blank(values))
+
+
+def all_valid(*columns):
+  """
+  Mask of the rows that are valid in every one of columns, which line up row
+  by row, or None if every row is
+  """
+  if len(set(len(c) for c in columns)) > 1:
+    raise ValueError("Columns of different lengths can't be lined up row by row")
+  valid = None
+  for c in columns:
+    valid = _both(valid, c.valid)
+  return valid
+
+
+def _both(valid, other):
+  if valid is None:
+    return other
+  if other is None:
+    return valid
+  return valid & other
+
+
+def _not_blank(values):
+  if values.dtype.kind in 'fc':
+    blank = np.isnan(values)
+  elif values.dtype.kind == 'O':
+    blank = pd.isna(values) | (values == '')
+  elif values.dtype.kind == 'U':
+    blank = values == ''
+  else:
+    return None
+  return ~blank if blank.any() else None
+
+
+def _is_arrow(values):
+  # without importing pyarrow, which is optional
+  return type(values).__module__.split('.')[0] == 'pyarrow'
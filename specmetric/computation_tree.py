@@ -1,4 +1,8 @@
 import uuid
+from specmetric.lazy_import import lazy_import
+
+# only ComputationGraph needs numpy
+np = lazy_import('numpy')
 
 class ComputationNode:
   """
@@ -41,3 +45,202 @@ class ComputationNode:
     return len(self.children) == 0
 
 
+
+
+class ComputationGraph:
+  """
+  ComputationGraph is a compact, array-backed computation graph.  Nodes are
+  integer ids, function types are interned into a table of codes, and the
+  children of each node are stored in CSR form: the children of node i are
+  child_ids[child_offsets[i]:child_offsets[i + 1]], in the order they were
+  given.
+
+  Graphs are built in bulk with from_records or from_edge_list, which accept
+  nodes in any order.  graph.node(i) returns a ComputationNodeView that can be
+  used anywhere a ComputationNode is expected, e.g. as the root passed to
+  ComputationTreeParser.
+  """
+
+  def __init__(self, names, function_types, function_codes, parents, child_offsets, child_ids, input_data=None, output_data=None):
+    # nodes without data share one (immutable) empty tuple
+    if input_data is None:
+      input_data = [()] * len(names)
+
+    if output_data is None:
+      output_data = [()] * len(names)
+
+    self.names = names
+    self.function_types = function_types
+    self.function_codes = function_codes
+    self.parents = parents
+    self.child_offsets = child_offsets
+    self.child_ids = child_ids
+    self.input_data = input_data
+    self.output_data = output_data
+    self.uuid = uuid.uuid4()
+    self._name_ids = None
+
+  def __len__(self):
+    return len(self.names)
+
+  def __str__(self):
+    return "ComputationGraph(nodes: " + str(len(self)) + ", function_types: " + str(len(self.function_types)) + ")"
+
+  @classmethod
+  def from_records(cls, records, name='name', parent='parent', function_type='function_type', input_data='input_data', output_data='output_data'):
+    """
+    Builds a graph from a list of dicts, one per node, where the parent of each
+    node is referred to by name (None for the root).  Records can be in any
+    order.  The keys used for each field can be overridden, e.g. the
+    spreadsheet app sends function_type='function'.
+    """
+    names = [r[name] for r in records]
+    parent_names = [r.get(parent) for r in records]
+    function_types = [r[function_type] for r in records]
+    inputs = [r.get(input_data, ()) for r in records]
+    outputs = [r.get(output_data, ()) for r in records]
+
+    has_parent = np.fromiter((p is not None for p in parent_names), dtype=bool, count=len(records))
+    child_ids = np.flatnonzero(has_parent)
+    graph = cls._build(names, function_types, inputs, outputs)
+    parent_ids = graph.index([parent_names[i] for i in child_ids])
+    return graph._link(parent_ids, child_ids)
+
+  @classmethod
+  def from_edge_list(cls, names, function_types, edges, input_data=None, output_data=None):
+    """
+    Builds a graph from per-node arrays and a list of (parent, child) edges.
+    Edges may be given as integer node ids or as node names.  The children of
+    each node keep the order in which their edges appear.
+    """
+    edges = np.asarray(edges)
+    if edges.size == 0:
+      edges = np.empty((0, 2), dtype=np.int64)
+
+    graph = cls._build(names, function_types, input_data, output_data)
+    if edges.dtype.kind in 'iu':
+      parent_ids, child_ids = edges[:, 0], edges[:, 1]
+    else:
+      parent_ids, child_ids = graph.index(edges[:, 0]), graph.index(edges[:, 1])
+    return graph._link(parent_ids, child_ids)
+
+  @classmethod
+  def _build(cls, names, function_types, input_data, output_data):
+    # intern the function types, so each node only stores a small integer code
+    function_table = {}
+    function_codes = np.fromiter((function_table.setdefault(f, len(function_table)) for f in function_types), dtype=np.int32, count=len(names))
+    return cls(list(names), tuple(function_table), function_codes, None, None, None, input_data, output_data)
+
+  def _link(self, parent_ids, child_ids):
+    num_nodes = len(self)
+    parent_ids = np.asarray(parent_ids, dtype=np.int32)
+    child_ids = np.asarray(child_ids, dtype=np.int32)
+
+    # a node shared by several parents (a DAG) records the parent of its last edge
+    parents = np.full(num_nodes, -1, dtype=np.int32)
+    parents[child_ids] = parent_ids
+
+    # CSR children: stable sort on the parent keeps the given child order
+    edge_order = np.argsort(parent_ids, kind='stable')
+    self.parents = parents
+    self.child_ids = child_ids[edge_order]
+    self.child_offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(parent_ids, minlength=num_nodes), out=self.child_offsets[1:])
+    # the name index is only needed while linking, so we don't keep it around
+    self._name_ids = None
+    return self
+
+  def index(self, names):
+    """
+    Returns the node ids for a list of names.  If a name is used by more than
+    one node, it refers to the last of them.
+    """
+    if self._name_ids is None:
+      self._name_ids = dict(zip(self.names, range(len(self.names))))
+
+    name_ids = self._name_ids
+    return np.fromiter((name_ids[n] for n in names), dtype=np.int64, count=len(names))
+
+  def function_type(self, node_id):
+    return self.function_types[self.function_codes[node_id]]
+
+  def children(self, node_id):
+    return self.child_ids[self.child_offsets[node_id]:self.child_offsets[node_id + 1]]
+
+  def is_leaf(self, node_id):
+    return self.child_offsets[node_id] == self.child_offsets[node_id + 1]
+
+  def roots(self):
+    return np.flatnonzero(self.parents < 0)
+
+  def node(self, node_id):
+    return ComputationNodeView(self, int(node_id))
+
+  def root(self):
+    """
+    Returns a view of the root node, if the graph has exactly one
+    """
+    roots = self.roots()
+    if len(roots) != 1:
+      raise ValueError("ComputationGraph has {} roots, expected 1".format(len(roots)))
+    return self.node(roots[0])
+
+  def nbytes(self):
+    """
+    Bytes used by the graph's arrays (excluding the names and data lists)
+    """
+    return self.function_codes.nbytes + self.parents.nbytes + self.child_offsets.nbytes + self.child_ids.nbytes
+
+
+class ComputationNodeView:
+  """
+  Lightweight view of a single node of a ComputationGraph, with the same
+  read interface as ComputationNode.  Views are created on demand and compare
+  equal if they refer to the same node of the same graph.
+  """
+  __slots__ = ('graph', 'node_id')
+
+  def __init__(self, graph, node_id):
+    self.graph = graph
+    self.node_id = node_id
+
+  def __eq__(self, other):
+    return isinstance(other, ComputationNodeView) and self.graph is other.graph and self.node_id == other.node_id
+
+  def __hash__(self):
+    return hash((id(self.graph), self.node_id))
+
+  def __str__(self):
+    return "ComputationNode(name: " + str(self.name) + ", function_type: " + self.function_type + ")"
+
+  @property
+  def name(self):
+    return self.graph.names[self.node_id]
+
+  @property
+  def function_type(self):
+    return self.graph.function_type(self.node_id)
+
+  @property
+  def input_data(self):
+    return self.graph.input_data[self.node_id]
+
+  @property
+  def output_data(self):
+    return self.graph.output_data[self.node_id]
+
+  @property
+  def uuid(self):
+    return uuid.UUID(int=(self.graph.uuid.int + self.node_id) % (1 << 128))
+
+  @property
+  def parent_node(self):
+    parent = self.graph.parents[self.node_id]
+    return self.graph.node(parent) if parent >= 0 else None
+
+  @property
+  def children(self):
+    return [ComputationNodeView(self.graph, int(c)) for c in self.graph.children(self.node_id)]
+
+  def is_leaf(self):
+    return bool(self.graph.is_leaf(self.node_id))
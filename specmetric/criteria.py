@@ -0,0 +1,259 @@
+"""
+COUNTIF criteria, evaluated over whole columns at once.
+
+A COUNTIF(S) is written as pairs of a range and a criterion, e.g.
+['A2:A2001', 'E8', 'C2:C2001', '"Yes"'] (see specmetric.formula).  Each
+criterion is compiled into a Criterion once, and its mask over a column is
+a NumPy comparison for numeric columns, or for any other, a comparison of
+the column's distinct values broadcast back to its rows.  Masks are kept in
+a MaskCache by (fingerprint of the column, criterion), and the masks of a
+COUNTIFS are combined with &.
+
+Criteria are matched the way spreadsheets do:
+  - a number, or text that reads as one ('5', '>=5', '<>5'), compares with
+    the numbers of the column
+  - other text ('Yes', '<>Yes', 'B*', '?ear', '>m') compares with its text,
+    ignoring case, with * and ? as wildcards in = and <> (~ escapes them)
+  - '' or '=' matches blanks and '<>' anything but blanks
+"""
+from collections import OrderedDict
+import math
+import operator
+import re
+import threading
+
+from specmetric.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+_OPERATORS = {
+  '=': operator.eq,
+  '<>': operator.ne,
+  '<': operator.lt,
+  '<=': operator.le,
+  '>': operator.gt,
+  '>=': operator.ge,
+}
+
+_CRITERION = re.compile(r"\A(<>|<=|>=|<|>|=)?(.*)\Z", re.DOTALL)
+
+
+class Criterion:
+  """
+  A compiled criterion: its operator, and operand, a float, text, or ''
+  for blanks
+  """
+
+  __slots__ = ('operator', 'operand', 'pattern')
+
+  def __init__(self, criterion):
+    if isinstance(criterion, (int, float, np.number)) and not isinstance(criterion, bool):
+      (self.operator, operand) = ('=', float(criterion))
+    else:
+      (operator_text, text) = _CRITERION.match('' if criterion is None else str(criterion)).groups()
+      self.operator = operator_text or '='
+      operand = _number(text.strip())
+      if operand is None:
+        operand = text
+    self.operand = operand
+    self.pattern = None
+    if isinstance(operand, str) and operand and self.operator in ('=', '<>'):
+      self.pattern = re.compile(_wildcard_regex(operand), re.IGNORECASE | re.DOTALL)
+
+  @property
+  def key(self):
+    return (self.operator, self.operand)
+
+  def __str__(self):
+    return self.operator + (self.operand if isinstance(self.operand, str) else '{:g}'.format(self.operand))
+
+  def __repr__(self):
+    return 'Criterion({!r})'.format(str(self))
+
+  def describe(self, subject):
+    """
+    The criterion in words, applied to subject: 'a is "Yes"', 'a > 5',
+    'a is not blank'
+    """
+    if self.operand == '':
+      operand = 'blank'
+    elif isinstance(self.operand, str):
+      operand = '"{}"'.format(self.operand)
+    else:
+      operand = '{:g}'.format(self.operand)
+    operator = {'=': 'is', '<>': 'is not'}.get(self.operator, self.operator)
+    return '{} {} {}'.format(subject, operator, operand)
+
+  def matches(self, value):
+    """
+    Whether a single value meets the criterion
+    """
+    blank = value is None or (isinstance(value, str) and value == '') or (isinstance(value, float) and math.isnan(value))
+    if self.operand == '':
+      return blank if self.operator == '=' else (not blank if self.operator == '<>' else False)
+    if blank:
+      return self.operator == '<>'
+    if isinstance(self.operand, float):
+      if isinstance(value, bool) or not isinstance(value, (int, float, np.number)):
+        return self.operator == '<>'
+      return bool(_OPERATORS[self.operator](float(value), self.operand))
+    if not isinstance(value, str):
+      return self.operator == '<>'
+    if self.pattern is not None:
+      return (self.pattern.fullmatch(value) is not None) == (self.operator == '=')
+    return _OPERATORS[self.operator](value.lower(), self.operand.lower())
+
+  def mask(self, column):
+    """
+    Boolean array of the entries of column (a specmetric.columns.Column)
+    that meet the criterion
+    """
+    values = column.values
+    blank = np.zeros(len(values), dtype=bool) if column.valid is None else ~column.valid
+    if values.dtype.kind in 'iuf':
+      if self.operand == '':
+        return blank.copy() if self.operator == '=' else (~blank if self.operator == '<>' else np.zeros(len(values), dtype=bool))
+      if not isinstance(self.operand, float):
+        # numbers and blanks are never text
+        return np.full(len(values), self.operator == '<>')
+      with np.errstate(invalid='ignore'):
+        mask = np.asarray(_OPERATORS[self.operator](values, self.operand))
+      mask[blank] = self.operator == '<>'
+      return mask
+    # anything else by its distinct values, of which a sheet's text columns
+    # have few
+    (codes, uniques) = pd.factorize(values)
+    matched = np.fromiter((self.matches(u) for u in uniques), dtype=bool, count=len(uniques))
+    # code -1 is None or NaN
+    mask = np.append(matched, self.matches(None))[codes]
+    mask[blank] = self.matches(None)
+    return mask
+
+
+def _number(text):
+  if text.endswith('%'):
+    number = _number(text[:-1])
+    return None if number is None else number / 100
+  try:
+    number = float(text)
+  except ValueError:
+    return None
+  return None if math.isnan(number) else number
+
+def _wildcard_regex(text):
+  parts = []
+  i = 0
+  while i < len(text):
+    c = text[i]
+    if c == '~' and i + 1 < len(text) and text[i + 1] in '*?~':
+      parts.append(re.escape(text[i + 1]))
+      i += 2
+      continue
+    parts.append('.*' if c == '*' else ('.' if c == '?' else re.escape(c)))
+    i += 1
+  return ''.join(parts)
+
+
+def criterion_value(name, data_dict):
+  """
+  The criterion a COUNTIF argument stands for: the value of the cell it
+  names, or the constant it is
+  """
+  if name in data_dict:
+    value = data_dict[name]
+    if isinstance(value, (list, tuple)) or (isinstance(value, np.ndarray) and value.ndim):
+      value = value[0] if len(value) == 1 else None
+    return value.item() if isinstance(value, np.generic) else value
+  text = name.strip() if isinstance(name, str) else name
+  if isinstance(text, str) and len(text) >= 2 and text[0] == text[-1] == '"':
+    return text[1:-1].replace('""', '"')
+  return text
+
+
+class MaskCache:
+  """
+  LRU cache of criterion masks, by the fingerprint of their column and
+  their criterion's key
+  """
+
+  def __init__(self, maxsize=256):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    with self._lock:
+      mask = self._entries.get(key)
+      if mask is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+        self._entries.move_to_end(key)
+      return mask
+
+  def put(self, key, mask):
+    with self._lock:
+      self._entries[key] = mask
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'size': len(self._entries),
+      'maxsize': self.maxsize,
+      'hit_rate': (self.hits / lookups) if lookups else 0.0
+    }
+
+
+default_mask_cache = MaskCache()
+
+
+def criteria_mask(pairs, column_of, value_of, fingerprint_of=None, cache=None):
+  """
+  Mask of the rows that meet every (range, criterion) pair of pairs, the
+  arguments of a COUNTIFS.  column_of(range) gives a range's Column and
+  value_of(criterion) a criterion's value.  With fingerprint_of(range),
+  masks are looked up in cache (by default, default_mask_cache) first.
+  Raises ValueError if the ranges aren't all as long.
+  """
+  if len(pairs) < 2 or len(pairs) % 2:
+    raise ValueError("criteria come in pairs of a range and a criterion")
+  cache = default_mask_cache if cache is None else cache
+  combined = None
+  for (name, criterion_name) in zip(pairs[::2], pairs[1::2]):
+    criterion = Criterion(value_of(criterion_name))
+    key = None if fingerprint_of is None else (fingerprint_of(name), criterion.key)
+    mask = cache.get(key) if key is not None else None
+    if mask is None:
+      mask = criterion.mask(column_of(name))
+      # cached masks are shared, so they must not be changed
+      mask.flags.writeable = False
+      if key is not None:
+        cache.put(key, mask)
+    if combined is None:
+      combined = mask
+    elif len(mask) != len(combined):
+      raise ValueError("COUNTIFS ranges of different lengths")
+    else:
+      combined = combined & mask
+  return combined
@@ -0,0 +1,458 @@
+"""
+Spreadsheet formulas compiled into computation trees: the node records
+ComputationGraph.from_records(records, function_type='function') takes, as
+the spreadsheet app sends them.
+
+Formulas are parsed once per template.  References are made relative to the
+cell a formula is in (unless they are absolute, with '$'), so a filled-down
+column, '=B2-C2', '=B3-C3', ..., is one template, 'R[0]C[-2]-R[0]C[-1]',
+bound to each of its cells in turn.  Templates are kept in a FormulaCache,
+by that normalized text.
+
+Functions map to the spreadsheet_grammatical_expressions.yml function types
+  SUM(range)               vector_sum, with the range as a vector child
+  AVERAGE(range)           mean
+  ROWS(range)              count
+  COUNTIF(S)(range, criterion, ...)
+                           filter, with each range as a vector child
+  a + b, a - b, a / b      scalar_sum, scalar_diff, scalar_ratio
+Cells used as operands are children, compiled from their own formulas by
+compile_cells; cells without formulas are scalar leaves, and so are
+constants, whose records also have their 'value'.  COUNTIF records also
+have their 'criteria', the range and criterion pairs as written.  Anything else
+(other functions, '*', '^', ...) raises FormulaError.
+
+A record's output_data (and its parent's input_data) is its text, 'A2:A5' or
+'SUM(A2:A5)', which names its column; its name is that text made unique in
+the tree, so a repeated subexpression or cell links up as often as it
+appears.
+"""
+from collections import OrderedDict
+import re
+import threading
+
+from specmetric.sheet_store import column_index, column_letters
+
+FUNCTIONS = {
+  'SUM': 'vector_sum',
+  'AVERAGE': 'mean',
+  'ROWS': 'count',
+  'COUNTIF': 'filter',
+  'COUNTIFS': 'filter',
+}
+
+OPERATORS = {
+  '+': 'scalar_sum',
+  '-': 'scalar_diff',
+  '/': 'scalar_ratio',
+}
+
+_TOKEN = re.compile(r"""\s*(?:
+  (?P<string>"(?:[^"]|"")*")
+  |(?P<function>[A-Za-z_][A-Za-z0-9_.]*)(?=\s*\()
+  |(?P<ref>(?:(?P<sheet>[A-Za-z_][A-Za-z0-9_.]*|'[^']+')!)?(?P<c1>\$?[A-Za-z]{1,3})(?P<r1>\$?\d+)(?:\s*:\s*(?P<c2>\$?[A-Za-z]{1,3})(?P<r2>\$?\d+))?)
+  |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?%?)
+  |(?P<operator><>|<=|>=|[-+*/^&=<>(),])
+  )""", re.VERBOSE)
+
+
+class FormulaError(ValueError):
+  """
+  A formula that can't be compiled
+  """
+
+
+class Ref:
+  """
+  A reference to a cell, with column and row either relative to the cell
+  of the formula (as offsets) or absolute
+  """
+
+  __slots__ = ('sheet', 'column', 'row', 'absolute_column', 'absolute_row')
+
+  def __init__(self, sheet, column, row, absolute_column, absolute_row):
+    self.sheet = sheet
+    self.column = column
+    self.row = row
+    self.absolute_column = absolute_column
+    self.absolute_row = absolute_row
+
+  @classmethod
+  def parse(cls, sheet, letters, digits, cell):
+    absolute_column = letters.startswith('$')
+    absolute_row = digits.startswith('$')
+    column = column_index(letters.lstrip('$'))
+    row = int(digits.lstrip('$')) - 1
+    return cls(sheet, column if absolute_column else column - cell[0], row if absolute_row else row - cell[1], absolute_column, absolute_row)
+
+  def normalized(self):
+    column = 'C{}'.format(self.column) if self.absolute_column else 'C[{}]'.format(self.column)
+    row = 'R{}'.format(self.row) if self.absolute_row else 'R[{}]'.format(self.row)
+    return (self.sheet + '!' if self.sheet else '') + row + column
+
+  def address(self, cell):
+    """
+    'A2' style address of the cell referred to from cell
+    """
+    column = self.column if self.absolute_column else self.column + cell[0]
+    row = self.row if self.absolute_row else self.row + cell[1]
+    if column < 0 or row < 0:
+      raise FormulaError("reference off the sheet")
+    return (self.sheet + '!' if self.sheet else '') + column_letters(column) + str(row + 1)
+
+
+def cell_position(address):
+  """
+  (column, row) of a single cell address, counting from 0
+  """
+  match = re.match(r"\A\s*\$?([A-Za-z]{1,3})\$?(\d+)\s*\Z", address)
+  if match is None:
+    raise FormulaError("not a cell: {!r}".format(address))
+  return (column_index(match.group(1)), int(match.group(2)) - 1)
+
+
+def tokenize(formula, cell):
+  """
+  The tokens of formula, as (kind, value) pairs, with references relative
+  to cell, and the normalized text they make up
+  """
+  text = formula.strip()
+  if text.startswith('='):
+    text = text[1:]
+  tokens = []
+  position = 0
+  while position < len(text):
+    match = _TOKEN.match(text, position)
+    if match is None or match.end() == position:
+      if text[position:].strip():
+        raise FormulaError("can't read {!r}".format(text[position:]))
+      break
+    position = match.end()
+    if match.group('ref') is not None:
+      sheet = match.group('sheet')
+      start = Ref.parse(sheet, match.group('c1'), match.group('r1'), cell)
+      if match.group('c2') is None:
+        tokens.append(('ref', start))
+      else:
+        tokens.append(('range', (start, Ref.parse(sheet, match.group('c2'), match.group('r2'), cell))))
+    elif match.group('string') is not None:
+      tokens.append(('string', match.group('string')))
+    elif match.group('function') is not None:
+      tokens.append(('function', match.group('function').upper()))
+    elif match.group('number') is not None:
+      tokens.append(('number', match.group('number')))
+    else:
+      tokens.append(('operator', match.group('operator')))
+  normalized = ''.join(_normalized(kind, value) for (kind, value) in tokens)
+  return (tokens, normalized)
+
+def _normalized(kind, value):
+  if kind == 'ref':
+    return value.normalized()
+  if kind == 'range':
+    return value[0].normalized() + ':' + value[1].normalized()
+  return value
+
+
+class FormulaTemplate:
+  """
+  A parsed formula, with its references relative to its cell.  Its
+  expression is a tree of tuples:
+    ('ref', Ref), ('range', (Ref, Ref)), ('number', text), ('string', text),
+    ('call', function, [arguments]), ('operator', operator, left, right)
+  """
+
+  def __init__(self, expression, normalized):
+    self.expression = expression
+    self.normalized = normalized
+
+  def records(self, address, taken=None):
+    """
+    The node records of the formula in address, and the cells it uses as
+    operands (which are leaves here, and become subtrees once their own
+    formulas are compiled), as (records, cells) where cells are (address,
+    name of the parent record).  Records are named by their text, made
+    unique (see unique_name) among the names in taken, which they are added
+    to.
+    """
+    cell = cell_position(address)
+    records = []
+    cells = []
+    _expression_records(self.expression, address, None, cell, records, cells, {} if taken is None else taken, top=True)
+    return (records, cells)
+
+
+def unique_name(text, taken):
+  """
+  A record's name: its text, or if another record of the tree has that name
+  already (a repeated subexpression, or a cell used twice), its text and
+  '#2', '#3', ...  taken counts the names used so far.
+  """
+  count = taken.get(text, 0) + 1
+  taken[text] = count
+  return text if count == 1 else '{}#{}'.format(text, count)
+
+
+def _name(expression, cell):
+  kind = expression[0]
+  if kind == 'ref':
+    return expression[1].address(cell)
+  if kind == 'range':
+    (start, stop) = expression[1]
+    return start.address(cell) + ':' + stop.address(cell).split('!')[-1]
+  if kind in ('number', 'string'):
+    return expression[1]
+  if kind == 'call':
+    return '{}({})'.format(expression[1], ', '.join(_name(e, cell) for e in expression[2]))
+  return '({} {} {})'.format(_name(expression[2], cell), expression[1], _name(expression[3], cell))
+
+def literal_value(expression):
+  (kind, text) = expression
+  if kind == 'string':
+    return text[1:-1].replace('""', '"')
+  if text.endswith('%'):
+    return float(text[:-1]) / 100
+  return float(text)
+
+def _expression_records(expression, text, parent, cell, records, cells, taken, top=False):
+  kind = expression[0]
+  if kind == 'ref' and not top:
+    # compiled from its own formula, if it has one
+    cells.append((text, parent))
+    return
+  name = unique_name(text, taken)
+  if kind == 'range':
+    records.append({'name': name, 'parent': parent, 'function': 'vector', 'input_data': [], 'output_data': text})
+    return
+  if kind == 'ref':
+    # '=B2', this cell is the other one
+    records.append({'name': name, 'parent': parent, 'function': 'scalar', 'input_data': [], 'output_data': text})
+    return
+  if kind in ('number', 'string'):
+    # constants carry their value, as there is no cell to take it from
+    records.append({'name': name, 'parent': parent, 'function': 'scalar', 'input_data': [], 'output_data': text, 'value': literal_value(expression)})
+    return
+
+  if kind == 'operator':
+    operands = [expression[2], expression[3]]
+    function = OPERATORS.get(expression[1])
+    if function is None:
+      raise FormulaError("{!r} isn't supported".format(expression[1]))
+    record = {'name': name, 'parent': parent, 'function': function, 'input_data': [_name(e, cell) for e in operands], 'output_data': text}
+  else:
+    (_, function_name, arguments) = expression
+    function = FUNCTIONS.get(function_name)
+    if function is None:
+      raise FormulaError("{} isn't supported".format(function_name))
+    if function == 'filter':
+      if len(arguments) < 2 or len(arguments) % 2 or any(a[0] != 'range' for a in arguments[::2]):
+        raise FormulaError("{} takes pairs of a range and a criterion".format(function_name))
+      operands = arguments[::2]
+      record = {'name': name, 'parent': parent, 'function': function, 'input_data': [_name(e, cell) for e in operands], 'output_data': text}
+      # the pairs, as they were written, for evaluating the criteria
+      record['criteria'] = [_name(e, cell) for e in arguments]
+    elif len(arguments) == 1 and arguments[0][0] == 'range':
+      operands = arguments
+      record = {'name': name, 'parent': parent, 'function': function, 'input_data': [_name(arguments[0], cell)], 'output_data': text}
+    elif function_name == 'SUM' and arguments:
+      # SUM(B2, B3, ...) of scalars
+      operands = arguments
+      record = {'name': name, 'parent': parent, 'function': 'scalar_sum', 'input_data': [_name(e, cell) for e in arguments], 'output_data': text}
+    else:
+      raise FormulaError("{} takes a single range".format(function_name))
+
+  records.append(record)
+  for operand in operands:
+    _expression_records(operand, _name(operand, cell), name, cell, records, cells, taken)
+
+
+class _Parser:
+  """
+  Recursive descent over the tokens of one formula
+  """
+
+  def __init__(self, tokens):
+    self.tokens = tokens
+    self.position = 0
+
+  def peek(self):
+    return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+  def take(self, operator=None):
+    token = self.peek()
+    if token[0] is None or (operator is not None and token != ('operator', operator)):
+      raise FormulaError("expected {!r}".format(operator) if operator else "formula ends too soon")
+    self.position += 1
+    return token
+
+  def parse(self):
+    expression = self.comparison()
+    if self.position != len(self.tokens):
+      raise FormulaError("unexpected {!r}".format(self.peek()[1]))
+    return expression
+
+  def comparison(self):
+    left = self.sum()
+    while self.peek() in [('operator', o) for o in ('=', '<>', '<', '>', '<=', '>=', '&')]:
+      operator = self.take()[1]
+      left = ('operator', operator, left, self.sum())
+    return left
+
+  def sum(self):
+    left = self.product()
+    while self.peek() in (('operator', '+'), ('operator', '-')):
+      operator = self.take()[1]
+      left = ('operator', operator, left, self.product())
+    return left
+
+  def product(self):
+    left = self.power()
+    while self.peek() in (('operator', '*'), ('operator', '/')):
+      operator = self.take()[1]
+      left = ('operator', operator, left, self.power())
+    return left
+
+  def power(self):
+    left = self.unary()
+    while self.peek() == ('operator', '^'):
+      self.take()
+      left = ('operator', '^', left, self.unary())
+    return left
+
+  def unary(self):
+    if self.peek() in (('operator', '-'), ('operator', '+')):
+      raise FormulaError("signs aren't supported")
+    return self.atom()
+
+  def atom(self):
+    (kind, value) = self.take()
+    if kind in ('ref', 'range', 'number', 'string'):
+      return (kind, value)
+    if kind == 'function':
+      self.take('(')
+      arguments = []
+      if self.peek() != ('operator', ')'):
+        arguments.append(self.comparison())
+        while self.peek() == ('operator', ','):
+          self.take()
+          arguments.append(self.comparison())
+      self.take(')')
+      return ('call', value, arguments)
+    if (kind, value) == ('operator', '('):
+      expression = self.comparison()
+      self.take(')')
+      return expression
+    raise FormulaError("unexpected {!r}".format(value))
+
+
+class FormulaCache:
+  """
+  LRU cache of FormulaTemplates, by normalized formula text (see the module
+  docstring).  Formulas that can't be compiled are cached too, as their
+  FormulaError.
+  """
+
+  def __init__(self, maxsize=4096):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    with self._lock:
+      template = self._entries.get(key)
+      if template is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+        self._entries.move_to_end(key)
+      return template
+
+  def put(self, key, template):
+    with self._lock:
+      self._entries[key] = template
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'size': len(self._entries),
+      'maxsize': self.maxsize,
+      'hit_rate': (self.hits / lookups) if lookups else 0.0
+    }
+
+
+default_formula_cache = FormulaCache()
+
+
+def compile_formula(formula, address, cache=default_formula_cache):
+  """
+  The FormulaTemplate of formula, in the cell at address.  Raises
+  FormulaError if it can't be compiled.
+  """
+  (tokens, normalized) = tokenize(formula, cell_position(address))
+  template = cache.get(normalized) if cache is not None else None
+  if template is None:
+    try:
+      template = FormulaTemplate(_Parser(tokens).parse(), normalized)
+      # check it compiles, so templates in the cache always do
+      template.records(address)
+    except FormulaError as e:
+      template = e
+    if cache is not None:
+      cache.put(normalized, template)
+  if isinstance(template, FormulaError):
+    raise template
+  return template
+
+
+def compile_cells(root, formula_of, cache=default_formula_cache, max_cells=64):
+  """
+  The node records of the tree rooted at the cell root: its formula,
+  compiled, and the formulas of the cells it uses, and so on.  formula_of
+  gives the formula of a cell's address, or None if it doesn't hold one.
+  A cell used by several formulas (or twice by one) is a subtree under each
+  of them, its formula compiled once.  Cells whose formulas can't be
+  compiled, and cells past the first max_cells visited, are scalar leaves.
+  """
+  records = []
+  taken = {}
+  templates = {}
+  visited = 0
+  to_visit = [(root, None)]
+  while to_visit:
+    (address, parent) = to_visit.pop(0)
+    visited += 1
+    if visited <= max_cells and address not in templates:
+      formula = formula_of(address)
+      try:
+        templates[address] = compile_formula(formula, address, cache) if formula else None
+      except FormulaError:
+        templates[address] = None
+    template = templates.get(address) if visited <= max_cells else None
+    if template is None:
+      records.append({'name': unique_name(address, taken), 'parent': parent, 'function': 'scalar', 'input_data': [], 'output_data': address})
+      continue
+    (cell_records, cells) = template.records(address, taken)
+    cell_records[0]['parent'] = parent
+    records.extend(cell_records)
+    to_visit.extend(cells)
+  return records
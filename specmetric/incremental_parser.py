@@ -0,0 +1,304 @@
+import bisect
+from fractions import Fraction
+
+from specmetric.visualization_container import VisualizationContainer
+from specmetric.parser import ComputationTreeParser, _heap_meld, _heap_push, _heap_pop
+
+class IncrementalParser(ComputationTreeParser):
+  """
+  A parser that keeps its resolved containers between parses, for trees that
+  are edited a little at a time (e.g. a formula in the spreadsheet app).
+
+  Edits go through the parser: replace_node, set_function_type, add_child and
+  remove_child.  Each edit marks the path from the edited node to the root as
+  dirty, and the next visualizeDFG only re-resolves that path through
+  mergeFamily.  Every other subtree reuses the containers it was resolved to
+  before, so an edit costs time proportional to the depth of the edited node
+  (and the number of children along its path) rather than to the size of the
+  tree.
+
+  The result is the same as a full ComputationTreeParser parse of the edited
+  tree with share_subexpressions=False and no cache.  The computation tree
+  has to be a tree of ComputationNodes: every node is reachable along a
+  single path.  Containers returned by one parse are reused by the next, so
+  they should be treated as read-only, and the ones that come from a
+  re-resolved path can change on the next parse.
+  """
+
+  def __init__(self, computation_tree, compositions=None, grammatical_expressions=None, isSpreadsheet=False):
+    super().__init__(computation_tree, compositions=compositions, grammatical_expressions=grammatical_expressions, isSpreadsheet=isSpreadsheet, share_subexpressions=False, cache=None)
+    # Containers are ordered by (lowest_depth, -order) where a full parse
+    # counts order up as it resolves nodes in post-order.  We label each node
+    # with its position in post-order instead, spreading labels of inserted
+    # subtrees between their neighbours, so reused containers keep their keys.
+    self.parents = {} # node -> parent node, None for the root
+    self.depths = {} # node -> depth the node is resolved at
+    self.labels = {} # node -> position of the node in post-order
+    self.resolved = {} # node -> heap of the containers its subtree resolved to
+    self.dirty = set() # nodes that must be re-resolved, always closed under parents
+    # Every container is pushed by the node that resolved it, and popped by
+    # that node's parent if it is the head of the node's heap.  Keeping track
+    # of both lets us update the result in place rather than walk the heap.
+    self.family = {} # key -> (container, length of its computation_nodes) for every pushed container
+    self.family_keys = {} # node -> keys of the containers it pushed
+    self.popped = {} # node -> (key, item) of the child heads it popped
+    self.popped_by = {} # key -> node that popped it
+    self.output = {} # key -> (container, length) of the containers nobody popped
+    self.output_keys = [] # sorted keys of output
+    self.changed = set() # keys that were pushed or popped since the last parse
+    self.index_subtree(computation_tree, None, 1, None, None)
+
+  def index_subtree(self, root, parent, depth, low, high):
+    """
+    Registers a subtree that is new to the parser, labelling its nodes in
+    post-order strictly between low and high (either may be None)
+    """
+    post_order = []
+    seen = set()
+    stack = [(root, parent, depth, False)]
+    while stack:
+      node, node_parent, node_depth, expanded = stack.pop()
+      if expanded:
+        post_order.append((node, node_parent, node_depth))
+        continue
+      if node in seen or node in self.parents:
+        raise ValueError("{} appears more than once in the computation tree".format(node))
+      seen.add(node)
+      stack.append((node, node_parent, node_depth, True))
+      for child_node in reversed(node.children):
+        stack.append((child_node, node, node_depth + 1, False))
+
+    if low is None and high is None:
+      labels = range(len(post_order))
+    else:
+      if low is None:
+        low = high - 1
+      elif high is None:
+        high = low + 1
+      step = Fraction(high - low) / (len(post_order) + 1)
+      labels = (low + step * (i + 1) for i in range(len(post_order)))
+    for (node, node_parent, node_depth), label in zip(post_order, labels):
+      self.parents[node] = node_parent
+      self.depths[node] = node_depth
+      self.labels[node] = label
+      self.dirty.add(node)
+
+  def forget_subtree(self, root):
+    stack = [root]
+    while stack:
+      node = stack.pop()
+      for state in (self.parents, self.depths, self.labels, self.resolved):
+        state.pop(node, None)
+      self.release(node, unpop=False)
+      self.dirty.discard(node)
+      stack.extend(node.children)
+
+  def mark_dirty(self, node):
+    while node is not None and node not in self.dirty:
+      self.dirty.add(node)
+      node = self.parents[node]
+
+  def first_label(self, node):
+    """
+    Label of the first node of node's subtree in post-order
+    """
+    while node.children:
+      node = node.children[0]
+    return self.labels[node]
+
+  def label_before(self, node):
+    """
+    Label of the node right before node's subtree in post-order, or None if
+    the subtree comes first
+    """
+    while True:
+      parent = self.parents[node]
+      if parent is None:
+        return None
+      index = _child_index(parent, node)
+      if index > 0:
+        return self.labels[parent.children[index - 1]]
+      node = parent
+
+  def check_node(self, node):
+    if node not in self.parents:
+      raise ValueError("{} is not part of this parser's computation tree".format(node))
+
+  # Edits
+
+  def set_function_type(self, node, function_type):
+    self.check_node(node)
+    node.function_type = function_type
+    self.mark_dirty(node)
+
+  def replace_node(self, node, new_node):
+    """
+    Puts new_node in node's place.  new_node takes over node's children, so
+    it should not have children of its own.
+    """
+    self.check_node(node)
+    if new_node in self.parents or new_node.children:
+      raise ValueError("{} must be a new node without children".format(new_node))
+    parent = self.parents[node]
+    if parent is None:
+      self.computation_tree = new_node
+    else:
+      parent.children[_child_index(parent, node)] = new_node
+      new_node.set_parent(parent)
+    new_node.children = node.children
+    node.children = []
+    for child_node in new_node.children:
+      child_node.set_parent(new_node)
+      self.parents[child_node] = new_node
+
+    self.parents[new_node] = parent
+    self.depths[new_node] = self.depths[node]
+    self.labels[new_node] = self.labels[node]
+    # the child heads node took go back when new_node is resolved
+    self.popped[new_node] = self.popped.pop(node, [])
+    self.forget_subtree(node)
+    self.mark_dirty(new_node)
+
+  def add_child(self, parent, child, index=None):
+    """
+    Inserts child, along with any children it has, as the index-th child of
+    parent (by default the last)
+    """
+    self.check_node(parent)
+    if index is None:
+      index = len(parent.children)
+    if index > 0:
+      low = self.labels[parent.children[index - 1]]
+    else:
+      low = self.label_before(parent)
+    if index < len(parent.children):
+      high = self.first_label(parent.children[index])
+    else:
+      high = self.labels[parent]
+
+    self.index_subtree(child, parent, self.depths[parent] + 1, low, high)
+    parent.children.insert(index, child)
+    child.set_parent(parent)
+    self.mark_dirty(parent)
+
+  def remove_child(self, parent, child):
+    self.check_node(parent)
+    del parent.children[_child_index(parent, child)]
+    self.forget_subtree(child)
+    self.mark_dirty(parent)
+
+  def release(self, node, unpop=True):
+    """
+    Drops the containers node pushed when it was last resolved and, with
+    unpop, puts the child heads it took back into the output
+    """
+    for key in self.family_keys.pop(node, ()):
+      del self.family[key]
+      self.popped_by.pop(key, None)
+      self.output.pop(key, None)
+      self.changed.add(key)
+    for key, item in self.popped.pop(node, ()):
+      # the container may be gone, a node that replaced its node may have
+      # pushed another one under the same key, or a descendant re-resolved in
+      # this parse may have taken it over
+      if unpop and self.popped_by.get(key) is node and self.family.get(key) is item:
+        del self.popped_by[key]
+        # a container that an earlier parse merged into its parent may be
+        # left unmerged this time
+        del item[0].computation_nodes[item[1]:]
+        self.output[key] = item
+        self.changed.add(key)
+
+  def visualizeDFG(self):
+    """
+    Re-resolves the dirty nodes, deepest first, and reuses the stored
+    containers of every other subtree.  See ComputationTreeParser.visualizeDFG
+    for how containers are resolved and ordered.
+    """
+    dirty = self.dirty
+    resolved = self.resolved
+    family = self.family
+    output = self.output
+    popped_by = self.popped_by
+    changed = self.changed
+    work_stack = [(self.computation_tree, False)]
+    while work_stack:
+      tree, expanded = work_stack.pop()
+      if tree not in dirty:
+        continue
+      if tree.children and not expanded:
+        work_stack.append((tree, True))
+        for child_node in reversed(tree.children):
+          if child_node in dirty:
+            work_stack.append((child_node, False))
+        continue
+
+      self.release(tree)
+      depth = self.depths[tree]
+      label = self.labels[tree]
+      if not tree.children:
+        family_containers = [VisualizationContainer(tree, compositions=self.compositions, grammatical_expressions=self.grammatical_expressions, lowest_depth=depth)]
+        resolved_child_tails = None
+      else:
+        child_container_heads = []
+        resolved_child_tails = None
+        popped = self.popped[tree] = []
+        for child_node in tree.children:
+          child_heap = resolved[child_node]
+          head_item, child_tails = _heap_pop(child_heap)
+          (head_container, num_nodes) = head_item
+          resolved_child_tails = _heap_meld(resolved_child_tails, child_tails)
+          output.pop(child_heap[1], None)
+          popped_by[child_heap[1]] = tree
+          changed.add(child_heap[1])
+          popped.append((child_heap[1], head_item))
+          # mergeFamily changes the heads it is given, and the child's heap has
+          # to stay as it is for the next time this node is re-resolved.  The
+          # only change to computation_nodes is appending to them, so rather
+          # than copying a (possibly long) list, heads share it and we cut off
+          # whatever an earlier resolution of this node appended.
+          del head_container.computation_nodes[num_nodes:]
+          head_copy = object.__new__(VisualizationContainer)
+          head_copy.__dict__.update(head_container.__dict__)
+          head_copy.encodings = dict(head_container.encodings)
+          child_container_heads.append(head_copy)
+
+        family_containers = ComputationTreeParser.mergeFamily(tree, child_container_heads, self.compositions, self.grammatical_expressions, parent_depth=depth)
+
+      keys = self.family_keys[tree] = []
+      for i, container in enumerate(family_containers):
+        key = (container.lowest_depth, -label, -i)
+        item = (container, len(container.computation_nodes))
+        resolved_child_tails = _heap_push(resolved_child_tails, key, item)
+        family[key] = output[key] = item
+        popped_by.pop(key, None)
+        changed.add(key)
+        keys.append(key)
+      resolved[tree] = resolved_child_tails
+      dirty.discard(tree)
+
+    # The output is every container that was pushed and not popped, which is
+    # what is left in the root's heap.  Its keys are kept sorted, and updated
+    # in place unless much of the tree changed.
+    output_keys = self.output_keys
+    if len(changed) > len(output_keys) // 8 + 16:
+      output_keys[:] = sorted(output)
+    else:
+      for key in changed:
+        i = bisect.bisect_left(output_keys, key)
+        present = i < len(output_keys) and output_keys[i] == key
+        if key in output:
+          if not present:
+            output_keys.insert(i, key)
+        elif present:
+          del output_keys[i]
+    changed.clear()
+    # deepest first, ties in resolution order
+    self.visualization_containers = [output[key][0] for key in reversed(output_keys)]
+
+
+def _child_index(parent, child):
+  for i, child_node in enumerate(parent.children):
+    if child_node is child:
+      return i
+  raise ValueError("{} is not a child of {}".format(child, parent))
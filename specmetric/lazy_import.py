@@ -0,0 +1,39 @@
+import importlib
+import sys
+
+class LazyModule:
+  """
+  Stands in for a module and imports it the first time one of its
+  attributes is used, so heavy dependencies like pandas and altair are
+  only paid for by code that actually renders.
+  """
+
+  def __init__(self, name):
+    self.__dict__['_name'] = name
+    self.__dict__['_module'] = None
+
+  def __repr__(self):
+    return "(LazyModule - name: {}, loaded: {})".format(self._name, self._module is not None)
+
+  def __getattr__(self, attr):
+    module = self._module
+    if module is None:
+      module = self.__dict__['_module'] = importlib.import_module(self._name)
+    value = getattr(module, attr)
+    # later lookups of the same attribute skip __getattr__ entirely
+    self.__dict__[attr] = value
+    return value
+
+  def __setattr__(self, attr, value):
+    raise AttributeError("Can't set attributes on lazily imported module {}".format(self._name))
+
+
+def lazy_import(name):
+  """
+  Returns a LazyModule for name, or the module itself if it is already
+  imported
+  """
+  module = sys.modules.get(name)
+  if module is not None:
+    return module
+  return LazyModule(name)
@@ -0,0 +1,227 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from specmetric.rule_compiler import compile_rules
+from specmetric.visualization_container import VisualizationContainer
+
+class ParseCache:
+  """
+  LRU cache of resolved subtrees, shared across ComputationTreeParser runs.
+
+  Keys are structural signatures (see subtree_signature), so two subtrees
+  with the same shape, function types and pattern of variable names share an
+  entry even if the names themselves differ.  Values are SubtreeTemplates,
+  which are re-bound to the nodes and names of the subtree on a hit.
+  """
+
+  def __init__(self, maxsize=1024):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    with self._lock:
+      template = self._entries.get(key)
+      if template is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+        self._entries.move_to_end(key)
+      return template
+
+  def put(self, key, template):
+    with self._lock:
+      self._entries[key] = template
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'size': len(self._entries),
+      'maxsize': self.maxsize,
+      'hit_rate': (self.hits / lookups) if lookups else 0.0
+    }
+
+
+default_parse_cache = ParseCache()
+
+
+_rules_versions = {}
+
+def rules_version(grammatical_expressions, compositions):
+  """
+  Fingerprint of a rule set, so cached subtrees are never reused with
+  different grammar or composition rules.  Rule sets are fingerprinted once
+  per pair of dicts, so they should not be modified after they are first
+  used to parse.
+  """
+  key = (id(grammatical_expressions), id(compositions))
+  entry = _rules_versions.get(key)
+  # we hold on to the dicts, so their ids can't be reused by other objects
+  if entry is None or entry[0] is not grammatical_expressions or entry[1] is not compositions:
+    rules = json.dumps([grammatical_expressions, compositions], sort_keys=True, default=str)
+    entry = (grammatical_expressions, compositions, hashlib.sha1(rules.encode('utf-8')).hexdigest())
+    _rules_versions[key] = entry
+  return entry[2]
+
+
+def _data_signature(data, name_ids, names):
+  """
+  Replaces every variable name in a node's input or output data with the
+  position of its first appearance, registering new names as it goes
+  """
+  if isinstance(data, (list, tuple)):
+    return tuple([_data_signature(d, name_ids, names) for d in data])
+  name_id = name_ids.get(data)
+  if name_id is None:
+    name_id = name_ids[data] = len(names)
+    names.append(data)
+  return name_id
+
+
+def subtree_signature(root_id, nodes, children, num_consumers):
+  """
+  Computes the structural signature of the subgraph below root_id, as
+  returned by ComputationTreeParser.canonicalize.  Variable names are
+  replaced by the position of their first appearance, so the signature only
+  depends on the pattern in which names repeat.
+
+  Returns (signature, node_ids, names), where node_ids and names list the
+  subgraph's nodes and variable names in the order the signature refers to
+  them, or None if the subgraph cannot be cached because some node inside it
+  is also consumed from outside of it, or a name is not hashable.
+  """
+  signature = []
+  node_ids = []
+  positions = {}
+  names = []
+  name_ids = {}
+  references = {}
+  stack = [root_id]
+  try:
+    while stack:
+      node_id = stack.pop()
+      if node_id in positions:
+        # a node shared inside the subgraph
+        signature.append(('ref', positions[node_id]))
+        references[node_id] += 1
+        continue
+      positions[node_id] = len(node_ids)
+      references[node_id] = 1
+      node_ids.append(node_id)
+
+      node = nodes[node_id]
+      output_signature = _data_signature(node.output_data, name_ids, names)
+      signature.append((node.function_type, _data_signature(node.input_data, name_ids, names), output_signature, len(children[node_id])))
+      stack.extend(reversed(children[node_id]))
+  except TypeError:
+    return None
+
+  for node_id in node_ids[1:]:
+    if references[node_id] != num_consumers[node_id]:
+      return None
+
+  return tuple(signature), node_ids, names
+
+
+class SubtreeTemplate:
+  """
+  The resolved containers of a subtree, with nodes, variable names and depths
+  stored relative to the subtree so they can be re-bound to another subtree
+  with the same signature.
+  """
+
+  def __init__(self, containers):
+    self.containers = containers
+
+  @classmethod
+  def from_entries(cls, entries, base_depth, nodes, node_ids, names):
+    """
+    Builds a template out of the (key, container) entries of a resolved
+    subtree.  Returns None if a container refers to something outside of the
+    subtree.
+    """
+    node_positions = {nodes[node_id]: i for (i, node_id) in enumerate(node_ids)}
+    name_positions = {name: i for (i, name) in enumerate(names)}
+    containers = []
+    try:
+      # ordered by the order they were resolved in
+      for (_, container) in sorted(entries, key=lambda e: -e[0][1]):
+        containers.append({
+          'valid_chart': container.valid_chart,
+          'root_node': node_positions[container.root_node],
+          'computation_nodes': [node_positions[n] for n in container.computation_nodes],
+          'lowest_depth': container.lowest_depth - base_depth,
+          'encodings': _encodings_template(container.encodings, name_positions),
+          'child_encodings': _encodings_template(container.child_encodings, name_positions),
+          'matchedRule': container.matchedRule
+        })
+    except (KeyError, TypeError):
+      return None
+    return cls(containers)
+
+  def instantiate(self, base_depth, nodes, node_ids, names, compositions, grammatical_expressions):
+    """
+    Returns new containers for the subtree, in the order they were resolved
+    """
+    subtree_nodes = [nodes[node_id] for node_id in node_ids]
+    rules = compile_rules(grammatical_expressions, compositions)
+    containers = []
+    for t in self.containers:
+      containers.append(VisualizationContainer.from_template(
+        subtree_nodes[t['root_node']],
+        [subtree_nodes[i] for i in t['computation_nodes']],
+        base_depth + t['lowest_depth'],
+        t['valid_chart'],
+        _bind_encodings(t['encodings'], names),
+        _bind_encodings(t['child_encodings'], names),
+        t['matchedRule'],
+        compositions, grammatical_expressions, rules=rules))
+    return containers
+
+
+# Encodings are keyed by variable name, and the renderer ties spacefilling
+# areas to a bar with an 'offset' of 'tied-<variable name>'.  Those are the
+# only places names appear, so they are the only places we re-bind.
+_TIED_PREFIX = 'tied-'
+
+def _encodings_template(encodings, name_positions):
+  template = []
+  for name, config in encodings.items():
+    config = dict(config)
+    offset = config.get('offset')
+    if isinstance(offset, str) and offset.startswith(_TIED_PREFIX):
+      config['offset'] = (_TIED_PREFIX, name_positions[offset[len(_TIED_PREFIX):]])
+    template.append((name_positions[name], config))
+  return template
+
+def _bind_encodings(template, names):
+  encodings = {}
+  for name_position, config in template:
+    config = dict(config)
+    if isinstance(config.get('offset'), tuple):
+      prefix, offset_position = config['offset']
+      config['offset'] = prefix + str(names[offset_position])
+    encodings[names[name_position]] = config
+  return encodings
@@ -1,7 +1,6 @@
 from specmetric.visualization_container import VisualizationContainer
-from specmetric.rules_config import compositions as _compositions
-from specmetric.rules_config import grammatical_expressions as _grammatical_expressions
-from specmetric.rules_config import spreadsheet_grammatical_expressions as _spreadsheet_grammatical_expressions
+from specmetric import rules_config
+from specmetric.parse_cache import default_parse_cache, rules_version, subtree_signature, SubtreeTemplate
 class ComputationTreeParser:
   """
   Parses the abstract syntax tree of a computation, where each node is a 
@@ -10,7 +9,7 @@ class ComputationTreeParser:
   """
   # Class methods
 
-  def mergeFamily(parent_node, visualization_container_list, compositions=_compositions, grammatical_expressions=_grammatical_expressions, parent_depth=0):
+  def mergeFamily(parent_node, visualization_container_list, compositions=None, grammatical_expressions=None, parent_depth=0):
     """
     Resolves 1 to n visualization containers (representing subgraphs)
     of computation graph into a list of m visualization containers.  Ideally
@@ -40,10 +39,14 @@ class ComputationTreeParser:
     # First, we need to get all children, and get their encodings
     child_encodings = {}
     for child_container in visualization_container_list:
-      child_encodings = child_encodings | child_container.encodings
+      child_encodings.update(child_container.encodings)
 
     parent_container = VisualizationContainer(parent_node, child_encodings=child_encodings, compositions=compositions, grammatical_expressions=grammatical_expressions, lowest_depth=parent_depth)
 
+    # Containers that have taken over the parent, in the order they did so.  Their
+    # computation nodes and encodings are combined once at the end, rather than
+    # copied into each other on every merge, so wide nodes stay linear.
+    merged_containers = [parent_container]
     while(len(visualization_container_list) > 0):
       child_container = visualization_container_list.pop()
       if child_container.lowest_depth < parent_container.lowest_depth:
@@ -52,89 +55,306 @@ class ComputationTreeParser:
       if child_container.parent_mergeable(parent_node):
         child_container.merge_parent(parent_node)
         # The child container has invaded the parent container and taken over
-        for node in parent_container.computation_nodes:
-          child_container.add_node(node)
-
-        # we also need to copy over metadata from the parent
-        # this should really be all one subroutine, but thats for refactoring
-        child_container.encodings = child_container.encodings | parent_container.encodings
-        child_container.root_node = parent_container.root_node
-
+        merged_containers.append(child_container)
         parent_container = child_container
       else:
         unmerged_child_containers.append(child_container)
 
+    if len(merged_containers) > 1:
+      # The last child to merge comes first, followed by the containers it took
+      # over, whose encodings override its own.
+      for container in reversed(merged_containers[:-1]):
+        parent_container.computation_nodes.extend(container.computation_nodes)
+        parent_container.encodings.update(container.encodings)
+
+      # we also need to copy over metadata from the parent
+      parent_container.root_node = merged_containers[0].root_node
+
     unmerged_child_containers.append(parent_container)
     return unmerged_child_containers
 
 
   # Instance methods
-  def __init__(self, computation_tree, compositions=_compositions, grammatical_expressions=_grammatical_expressions, isSpreadsheet=False):
+  def __init__(self, computation_tree, compositions=None, grammatical_expressions=None, isSpreadsheet=False, share_subexpressions=True, cache=default_parse_cache, max_cached_subtree_size=256):
     self.computation_tree = computation_tree
+    # computation_tree may be a DAG.  Nodes reachable along several paths are
+    # always resolved once; with share_subexpressions, structurally identical
+    # subtrees (same function types and input/output names) are also treated
+    # as a single shared node.
+    self.share_subexpressions = share_subexpressions
+    # Resolved subtrees are memoized by their structure in a ParseCache that is
+    # shared across parsers, so trees with the same shape but different
+    # variable names are only resolved once.  We look up the whole tree, and
+    # the largest subtrees with at most max_cached_subtree_size nodes.  Pass
+    # cache=None to turn this off.
+    self.cache = cache
+    self.max_cached_subtree_size = max_cached_subtree_size
     # The dag is implemented as a list of lists - it's really a linked list
     # but where each node could be 1 or more visualizations where we can't
     # agree on what encoding to use, so we make multiple visualizations
     self.visualization_containers = []
+    # rule sets are looked up now rather than when this module was imported,
+    # so importing the parser doesn't load them
     if isSpreadsheet:
-      self.grammatical_expressions = _spreadsheet_grammatical_expressions
+      self.grammatical_expressions = rules_config.spreadsheet_grammatical_expressions
     else:
-      self.grammatical_expressions = grammatical_expressions
+      self.grammatical_expressions = rules_config.grammatical_expressions if grammatical_expressions is None else grammatical_expressions
     
-    self.compositions = compositions
+    self.compositions = rules_config.compositions if compositions is None else compositions
+
+  def canonicalize(self):
+    """
+    Assigns an integer id to every distinct subexpression reachable from the
+    root.  Nodes reached along several paths (a DAG) always share an id.  With
+    share_subexpressions, nodes are hash-consed on their function type, input
+    and output names and the ids of their children (and their own name, if
+    they have no output), so that structurally identical subtrees share an id
+    too.
+
+    Returns (root_id, nodes, children) where nodes[i] is the representative
+    node for id i (the first one found) and children[i] is the list of child ids.
+    Raises ValueError if the graph has a cycle.
+    """
+    node_ids = {}
+    structural_ids = {}
+    nodes = []
+    children = []
+    share_subexpressions = self.share_subexpressions
+    stack = [(self.computation_tree, False)]
+    while stack:
+      node, expanded = stack.pop()
+      if not expanded:
+        if node in node_ids:
+          continue
+        # None marks a node whose children are still being canonicalized
+        node_ids[node] = None
+        stack.append((node, True))
+        for child_node in reversed(node.children):
+          if child_node in node_ids:
+            if node_ids[child_node] is None:
+              raise ValueError("Computation graph has a cycle through {}".format(child_node))
+          else:
+            stack.append((child_node, False))
+        continue
+
+      child_ids = [node_ids[child_node] for child_node in node.children]
+      if share_subexpressions:
+        output_data = _hashable(node.output_data)
+        # without output data there is nothing to tell two nodes of the same
+        # type apart by (two unnamed constants, say) but their names
+        name = node.name if output_data in ((), '', None) else None
+        key = (node.function_type, _hashable(node.input_data), output_data, tuple(child_ids), name)
+      else:
+        key = node
+      node_id = structural_ids.get(key)
+      if node_id is None:
+        node_id = structural_ids[key] = len(nodes)
+        nodes.append(node)
+        children.append(child_ids)
+      node_ids[node] = node_id
+
+    return node_ids[self.computation_tree], nodes, children
+
+  def cache_boundaries(self, root_id, children):
+    """
+    Returns the node ids whose subtrees are looked up in the cache: the root,
+    and every subtree of at most max_cached_subtree_size nodes (but more than
+    one) whose parent's subtree is larger than that.
+    """
+    limit = self.max_cached_subtree_size + 1
+    # ids are assigned in post-order, so children come before their parents
+    sizes = [1] * len(children)
+    for node_id, child_ids in enumerate(children):
+      sizes[node_id] = min(limit, 1 + sum(sizes[c] for c in child_ids))
+
+    boundaries = {root_id}
+    for node_id, child_ids in enumerate(children):
+      if sizes[node_id] == limit:
+        boundaries.update(c for c in child_ids if 1 < sizes[c] < limit)
+    return boundaries
 
   def visualizeDFG(self):
     """
-    Recursive parsing function.  
+    Iterative parsing function.
 
-    Depth-first search.
+    Depth-first search, driven by an explicit stack so that arbitrarily deep
+    trees do not hit the recursion limit.
 
     Each path from root to leaf is decomposed into a set of visualizations.
 
     At each branching point, on the way back from DFS, branches are either merged
     or split into multiple, parallel visualizations.
 
-    Returns a list of visualization containers.
+    Shared subexpressions (see canonicalize) are resolved once.  Every consumer
+    gets its own copy of the shared head container to merge with, the rest of
+    the shared subgraph's containers appear once, and a shared head that no
+    consumer can merge with is also only kept once.
+
+    Subtrees found in the parser's cache are re-bound from the cached result
+    instead of being resolved again.
+
+    Returns a list of visualization containers, ordered by depth on the tree
+    (deepest first).  Containers at the same depth keep the order in which they
+    were resolved during the traversal.
     """
+    root_id, nodes, children = self.canonicalize()
+    num_consumers = [0] * len(nodes)
+    for child_ids in children:
+      for child_id in child_ids:
+        num_consumers[child_id] += 1
+
+    # Each entry on the work stack is (node id, depth, expanded).  A node is
+    # pushed once to expand its children and once more to resolve it after all
+    # of its children have been resolved (post-order).
+    #
+    # Resolved subtrees are kept as meldable heaps keyed by
+    # (lowest_depth, -order), so the head of a subtree (the container with the
+    # smallest depth that was resolved last) can be popped in O(log n) instead
+    # of re-sorting every accumulated container at every internal node.
+    work_stack = [(root_id, 0, False)]
+    resolved = {} # node id -> (heap of containers or None once consumed, depth it was resolved at)
+    shared_heads = {} # node id -> unmodified head of a shared subexpression
+    unmerged_shared_heads = {} # node id -> the copy of a shared head that was kept unmerged
+    order = 0
 
-    def parseDFTree(tree, depth=0):
-      """
-      pops the root node.  Determines if it can be added to the current 
-      visualization container or if it needs to be the start of a new one.
-      then recursively parses its children passing either the current vis
-      container or a newly created one for each child.
-
-      Recursion invariant: parse_root should return a deque representing a DAG
-      of visualizations for everything beneath tree, where the last element of
-      the deque is the current visualization container.  
-      """
+    cache_boundaries = set()
+    if self.cache is not None:
+      cache_boundaries = self.cache_boundaries(root_id, children)
+      version = rules_version(self.grammatical_expressions, self.compositions)
+    uncached_subtrees = {} # node id -> (cache key, subtree node ids, subtree names)
+    while work_stack:
+      node_id, depth, expanded = work_stack.pop()
+      if node_id in resolved:
+        # shared subexpression, already resolved
+        continue
+      tree = nodes[node_id]
       new_depth = depth + 1
-      if tree.is_leaf():
+      if not children[node_id]:
         # We are at a leaf, there is no former visualization to connect to
-        return [VisualizationContainer(tree, compositions=self.compositions, grammatical_expressions=self.grammatical_expressions, lowest_depth=new_depth)]
+        container = VisualizationContainer(tree, compositions=self.compositions, grammatical_expressions=self.grammatical_expressions, lowest_depth=new_depth)
+        resolved[node_id] = (_heap_push(None, (container.lowest_depth, -order), container), new_depth)
+        order += 1
+      elif not expanded:
+        if node_id in cache_boundaries:
+          subtree = subtree_signature(node_id, nodes, children, num_consumers)
+          if subtree is not None:
+            signature, subtree_ids, names = subtree
+            key = (version, signature)
+            template = self.cache.get(key)
+            if template is not None:
+              resolved_subtree = None
+              for container in template.instantiate(new_depth, nodes, subtree_ids, names, self.compositions, self.grammatical_expressions):
+                resolved_subtree = _heap_push(resolved_subtree, (container.lowest_depth, -order), container)
+                order += 1
+              resolved[node_id] = (resolved_subtree, new_depth)
+              continue
+            uncached_subtrees[node_id] = (key, subtree_ids, names)
+
+        work_stack.append((node_id, depth, True))
+        for child_id in reversed(children[node_id]):
+          work_stack.append((child_id, new_depth, False))
       else:
-        # if we are not at a leaf, we should have >0 children
+        # if we are not at a leaf, we should have >0 children, all resolved
         child_container_heads = []
-        resolved_child_tails = []
-        for child_node in tree.children:
-          child_containers = parseDFTree(child_node, depth=new_depth)
+        shared_child_heads = []
+        resolved_child_tails = None
+        for child_id in children[node_id]:
+          child_heap, child_depth = resolved[child_id]
+          if child_heap is not None:
+            # head gets judged against parent, tail goes into the heap together
+            head_container, child_tails = _heap_pop(child_heap)
+            resolved_child_tails = _heap_meld(resolved_child_tails, child_tails)
+            resolved[child_id] = (None, child_depth)
+            if num_consumers[child_id] > 1:
+              shared_heads[child_id] = head_container.copy()
+          else:
+            # the tail has already been placed by an earlier consumer
+            head_container = shared_heads[child_id].copy()
 
-          # head gets judged against parent
-          head_container = child_containers.pop()
+          if num_consumers[child_id] > 1:
+            # the head sits as deep below this node as it did below the node
+            # that resolved it
+            head_container.lowest_depth += (new_depth + 1) - child_depth
+            shared_child_heads.append((child_id, head_container))
           child_container_heads.append(head_container)
 
-          # tail goes into the stack together
-          resolved_child_tails = resolved_child_tails + child_containers
-
         # We resolve the current node and the n child containers, which will 
         # result in either 1 visualization container (child and tree were merged)
         # or m<=n+1 containers, meaning either/or the child containers were incompatible
         # with the tree node, so we had to start a new visualization container, or the
         # child containers were not mergeable so they had to stay as separate visualizations
+        family_containers = ComputationTreeParser.mergeFamily(tree, child_container_heads, self.compositions, self.grammatical_expressions, parent_depth=new_depth)
+
+        # shared heads that stayed unmerged are only kept the first time
+        for child_id, head_container in shared_child_heads:
+          if any(c is head_container for c in family_containers[:-1]):
+            if child_id in unmerged_shared_heads:
+              family_containers = [c for c in family_containers if c is not head_container]
+            else:
+              unmerged_shared_heads[child_id] = head_container
+
+        for container in family_containers:
+          resolved_child_tails = _heap_push(resolved_child_tails, (container.lowest_depth, -order), container)
+          order += 1
+        resolved[node_id] = (resolved_child_tails, new_depth)
+
+        if node_id in uncached_subtrees:
+          key, subtree_ids, names = uncached_subtrees.pop(node_id)
+          template = SubtreeTemplate.from_entries(_heap_entries(resolved_child_tails), new_depth, nodes, subtree_ids, names)
+          if template is not None:
+            self.cache.put(key, template)
+
+    # One final ordering pass: deepest first, ties in resolution order
+    entries = sorted(_heap_entries(resolved[root_id][0]), key=lambda e: e[0], reverse=True)
+    self.visualization_containers = [container for (_, container) in entries]
 
-        # Then, we return the previous visualizations, and the visualization containers from
-        # mergeFamily
-        resolved_child_tails = sorted(resolved_child_tails + ComputationTreeParser.mergeFamily(tree, child_container_heads, self.compositions, self.grammatical_expressions, parent_depth=new_depth), key=lambda x: (-1 * x.lowest_depth))
-        return resolved_child_tails
 
-    self.visualization_containers = parseDFTree(self.computation_tree)
+def _hashable(data):
+  if isinstance(data, (list, tuple)):
+    data = tuple(data)
+    try:
+      hash(data)
+    except TypeError:
+      data = tuple(_hashable(d) for d in data)
+  return data
 
+
+# Persistent leftist heap, used by visualizeDFG to meld the resolved containers
+# of sibling subtrees.  A heap is either None or a tuple of
+# (rank, key, item, left, right); the smallest key is at the root.
+def _heap_meld(a, b):
+  if a is None:
+    return b
+  if b is None:
+    return a
+  if b[1] < a[1]:
+    a, b = b, a
+  left = a[3]
+  right = _heap_meld(a[4], b)
+  if left is None or left[0] < right[0]:
+    left, right = right, left
+  rank = right[0] + 1 if right is not None else 1
+  return (rank, a[1], a[2], left, right)
+
+def _heap_push(heap, key, item):
+  return _heap_meld(heap, (1, key, item, None, None))
+
+def _heap_pop(heap):
+  """
+  Returns the item with the smallest key, and the heap without it
+  """
+  return heap[2], _heap_meld(heap[3], heap[4])
+
+def _heap_entries(heap):
+  """
+  Returns every (key, item) pair in the heap, in no particular order
+  """
+  entries = []
+  stack = [heap]
+  while stack:
+    h = stack.pop()
+    if h is not None:
+      entries.append((h[1], h[2]))
+      stack.append(h[3])
+      stack.append(h[4])
+  return entries
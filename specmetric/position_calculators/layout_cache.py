@@ -0,0 +1,238 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from specmetric.position_calculators.treemap import RECT_DTYPE, squarify_bars
+
+# Bump whenever squarify_bars lays things out differently, so layouts cached
+# on disk by an older version are not reused
+LAYOUT_VERSION = 1
+
+class LayoutCache:
+  """
+  Content-addressed cache of treemap layouts, one entry per bar.
+
+  Keys are fingerprints of a bar's values (their bytes, dtype and shape)
+  together with the width, height and padding it was laid out with, so a
+  bar whose values haven't changed is never laid out again, whatever else
+  changed in the sheet.
+
+  Layouts are kept in an in-memory LRU of up to maxsize bars and max_bytes
+  (by nbytes, so layouts mapped from disk count at their full size).  With a
+  directory, they are also written there as .npy files, which are memory
+  mapped back when they fall out of memory or in a later process.  The
+  directory is kept under max_disk_bytes by removing the least recently
+  used files.
+  """
+
+  def __init__(self, maxsize=256, directory=None, max_disk_bytes=256 * 1024 * 1024, max_bytes=64 * 1024 * 1024):
+    self.maxsize = maxsize
+    self.max_bytes = max_bytes
+    self.directory = directory
+    self.max_disk_bytes = max_disk_bytes
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.disk_evictions = 0
+    self._entries = OrderedDict()
+    self._bytes = 0
+    self._disk_bytes = None
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __getstate__(self):
+    # a copy sent to another process starts out empty, but shares the
+    # directory
+    return {'maxsize': self.maxsize, 'directory': self.directory, 'max_disk_bytes': self.max_disk_bytes, 'max_bytes': self.max_bytes}
+
+  def __setstate__(self, state):
+    self.__init__(**state)
+
+  def get(self, key):
+    with self._lock:
+      rects = self._entries.get(key)
+      if rects is not None:
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return rects
+    rects = self._load(key)
+    with self._lock:
+      if rects is None:
+        self.misses += 1
+      else:
+        self.disk_hits += 1
+        self._remember(key, rects)
+      return rects
+
+  def put(self, key, rects):
+    rects.flags.writeable = False
+    with self._lock:
+      self._remember(key, rects)
+    self._save(key, rects)
+
+  def clear(self):
+    """
+    Empties the memory tier and resets the statistics; layouts on disk are
+    kept
+    """
+    with self._lock:
+      self._entries.clear()
+      self._bytes = 0
+      self.hits = 0
+      self.disk_hits = 0
+      self.misses = 0
+      self.evictions = 0
+      self.disk_evictions = 0
+
+  def stats(self):
+    lookups = self.hits + self.disk_hits + self.misses
+    return {
+      'hits': self.hits,
+      'disk_hits': self.disk_hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'disk_evictions': self.disk_evictions,
+      'size': len(self._entries),
+      'maxsize': self.maxsize,
+      'bytes': self._bytes,
+      'max_bytes': self.max_bytes,
+      'disk_bytes': self._disk_bytes or 0,
+      'hit_rate': ((self.hits + self.disk_hits) / lookups) if lookups else 0.0
+    }
+
+  def _remember(self, key, rects):
+    previous = self._entries.pop(key, None)
+    if previous is not None:
+      self._bytes -= previous.nbytes
+    self._entries[key] = rects
+    self._bytes += rects.nbytes
+    # the newest layout stays, even if it is over max_bytes on its own
+    while len(self._entries) > self.maxsize or (self._bytes > self.max_bytes and len(self._entries) > 1):
+      (_, evicted) = self._entries.popitem(last=False)
+      self._bytes -= evicted.nbytes
+      self.evictions += 1
+
+  def _path(self, key):
+    return os.path.join(self.directory, key + '.npy')
+
+  def _load(self, key):
+    if self.directory is None:
+      return None
+    path = self._path(key)
+    try:
+      rects = np.load(path, mmap_mode='r')
+      if rects.dtype != RECT_DTYPE or rects.ndim != 1:
+        raise ValueError("not a layout")
+      # the file's time is its place in the disk LRU
+      os.utime(path)
+      return rects
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError):
+      # a corrupt or foreign file is laid out again and overwritten
+      return None
+
+  def _save(self, key, rects):
+    if self.directory is None:
+      return
+    try:
+      import tempfile
+      os.makedirs(self.directory, exist_ok=True)
+      # write to a temporary file first so readers never see half a layout
+      (fd, tmp_path) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+      try:
+        with os.fdopen(fd, 'wb') as fp:
+          np.save(fp, rects, allow_pickle=False)
+        os.replace(tmp_path, self._path(key))
+      except BaseException:
+        os.unlink(tmp_path)
+        raise
+      with self._lock:
+        if self._disk_bytes is None:
+          self._disk_bytes = self._scan()[1]
+        else:
+          self._disk_bytes += os.path.getsize(self._path(key))
+        if self._disk_bytes > self.max_disk_bytes:
+          self._trim()
+    except OSError:
+      # the disk tier is only an optimization
+      pass
+
+  def _scan(self):
+    """
+    Returns the layouts on disk, least recently used first, as (path, size,
+    time), and their total size
+    """
+    files = []
+    with os.scandir(self.directory) as entries:
+      for entry in entries:
+        if entry.name.endswith('.npy'):
+          try:
+            stat = entry.stat()
+          except FileNotFoundError:
+            continue
+          files.append((entry.path, stat.st_size, stat.st_mtime))
+    files.sort(key=lambda f: f[2])
+    return files, sum(f[1] for f in files)
+
+  def _trim(self):
+    # other processes may share the directory, so go by what is there
+    (files, total) = self._scan()
+    for (path, size, _) in files:
+      if total <= self.max_disk_bytes:
+        break
+      try:
+        os.unlink(path)
+        self.disk_evictions += 1
+      except FileNotFoundError:
+        pass
+      total -= size
+    self._disk_bytes = total
+
+
+default_layout_cache = LayoutCache()
+
+
+def layout_key(values, width, height, pad):
+  """
+  Fingerprint of a bar's values and the rectangle they are laid out in
+  """
+  values = np.ascontiguousarray(values)
+  digest = hashlib.blake2b(digest_size=20)
+  digest.update(repr((LAYOUT_VERSION, values.dtype.str, values.shape, float(width), float(height), bool(pad))).encode('utf-8'))
+  digest.update(values.data if values.dtype.kind != 'O' else repr(values.tolist()).encode('utf-8'))
+  return digest.hexdigest()
+
+
+def cached_squarify_bars(bars, width, height, pad=True, cache=None):
+  """
+  squarify_bars, with each bar's layout looked up in cache (by default,
+  default_layout_cache) first.  Bars that miss are laid out together in
+  one call.
+  """
+  cache = default_layout_cache if cache is None else cache
+  bars = [np.asarray(values) for values in bars]
+  widths = np.broadcast_to(np.asarray(width, dtype=float), (len(bars),))
+  heights = np.broadcast_to(np.asarray(height, dtype=float), (len(bars),))
+
+  keys = [layout_key(values, widths[bar], heights[bar], pad) for (bar, values) in enumerate(bars)]
+  layouts = [cache.get(key) for key in keys]
+  missing = [bar for (bar, rects) in enumerate(layouts) if rects is None]
+  if missing:
+    rects = squarify_bars([bars[bar] for bar in missing], widths[missing], heights[missing], pad=pad)
+    bounds = np.cumsum([0] + [len(bars[bar]) for bar in missing])
+    for (i, bar) in enumerate(missing):
+      layout = rects[bounds[i]:bounds[i + 1]].copy()
+      layout['bar'] = 0
+      cache.put(keys[bar], layout)
+      layouts[bar] = layout
+
+  rects = np.concatenate(layouts) if layouts else np.empty(0, dtype=RECT_DTYPE)
+  rects['bar'] = np.repeat(np.arange(len(bars)), [len(values) for values in bars])
+  return rects
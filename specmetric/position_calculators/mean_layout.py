@@ -0,0 +1,98 @@
+import numpy as np
+
+class MeanLayout:
+  """
+  Positions of the marks of a mean chart, for one or more attributes at once.
+
+  Each attribute's values are laid out along the x axis in order of size,
+  with two extra marks for the mean and the median of the values.  Rows of
+  the arrays below are attributes, and columns are marks in x order, so
+  every row has two more entries than the attribute has values.
+
+    - order: index of the value drawn at each position, where num_values
+      stands for the mean and num_values + 1 for the median
+    - values: the value drawn at each position
+    - means, medians: the mean and median of each attribute
+    - mean_index, median_index: the position of the mean and median marks
+
+  Like the sort it replaces, values that are equal come out in no particular
+  order, which changes which value is drawn where but not where marks are
+  drawn.  The mean and median go after the values they are equal to, the
+  mean before the median.
+  """
+
+  def __init__(self, values):
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+      values = values[np.newaxis, :]
+    (num_attrs, num_values) = values.shape
+    self.num_values = num_values
+    self.means = np.mean(values, axis=1)
+    self.medians = np.median(values, axis=1)
+
+    value_order = np.argsort(values, axis=1)
+    sorted_values = np.take_along_axis(values, value_order, axis=1)
+    # where the mean and median land among the sorted values, counting the
+    # other one when it comes first
+    mean_index = np.empty(num_attrs, dtype=np.intp)
+    median_index = np.empty(num_attrs, dtype=np.intp)
+    for i in range(num_attrs):
+      mean_index[i] = np.searchsorted(sorted_values[i], self.means[i], side='right')
+      median_index[i] = np.searchsorted(sorted_values[i], self.medians[i], side='right')
+    mean_first = self.means <= self.medians
+    median_index += mean_first
+    mean_index += ~mean_first
+    self.mean_index = mean_index
+    self.median_index = median_index
+
+    # everything that isn't the mean or median is a sorted value, in order
+    self.order = np.empty((num_attrs, num_values + 2), dtype=np.intp)
+    self.values = np.empty((num_attrs, num_values + 2), dtype=float)
+    rows = np.arange(num_attrs)
+    is_value = np.ones((num_attrs, num_values + 2), dtype=bool)
+    is_value[rows, mean_index] = False
+    is_value[rows, median_index] = False
+    self.order[is_value] = value_order.ravel()
+    self.values[is_value] = sorted_values.ravel()
+    self.order[rows, mean_index] = num_values
+    self.order[rows, median_index] = num_values + 1
+    self.values[rows, mean_index] = self.means
+    self.values[rows, median_index] = self.medians
+
+  def colors(self, i, name):
+    """
+    Color of each mark of the i-th attribute: mean, median, or name
+    """
+    colors = np.full(self.num_values + 2, name, dtype=object)
+    colors[self.mean_index[i]] = 'mean'
+    colors[self.median_index[i]] = 'median'
+    return colors
+
+  def take(self, i, column, mean_fill=-1, median_fill=-2):
+    """
+    column, which has an entry per value, in the x order of the i-th
+    attribute, with mean_fill and median_fill for the mean and median marks
+    """
+    column = np.asarray(column)
+    fill = np.array([mean_fill, median_fill])
+    if column.dtype.kind not in 'biuf' or fill.dtype.kind not in 'biuf':
+      column = column.astype(object)
+      fill = fill.astype(object)
+    return np.concatenate([column, fill])[self.order[i]]
+
+
+def square_offsets(values, padding=3):
+  """
+  Left edges of squares with sides sqrt(values), placed left to right with
+  padding between them.  Returns (offsets, sides).
+
+  Adds each side and then the padding to the running offset, in that order,
+  so the offsets are exactly those of the row by row loop this replaces.
+  """
+  sides = np.sqrt(values)
+  steps = np.empty(2 * max(len(sides) - 1, 0))
+  steps[0::2] = sides[:-1]
+  steps[1::2] = padding
+  offsets = np.zeros(len(sides))
+  offsets[1:] = np.cumsum(steps)[1::2]
+  return (offsets, sides)
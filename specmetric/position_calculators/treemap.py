@@ -0,0 +1,118 @@
+import numpy as np
+
+# One rectangle of a treemap: the bar it belongs to, the position of its
+# value in that bar's values, and its corner and size
+RECT_DTYPE = np.dtype([
+  ('bar', np.intp),
+  ('index', np.intp),
+  ('x', float),
+  ('y', float),
+  ('dx', float),
+  ('dy', float),
+])
+
+def squarify_bars(bars, width, height, pad=True):
+  """
+  Lays out each bar in bars, a sequence of value vectors, as a squarified
+  treemap (Bruls, Huizing, van Wijk, "Squarified Treemaps") filling a
+  width by height rectangle with its corner at 0, 0.  width and height can
+  be a number or one number per bar.
+
+  Returns a structured array of RECT_DTYPE with a rectangle per value, bar
+  by bar, and within a bar from the largest value to the smallest (equal
+  values keep their order).  With pad, rectangles are shrunk by 1 on each
+  side where they are big enough, to leave a visible border.
+
+  The rectangles are exactly those of the squarify package given the same
+  sorted values: row sums are accumulated left to right as squarify does,
+  and its aspect ratio tests are made on the same numbers.
+  """
+  bars = [np.asarray(values) for values in bars]
+  widths = np.broadcast_to(np.asarray(width, dtype=float), (len(bars),))
+  heights = np.broadcast_to(np.asarray(height, dtype=float), (len(bars),))
+  rects = np.empty(sum(len(values) for values in bars), dtype=RECT_DTYPE)
+
+  start = 0
+  for (bar, values) in enumerate(bars):
+    end = start + len(values)
+    rects['bar'][start:end] = bar
+    if len(values):
+      # largest first, equal values in their original order
+      order = len(values) - 1 - np.argsort(values[::-1], kind='stable')[::-1]
+      rects['index'][start:end] = order
+      sizes = normalize_sizes(values[order], widths[bar], heights[bar])
+      _squarify(sizes, 0., 0., widths[bar], heights[bar], rects[start:end])
+    start = end
+
+  if pad:
+    for (corner, side) in (('x', 'dx'), ('y', 'dy')):
+      padded = rects[side] > 2
+      rects[corner][padded] += 1
+      rects[side][padded] -= 2
+  return rects
+
+
+def normalize_sizes(values, width, height):
+  """
+  values scaled to add up to width * height
+  """
+  if values.dtype.kind in 'iub':
+    total = values.sum()
+  else:
+    # summed left to right, like sum(values)
+    total = np.cumsum(values, dtype=float)[-1]
+  return values.astype(float) * (width * height) / total
+
+
+def _squarify(sizes, x, y, dx, dy, rects):
+  """
+  Fills rects with the layout of sizes (sorted, largest first, and adding up
+  to dx * dy) in the rectangle at x, y
+  """
+  num_sizes = len(sizes)
+  start = 0
+  window = 16
+  with np.errstate(divide='ignore', invalid='ignore'):
+    while start < num_sizes:
+      # rows are laid along the shorter side
+      along_y = dx >= dy
+      side = dy if along_y else dx
+
+      # A row takes the next value as long as that doesn't make its worst
+      # aspect ratio any worse.  The worst ratio is that of its smallest
+      # (last) or largest (first) rectangle, so we can check every row length
+      # in a window at once, and only widen the window if the row fills it.
+      while True:
+        stop = min(num_sizes, start + window)
+        row_sums = np.cumsum(sizes[start:stop])
+        thickness = row_sums / side
+        worst = np.maximum(thickness / (sizes[start:stop] / thickness), (sizes[start] / thickness) / thickness)
+        worse = np.flatnonzero(worst[:-1] < worst[1:])
+        if len(worse):
+          row_length = worse[0] + 1
+          break
+        if stop == num_sizes:
+          row_length = stop - start
+          break
+        window *= 2
+
+      row = slice(start, start + row_length)
+      thickness = row_sums[row_length - 1] / side
+      lengths = sizes[row] / thickness
+      # offsets along the row, added up one rectangle at a time
+      offsets = np.cumsum(np.concatenate(([y if along_y else x], lengths[:-1])))
+      if along_y:
+        rects['x'][row] = x
+        rects['y'][row] = offsets
+        rects['dx'][row] = thickness
+        rects['dy'][row] = lengths
+        (x, dx) = (x + thickness, dx - thickness)
+      else:
+        rects['x'][row] = offsets
+        rects['y'][row] = y
+        rects['dx'][row] = lengths
+        rects['dy'][row] = thickness
+        (y, dy) = (y + thickness, dy - thickness)
+
+      start += row_length
+      window = max(16, 2 * row_length)
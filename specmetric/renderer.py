@@ -1,11 +1,20 @@
-import pandas as pd
-import numpy as np
-import altair as alt
-from altair import datum
-from specmetric.position_calculators.squarifier import squarify_within_bar
+from specmetric.lazy_import import lazy_import
 from collections import OrderedDict
-from pandas.api.types import is_string_dtype
-from pandas.api.types import is_numeric_dtype
+from itertools import repeat
+import concurrent.futures
+import json
+
+from specmetric import columns
+# pandas and altair take most of a second to import, so they are
+# only imported once a chart is actually built
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+alt = lazy_import('altair')
+layout_cache = lazy_import('specmetric.position_calculators.layout_cache')
+mean_layout = lazy_import('specmetric.position_calculators.mean_layout')
+chart_cache = lazy_import('specmetric.chart_cache')
+vegalite = lazy_import('specmetric.vegalite')
+countif = lazy_import('specmetric.criteria')
 
 class AltairRenderer:
   """
@@ -44,46 +53,200 @@ class AltairRenderer:
 
   Uses consistent scales across all visualizations, if possible
   Also tries to use unique IDs for post-hoc cross linking
+
+  data_dict can be any mapping of variable names to columns, such as a
+  specmetric.column_store.ColumnStore, which loads only the columns that
+  are looked up.  Only the variables a container encodes, ids and
+  input_vars are.
+
+  Treemap layouts are looked up in layout_cache (a LayoutCache, by default
+  the module wide default_layout_cache) before they are computed
+
+  With a chart_cache (a ChartCache), each container's charts are kept
+  between renderers, and only rebuilt when its chart, encodings, the
+  input_vars or the columns it reads change
+
+  Charts are put side by side, or with columns, wrapped into rows of that
+  many charts
+
+  criteria maps the names of COUNTIF(S) nodes to their range and criterion
+  pairs (see specmetric.criteria), so their factor_charts show which rows
+  match.  Masks are looked up in mask_cache (a MaskCache, by default the
+  module wide default_mask_cache) before they are computed
   """
 
-  def __init__(self, resolved_specifications, data_dict, input_vars=[]):
+  # charts are built with altair, or anything with the same API
+  alt = alt
+
+  def __init__(self, resolved_specifications, data_dict, input_vars=[], layout_cache=None, columns=None, chart_cache=None, criteria=None, mask_cache=None):
+    alt = self.alt
     self.resolved_specifications = resolved_specifications
     self.data_dict = data_dict
     self.input_vars = input_vars
+    self.layout_cache = layout_cache
+    self.chart_cache = chart_cache
+    self.columns = columns
+    self.criteria = criteria or {}
+    self.mask_cache = mask_cache
+    self.column_cache = {}
+    self.fingerprint_cache = {}
     # self.max_vector_axis = 400 # refactor
     self.vector_scale = alt.Scale(domain=[0,500])
 
-  def convert_to_charts(self):
-    charts = []
+  def convert_to_charts(self, executor=None, max_workers=None):
+    """
+    Builds the charts of every resolved specification and composes them.
+
+    Specifications only share the color scale and crosslinker selection,
+    which are made here, so with an executor their charts (layouts, datasets
+    and all) are built in parallel: executor is 'thread' or 'process' for a
+    pool of max_workers that lasts for this call, or any
+    concurrent.futures.Executor.  Charts are composed in the order of the
+    specifications either way, so the result does not depend on which
+    finishes first.
+
+    With a chart_cache, only the specifications whose charts aren't in it
+    are built.
+    """
+    alt = self.alt
     categorical_color_scale = alt.Scale(scheme='category10')
-    crosslinker = alt.selection_single(fields=['id'], on='mouseover', empty='none')
-
-    for spec in self.resolved_specifications:
+    if self.chart_cache is None:
+      crosslinker = alt.selection_single(fields=['id'], on='mouseover', empty='none')
+    else:
+      # cached charts were made with the crosslinker of an earlier render,
+      # which must be the same selection as this one's
+      crosslinker = alt.selection_single(name='crosslinker', fields=['id'], on='mouseover', empty='none')
+
+    specs = self.resolved_specifications
+    if self.chart_cache is None:
+      keys = None
+      charts = [None] * len(specs)
+    else:
+      keys = [self.chart_key(spec) for spec in specs]
+      charts = [self.chart_cache.get(key) for key in keys]
+    indices = [i for (i, cs) in enumerate(charts) if cs is None]
+    missing = [specs[i] for i in indices]
+
+    if executor is None:
       # Render altair chart, but make sure that we have all needed scales
       # defined, including colors, since they will be shared.
-      charts.append(self.build_chart(spec, categorical_color_scale, crosslinker))
+      built = [self.build_chart(spec, categorical_color_scale, crosslinker) for spec in missing]
+    elif executor == 'thread':
+      with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        built = list(pool.map(self.build_chart, missing, repeat(categorical_color_scale), repeat(crosslinker)))
+    elif executor == 'process':
+      # the renderer, with all of its data, is sent to each worker once
+      # rather than with every specification
+      with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_set_worker_renderer, initargs=(self,)) as pool:
+        built = list(pool.map(_build_worker_chart, indices, repeat(categorical_color_scale), repeat(crosslinker)))
+    else:
+      built = list(executor.map(self.build_chart, missing, repeat(categorical_color_scale), repeat(crosslinker)))
+
+    for (i, cs) in zip(indices, built):
+      charts[i] = cs
+      if keys is not None:
+        self.chart_cache.put(keys[i], cs)
 
     return self.flatten_charts(charts)
 
-  def flatten_charts(self, charts):
-    # add (+) together second level charts, and union (|) the first level results
-    result_chart = None
-    for cs in charts:
-      curr = None
-      for c in cs:
-        if curr:
-          curr = curr + c
-        else:
-          curr = c
-
-      if result_chart:
-        result_chart = result_chart | curr
-      else:
-        result_chart = curr
+  def chart_key(self, spec):
+    """
+    Key of spec's charts in the chart_cache: its chart and encodings, the
+    input variables, fingerprints of the columns it reads, and its criteria
+    """
+    pairs = self.criteria.get(spec.root_node.name)
+    names = set(spec.encodings) | set(self.input_vars) | {'ids'} | set(pairs[::2] if pairs else ())
+    fingerprints = {name: (self.fingerprint(name) if name in self.data_dict else None) for name in names}
+    extra = None
+    if pairs:
+      extra = [pairs, [countif.criterion_value(name, self.data_dict) for name in pairs[1::2]]]
+    backend = getattr(self.alt, '__name__', type(self).__name__)
+    return chart_cache.chart_key(backend, spec.valid_chart, spec.encodings, self.input_vars, fingerprints, extra)
+
+  def fingerprint(self, name):
+    if name not in self.fingerprint_cache:
+      self.fingerprint_cache[name] = chart_cache.column_fingerprint(self.column(name))
+    return self.fingerprint_cache[name]
+
+  def criteria_mask(self, spec, rows):
+    """
+    Mask of the rows that meet the criteria of spec's COUNTIF(S), if it has
+    criteria and they line up with rows rows, else None
+    """
+    pairs = self.criteria.get(spec.root_node.name)
+    if not pairs or any(name not in self.data_dict for name in pairs[::2]):
+      return None
+    try:
+      mask = countif.criteria_mask(pairs, self.column, lambda name: countif.criterion_value(name, self.data_dict), self.fingerprint, self.mask_cache)
+    except ValueError:
+      return None
+    return mask if len(mask) == rows else None
 
-    return result_chart
+  def flatten_charts(self, charts):
+    """
+    Layers the charts of each specification, and puts the layered charts
+    side by side (or in rows of self.columns).  Each is composed in one
+    call, since adding charts one at a time with + and | copies everything
+    added so far every time.
+    """
+    alt = self.alt
+    layers = [cs[0] if len(cs) == 1 else alt.layer(*cs) for cs in charts if cs]
+    if not layers:
+      return None
+    if self.columns is not None:
+      return alt.concat(*layers, columns=self.columns)
+    if len(layers) == 1:
+      return layers[0]
+    return alt.hconcat(*layers)
+
+  def dataset(self, data):
+    """
+    Converts data, a DataFrame or a dict of equally long columns, to inline
+    data that several layers can share.  Altair moves inline data to the
+    datasets at the top level of the spec, named by a hash of its values, so
+    a dataset shared by every layer of a chart (or by several charts) is
+    written out once.  Anything a single layer needs on top of its base
+    dataset should be a transform, not another copy of the data.
+    """
+    names = [str(name) for name in data]
+    columns = [self.json_column(data[name]) for name in data]
+    # a tuple rather than a list, since Altair deep copies lists (but not
+    # tuples) every time a chart is changed or layered
+    return {'values': vegalite.Rows(dict(zip(names, row)) for row in zip(*columns))}
+
+  def json_column(self, values):
+    """
+    values as a list of plain Python values, with None for missing ones
+    """
+    if not isinstance(values, np.ndarray):
+      # a Series infers the type of a list without turning mixed numbers and
+      # strings into strings, like an array would
+      values = pd.Series(values).to_numpy()
+    missing = pd.isna(values)
+    if missing.any():
+      values = values.astype(object)
+      values[missing] = None
+    return values.tolist()
+
+  def column(self, name):
+    """
+    data_dict[name] as a Column (see specmetric.columns), which holds on to
+    the arrays it was given rather than copying them
+    """
+    if name not in self.column_cache:
+      self.column_cache[name] = columns.column(self.data_dict[name])
+    return self.column_cache[name]
+
+  def shorthand(self, data, column):
+    """
+    column with its Vega-Lite type as inferred from data, since Altair only
+    infers types of fields in charts given a DataFrame
+    """
+    alt = self.alt
+    return '{}:{}'.format(column, alt.utils.infer_vegalite_type(np.asarray(data[column]))[0].upper())
 
   def build_chart(self, spec, categorical_color_scale, crosslinker):
+    alt = self.alt
     charts = []
     scalar_data = OrderedDict()
     vector_data = OrderedDict()
@@ -126,9 +289,9 @@ class AltairRenderer:
 
         # # first, draw the scalar bars
         title = "Comparison of {} and {}".format(scalar_keys[0], scalar_keys[1])
-        chart = alt.Chart(chart_data).mark_bar(opacity=opacity, size=bar_width).encode(
-          x=alt.X('scalar_names', axis=alt.Axis(title='')),
-          y=alt.Y('scalar_values', axis=alt.Axis(title='magnitude'))
+        chart = alt.Chart(self.dataset(chart_data)).mark_bar(opacity=opacity, size=bar_width).encode(
+          x=alt.X('scalar_names:N', axis=alt.Axis(title='')),
+          y=alt.Y('scalar_values:Q', axis=alt.Axis(title='magnitude'))
         ).properties(width=total_width, height=total_height, title=title)
         charts.append(chart)
 
@@ -137,56 +300,49 @@ class AltairRenderer:
         # existing bars with spacefilling.  So we set their opacity to 0.
 
         opacity=0.2
-        # then, draw any vector encodings
-        sums = [np.sum(d) for (_,d) in vector_data.items()]
-        max_total = max(sums)
+        # then, draw any vector encodings, leaving out blanks
+        bar_columns = [self.column(attr) for attr in vector_data]
+        bars = [c.compress() for c in bar_columns]
+        sums = [np.sum(values) for values in bars]
 
         # We have a spacefilling visualization
         # we use a square packing algorithm
         # we have to calculate the offsets, however.
         num_bars = len(vector_data.keys())
         original_column_names = list(vector_data.keys())
-        total_bar_data = []
-        for i in np.arange(num_bars):
-          colname = original_column_names[i]
-          offset = ((i + 0.5) * bar_padding) + (i * bar_width)
-
-          values = vector_data[colname]
-          total = np.sum(values)
-
-          # We actually want to pass in the height and width 
-          # in the bar chart's target encoding
-          # The bar width is a little harder to reason about.
-          # bar_height = (total / max_total) * total_height
-          # However, we need to normalize things or else the
-          # padding calculations break
-          modulated_bar_height = 100
-          squares = squarify_within_bar(self.data_dict['ids'], values, bar_width, modulated_bar_height, pad=True)
-          height_multiplier = total / modulated_bar_height
-          
-          bar_data = pd.DataFrame()
-          bar_data['__x__'] = squares['x'] + offset
-          bar_data['__x2__'] = squares['x'] + offset + squares['dx']
-          bar_data['__y__'] = squares['y'] * height_multiplier
-          bar_data['__y2__'] = (squares['y'] + squares['dy']) * height_multiplier
-          bar_data['color'] = colname
-          bar_data['part of'] = scalar_keys[i]
-          bar_data['id'] = squares.index.values
-          for input_var in self.input_vars:
-            bar_data[input_var] = self.data_dict[input_var]
-
-          total_bar_data.append(bar_data)
-
-        total_bar_df = pd.concat(total_bar_data)
+        # The bars sit on the scalar bars' magnitude axis, so each one has to
+        # end up as high as its total.  We need to normalize things or else
+        # the padding calculations break, so every bar is laid out 100 high
+        # and then stretched to its total
+        modulated_bar_height = 100
+        ids = self.column('ids')
+        squares = layout_cache.cached_squarify_bars(bars, bar_width, modulated_bar_height, pad=True, cache=self.layout_cache)
+        # the row of each square, in the columns bars were taken from
+        starts = np.cumsum([0] + [len(values) for values in bars])
+        rows = np.concatenate([bar_columns[i].rows(squares['index'][starts[i]:starts[i + 1]]) for i in range(num_bars)])
+        bar = squares['bar']
+        offsets = ((np.arange(num_bars) + 0.5) * bar_padding) + (np.arange(num_bars) * bar_width)
+        height_multipliers = np.asarray(sums, dtype=float) / modulated_bar_height
+
+        total_bar_data = OrderedDict()
+        total_bar_data['__x__'] = squares['x'] + offsets[bar]
+        total_bar_data['__x2__'] = squares['x'] + offsets[bar] + squares['dx']
+        total_bar_data['__y__'] = squares['y'] * height_multipliers[bar]
+        total_bar_data['__y2__'] = (squares['y'] + squares['dy']) * height_multipliers[bar]
+        total_bar_data['color'] = np.asarray(original_column_names, dtype=object)[bar]
+        total_bar_data['part of'] = np.asarray(scalar_keys[:num_bars], dtype=object)[bar]
+        total_bar_data['id'] = ids.filled(rows)
+        for input_var in self.input_vars:
+          total_bar_data[input_var] = self.column(input_var).filled(rows)
 
         title = "Comparison of sum of {} and {}".format(vector_keys[0], vector_keys[1])
-        tooltip_columns = sorted(list(set(total_bar_df.columns.values) & set(self.input_vars + ['id', 'part of'])))
-        ratio_plot = alt.Chart(total_bar_df).mark_rect(opacity=0.2).encode(
-          x=alt.X('__x__', axis=alt.Axis(title='', labels=False), scale=alt.Scale(domain=[0,total_width])),
-          y=alt.Y('__y__', axis=alt.Axis(title='magnitude')),
+        tooltip_columns = [self.shorthand(total_bar_data, col) for col in sorted(set(total_bar_data) & set(self.input_vars + ['id', 'part of']))]
+        ratio_plot = alt.Chart(self.dataset(total_bar_data)).mark_rect(opacity=0.2).encode(
+          x=alt.X('__x__:Q', axis=alt.Axis(title='', labels=False), scale=alt.Scale(domain=[0,total_width])),
+          y=alt.Y('__y__:Q', axis=alt.Axis(title='magnitude')),
           x2=alt.X2('__x2__'),
           y2=alt.Y2('__y2__'),
-          color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color', scale=categorical_color_scale, legend=None)),
+          color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color:N', scale=categorical_color_scale, legend=None)),
           tooltip=tooltip_columns
         ).properties(width=total_width, height=total_height, title=title).add_selection(crosslinker)
         charts.append(ratio_plot)
@@ -195,81 +351,118 @@ class AltairRenderer:
       # first gets x
       # next gets y
       # last gets color
+      # With criteria, every row is marked by whether it meets them, from
+      # masks computed once over whole columns, and counts are split by that
+      matched = self.criteria_mask(spec, len(self.column(vector_keys[0]))) if vector_keys else None
+      matching = ''
+      if matched is not None:
+        pairs = self.criteria[spec.root_node.name]
+        matching = " ({} matching {})".format(int(matched.sum()), ', '.join(
+          countif.Criterion(countif.criterion_value(criterion, self.data_dict)).describe(name) for (name, criterion) in zip(pairs[::2], pairs[1::2])))
       if (len(vector_keys) == 1):
         # just a bar chart
-        title = "Frequency of Values in {}".format(vector_keys[0])
-        values = self.data_dict[vector_keys[0]];
+        title = "Frequency of Values in {}".format(vector_keys[0]) + matching
         # We want to show distribution of values
-        # We skip the header rows
-        values_df = pd.DataFrame(data={'val': [v for v in values if (v is not None and v != '')]})
-
-        if (is_numeric_dtype(values_df.val)):
-          dist_chart = alt.Chart(values_df).mark_bar().encode(
-            alt.X("val:Q", bin=True),
-            y='count()',
+        # We skip blanks, like the header rows
+        values = self.column(vector_keys[0])
+        values_df = pd.DataFrame(data={'val': values.compress()}, copy=False)
+        matches = None if matched is None else (matched if values.valid is None else matched[values.valid])
+
+        if (pd.api.types.is_numeric_dtype(values_df.val)):
+          encoding = {'x': alt.X("val:Q", bin=True), 'y': 'count()'}
+          if matches is not None:
+            values_df['criteria'] = np.where(matches, 'matching', 'not matching')
+            encoding['color'] = 'criteria:N'
+          dist_chart = alt.Chart(self.dataset(values_df)).mark_bar().encode(**encoding
           ).properties(width=total_width, height=total_height, title=title
                 ).add_selection(crosslinker)
-        else:
+        elif matches is None:
           value_counts = values_df.val.value_counts()
           grouped_df = pd.DataFrame({'val': value_counts.index, 'amt': value_counts})
-          dist_chart = alt.Chart(grouped_df).mark_bar().encode(
-            x='val',
-            y='amt'
+          dist_chart = alt.Chart(self.dataset(grouped_df)).mark_bar().encode(
+            x='val:N',
+            y='amt:Q'
+          ).properties(width=total_width, height=total_height, title=title
+                ).add_selection(crosslinker)
+        else:
+          # the counts of each value, matching and not, in one pass
+          (codes, uniques) = pd.factorize(values_df.val)
+          counts = np.bincount(codes * 2 + matches, minlength=2 * len(uniques))
+          grouped_df = pd.DataFrame({
+            'val': np.repeat(np.asarray(uniques, dtype=object), 2),
+            'criteria': np.tile(np.array(['not matching', 'matching'], dtype=object), len(uniques)),
+            'amt': counts})
+          grouped_df = grouped_df[grouped_df.amt > 0]
+          dist_chart = alt.Chart(self.dataset(grouped_df)).mark_bar().encode(
+            x='val:N',
+            y='amt:Q',
+            color='criteria:N'
           ).properties(width=total_width, height=total_height, title=title
                 ).add_selection(crosslinker)
 
         charts.append(dist_chart)
       elif (len(vector_keys) == 2):
-        title = "Counts of values in {} and {}".format(vector_keys[0], vector_keys[1])
-        values_x = self.data_dict[vector_keys[0]];
-        values_y = self.data_dict[vector_keys[1]];
+        title = "Counts of values in {} and {}".format(vector_keys[0], vector_keys[1]) + matching
+        values_x = self.column(vector_keys[0])
+        values_y = self.column(vector_keys[1])
         # We want to show distribution of values
-        # We skip the header rows
-        values_df = pd.DataFrame(data={'values_x': [v for v in values_x if (v is not None and v != '')],
-                                      'values_y': [v for v in values_y if (v is not None and v != '')]})
-
-        if (is_numeric_dtype(values_df.values_x)):
-          dist_chart = alt.Chart(values_df).mark_point().encode(
-            alt.X("values_x", bin=True),
-            alt.Y("values_y"),
-            size='count()',
+        # We skip rows with a blank in any column, like the header rows
+        valid = columns.all_valid(values_x, values_y)
+        values_df = pd.DataFrame(data={'values_x': values_x.compress(valid),
+                                      'values_y': values_y.compress(valid)}, copy=False)
+        encoding = {'size': 'count()'}
+        if matched is not None:
+          values_df['criteria'] = np.where(matched if valid is None else matched[valid], 'matching', 'not matching')
+          encoding['color'] = 'criteria:N'
+
+        if (pd.api.types.is_numeric_dtype(values_df.values_x)):
+          dist_chart = alt.Chart(self.dataset(values_df)).mark_point().encode(
+            alt.X(self.shorthand(values_df, 'values_x'), bin=True),
+            alt.Y(self.shorthand(values_df, 'values_y')),
+            **encoding
           ).properties(width=total_width, height=total_height, title=title
                 ).add_selection(crosslinker)
         else:
-          dist_chart = alt.Chart(values_df).mark_point().encode(
-            alt.X("values_x"),
-            alt.Y("values_y"),
-            size='count()',
+          dist_chart = alt.Chart(self.dataset(values_df)).mark_point().encode(
+            alt.X(self.shorthand(values_df, 'values_x')),
+            alt.Y(self.shorthand(values_df, 'values_y')),
+            **encoding
           ).properties(width=total_width, height=total_height, title=title
                 ).add_selection(crosslinker)
 
         charts.append(dist_chart)
       elif (len(vector_keys) > 2):
-        title = "Comparison of values in {} and {} by {}".format(vector_keys[0], vector_keys[1], vector_keys[2])
+        title = "Comparison of values in {} and {} by {}".format(vector_keys[0], vector_keys[1], vector_keys[2]) + matching
 
-        values_x = self.data_dict[vector_keys[0]];
-        values_y = self.data_dict[vector_keys[1]];
-        values_color = self.data_dict[vector_keys[2]];
+        values_x = self.column(vector_keys[0])
+        values_y = self.column(vector_keys[1])
+        values_color = self.column(vector_keys[2])
         # We want to show distribution of values
-        # We skip the header rows
-        values_df = pd.DataFrame(data={'values_x': [v for v in values_x if (v is not None and v != '')],
-                                      'values_y': [v for v in values_y if (v is not None and v != '')],
-                                      'values_color': [v for v in values_color if (v is not None and v != '')]})
-
-        if (is_numeric_dtype(values_df.values_x)):
-          dist_chart = alt.Chart(values_df).mark_point().encode(
-            alt.X("values_x", bin=True),
-            alt.Y("values_y"),
-            color='values_color',
-            size='count()',
+        # We skip rows with a blank in any column, like the header rows
+        valid = columns.all_valid(values_x, values_y, values_color)
+        values_df = pd.DataFrame(data={'values_x': values_x.compress(valid),
+                                      'values_y': values_y.compress(valid),
+                                      'values_color': values_color.compress(valid)}, copy=False)
+        encoding = {'size': 'count()'}
+        if matched is not None:
+          # color is taken, so matches get their own shape
+          values_df['criteria'] = np.where(matched if valid is None else matched[valid], 'matching', 'not matching')
+          encoding['shape'] = 'criteria:N'
+
+        if (pd.api.types.is_numeric_dtype(values_df.values_x)):
+          dist_chart = alt.Chart(self.dataset(values_df)).mark_point().encode(
+            alt.X(self.shorthand(values_df, 'values_x'), bin=True),
+            alt.Y(self.shorthand(values_df, 'values_y')),
+            color=self.shorthand(values_df, 'values_color'),
+            **encoding
           ).properties(width=total_width, height=total_height, title=title
                 ).add_selection(crosslinker)
         else:
-          dist_chart = alt.Chart(values_df).mark_point().encode(
-            alt.X("values_x"),
-            alt.Y("values_y"),
-            color='values_color',
-            size='count()',
+          dist_chart = alt.Chart(self.dataset(values_df)).mark_point().encode(
+            alt.X(self.shorthand(values_df, 'values_x')),
+            alt.Y(self.shorthand(values_df, 'values_y')),
+            color=self.shorthand(values_df, 'values_color'),
+            **encoding
           ).properties(width=total_width, height=total_height, title=title
                 ).add_selection(crosslinker)
 
@@ -278,13 +471,12 @@ class AltairRenderer:
       # Need to add functionality for having two vectors, I guess?  Maybe we just show factor chart.
       for attr in vector_keys:
         title = "Frequency of Values in {}".format(vector_keys[0])
-        values = self.data_dict[attr];
         # We want to show distribution of values
-        # We skip the header rows
-        values_df = pd.DataFrame(data={'val': [v for v in values if (v is not None and v != '')]})
+        # We skip blanks, like the header rows
+        values_df = pd.DataFrame(data={'val': self.column(attr).compress()}, copy=False)
 
-        if (is_numeric_dtype(values_df.val)):
-          dist_chart = alt.Chart(values_df).mark_bar().encode(
+        if (pd.api.types.is_numeric_dtype(values_df.val)):
+          dist_chart = alt.Chart(self.dataset(values_df)).mark_bar().encode(
             alt.X("val:Q", bin=True),
             y='count()',
           ).properties(width=total_width, height=total_height, title=title
@@ -292,9 +484,9 @@ class AltairRenderer:
         else:
           value_counts = values_df.val.value_counts()
           grouped_df = pd.DataFrame({'val': value_counts.index, 'amt': value_counts})
-          dist_chart = alt.Chart(grouped_df).mark_bar().encode(
-            x='val',
-            y='amt'
+          dist_chart = alt.Chart(self.dataset(grouped_df)).mark_bar().encode(
+            x='val:N',
+            y='amt:Q'
           ).properties(width=total_width, height=total_height, title=title
                 ).add_selection(crosslinker)
 
@@ -306,68 +498,62 @@ class AltairRenderer:
         # We lay out the marks on an x axis in order of their value
         # and also draw the mean, annotated
 
-        for attr in vector_keys:
-          values = self.data_dict[attr]
+        # sort every attribute and find its mean and median in one go, or
+        # one at a time if they don't have the same number of values (once
+        # blanks are left out)
+        attr_columns = [self.column(attr) for attr in vector_keys]
+        attr_values = [c.compress() for c in attr_columns]
+        if len(set(len(values) for values in attr_values)) == 1:
+          layout = mean_layout.MeanLayout(attr_values)
+          layouts = [(layout, i) for i in range(len(attr_values))]
+        else:
+          layouts = [(mean_layout.MeanLayout(values), 0) for values in attr_values]
+
+        for attr, attr_column, (layout, row) in zip(vector_keys, attr_columns, layouts):
+          num_values = layout.num_values
+          # the rows of the values that are drawn
+          rows = None if attr_column.valid is None else np.flatnonzero(attr_column.valid)
           if 'ids' in self.data_dict:
-            ids = self.data_dict['ids']
+            ids = self.column('ids').filled(rows)
           else:
-            ids = range(0,len(values))
-
-          mean_value = np.mean(values)
-          median_value = np.median(values)
-          values_df = pd.DataFrame(data={'val': values, 'is_mean': False, 'is_median': False}, index=ids)
+            ids = np.arange(num_values) if rows is None else rows
+
+          mean_value = layout.means[row]
+          median_value = layout.medians[row]
+          values_df = pd.DataFrame(data={
+            'val': layout.values[row],
+            'is_mean': layout.order[row] == num_values,
+            'is_median': layout.order[row] == num_values + 1,
+          })
           for input_var in self.input_vars:
-            values_df[input_var] = self.data_dict[input_var]
+            values_df[input_var] = layout.take(row, self.column(input_var).filled(rows))
 
           for skipped_var in skipped_keys:
-            values_df[skipped_var] = self.data_dict[skipped_var]
-
-          mean_row = []
-          median_row = []
-          for col in values_df.columns.values:
-            if col == 'val':
-              mean_row.append(mean_value)
-              median_row.append(median_value)
-            elif col == 'is_mean':
-              mean_row.append(True)
-              median_row.append(False)
-            elif col == 'is_median':
-              mean_row.append(False)
-              median_row.append(True)
-            else:
-              mean_row.append(-1)
-              median_row.append(-2)
-
-          values_df.loc[len(values_df)] = mean_row
-          values_df.loc[len(values_df)] = median_row
-
-          values_df = values_df.sort_values(by='val')
-          values_df['id'] = values_df.index.values
-          values_df = values_df.reset_index(drop=True)
-          values_df['x'] = values_df.index.values # should give 0-indexed counter
-
-          tooltip_columns = sorted(list(set(values_df.columns.values) & set(self.input_vars + ['id'])))
-
-          mean_x_location = values_df[values_df['is_mean']].iloc[0].x
-          median_x_location = values_df[values_df['is_median']].iloc[0].x          
-          values_df['color'] = attr
-          values_df['color'] = values_df.apply((lambda x: 'mean' if x.is_mean else x.color), axis=1)
-          values_df['color'] = values_df.apply((lambda x: 'median' if x.is_median else x.color), axis=1)
+            values_df[skipped_var] = layout.take(row, self.column(skipped_var).filled(rows))
+
+          # the mean and median marks take the next ids after the values'
+          values_df['id'] = layout.take(row, ids, num_values, num_values + 1)
+          values_df['x'] = np.arange(num_values + 2)
+
+          tooltip_columns = [self.shorthand(values_df, col) for col in sorted(set(values_df.columns.values) & set(self.input_vars + ['id']))]
+
+          mean_x_location = layout.mean_index[row].item()
+          median_x_location = layout.median_index[row].item()
+          values_df['color'] = layout.colors(row, attr)
 
           mark = spec.encodings[attr]['mark'] or 'square'
           if mark == 'line' and ((len(vector_keys) < 2) or ('skip' not in spec.encodings[attr])):
-            values_df['y'] = 0
-            values_df['x2'] = values_df['x']
-            values_df['y2'] = values_df['val']
             title = "Distributions of {}".format(attr)
-            line_plot = alt.Chart(values_df).mark_line().encode(
-              x=alt.X('x', axis=alt.Axis(title='', labels=False)),
-              y=alt.Y('y', scale=self.vector_scale, axis=alt.Axis(title=attr)),
-              x2=alt.X2('x2'),
-              y2=alt.Y2('y2'),
+            line_plot = alt.Chart(self.dataset(values_df)).transform_calculate(
+              y='0'
+            ).mark_line().encode(
+              x=alt.X('x:Q', axis=alt.Axis(title='', labels=False)),
+              y=alt.Y('y:Q', scale=self.vector_scale, axis=alt.Axis(title=attr)),
+              x2=alt.X2('x'),
+              y2=alt.Y2('val'),
               tooltip=tooltip_columns,
-              color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color', scale=categorical_color_scale, legend=None)),
-              # color=alt.Color('color', scale=categorical_color_scale, legend=None),
+              color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color:N', scale=categorical_color_scale, legend=None)),
+              # color=alt.Color('color:N', scale=categorical_color_scale, legend=None),
             ).properties(width=total_width, height=total_height, title=title
             # )
             ).add_selection(crosslinker)
@@ -375,68 +561,59 @@ class AltairRenderer:
 
           if mark == 'bar-compare':
             # we draw small bars at each point
+            # one bar per skipped value, folded out of the values themselves
             bar_width = 0.25
-            ratio_bar_dataframes = []
-            for i, bar_type in enumerate(skipped_keys):
-              ratio_bar_data = pd.DataFrame()
-              ratio_bar_data['x-ratio'] = values_df['x'] + (i*bar_width)
-              ratio_bar_data['y-ratio'] = 0
-              ratio_bar_data['x2-ratio'] = values_df['x'] + ((i+1)*bar_width)
-              ratio_bar_data['y2-ratio'] = values_df[bar_type]
-              ratio_bar_data['color-ratio'] = bar_type
-              ratio_bar_data['id'] = values_df['id']
-              ratio_bar_dataframes.append(ratio_bar_data)
-
-            ratio_bar_data = pd.concat(ratio_bar_dataframes)
-            bar_plot = alt.Chart(ratio_bar_data).mark_rect(opacity=0.4).encode(
-              x=alt.X('x-ratio', axis=alt.Axis(title='', labels=False)),
-              y=alt.Y('y-ratio', axis=alt.Axis(title="Ratio of {} to {}".format(skipped_keys[0], skipped_keys[1]), labels=False), scale=self.vector_scale),
+            bar_plot = alt.Chart(self.dataset(values_df)).transform_fold(
+              skipped_keys, as_=['color-ratio', 'y2-ratio']
+            ).transform_calculate(**{
+              'ratio-index': "indexof({}, datum['color-ratio'])".format(json.dumps(skipped_keys)),
+              'x-ratio': "datum.x + datum['ratio-index'] * {}".format(bar_width),
+              'x2-ratio': "datum.x + (datum['ratio-index'] + 1) * {}".format(bar_width),
+              'y-ratio': '0',
+            }).mark_rect(opacity=0.4).encode(
+              x=alt.X('x-ratio:Q', axis=alt.Axis(title='', labels=False)),
+              y=alt.Y('y-ratio:Q', axis=alt.Axis(title="Ratio of {} to {}".format(skipped_keys[0], skipped_keys[1]), labels=False), scale=self.vector_scale),
               x2=alt.X2('x2-ratio'),
               y2=alt.Y2('y2-ratio'),
-              # color=alt.Color('color-ratio', scale=categorical_color_scale, legend=None),
-              color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color-ratio', scale=categorical_color_scale, legend=None)), 
+              # color=alt.Color('color-ratio:N', scale=categorical_color_scale, legend=None),
+              color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color-ratio:N', scale=categorical_color_scale, legend=None)), 
             ).properties(width=total_width, height=total_height, title=title
             ).add_selection(crosslinker)
             # )
-            mean_x_location = values_df[values_df['is_mean']].iloc[0].x
-            median_x_location = values_df[values_df['is_median']].iloc[0].x
 
             charts.append(bar_plot)
 
           if mark == 'square':
             # We do a little hack to keep the squares the right size, but on a single chart
-            values_df['sqrtval'] = np.sqrt(values_df['val'])
-            padding=3
-            values_df['squarex'] = 0
-            for i in range(1, len(values_df)):
-              values_df.loc[i, 'squarex'] = values_df.loc[i-1, 'squarex'] + values_df.loc[i-1, 'sqrtval'] + padding
-
-            values_df['y'] = 0
-            values_df['x2'] = values_df['squarex'] + values_df['sqrtval']
-            values_df['y2'] = np.sqrt(values_df['val'])
+            (squarex, sqrtval) = mean_layout.square_offsets(layout.values[row], padding=3)
+            values_df['sqrtval'] = sqrtval
+            values_df['squarex'] = squarex
 
             title = "Distributions of {}".format(attr)
-            line_plot = alt.Chart(values_df).mark_rect(opacity=0.2).encode(
-              x=alt.X('squarex', scale=self.vector_scale, axis=alt.Axis(title='', labels=False)),
-              y=alt.Y('y', scale=self.vector_scale, axis=alt.Axis(title=attr)),
+            line_plot = alt.Chart(self.dataset(values_df)).transform_calculate(
+              y='0',
+              x2='datum.squarex + datum.sqrtval'
+            ).mark_rect(opacity=0.2).encode(
+              x=alt.X('squarex:Q', scale=self.vector_scale, axis=alt.Axis(title='', labels=False)),
+              y=alt.Y('y:Q', scale=self.vector_scale, axis=alt.Axis(title=attr)),
               x2=alt.X2('x2'),
-              y2=alt.Y2('y2'),
+              y2=alt.Y2('sqrtval'),
               tooltip=tooltip_columns,
-              color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color', scale=categorical_color_scale, legend=None)),
+              color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color:N', scale=categorical_color_scale, legend=None)),
             ).properties(width=total_width, height=total_height, title=title).add_selection(crosslinker)
             charts.append(line_plot)
-            mean_x_location = values_df[values_df['is_mean']].iloc[0].squarex
-            median_x_location = values_df[values_df['is_median']].iloc[0].squarex
+            mean_x_location = squarex[layout.mean_index[row]].item()
+            median_x_location = squarex[layout.median_index[row]].item()
 
           # whatever mark, we put dotted annotations of where the mean and median are
-          mean_line_data = pd.DataFrame(data={
+          mean_line_data = self.dataset(pd.DataFrame(data={
             'x': [mean_x_location - 0.1, mean_x_location - 0.1], 
             'y': [0, total_height],
-            'color': ['mean', 'mean']})
+            'color': ['mean', 'mean']}))
           mean_line = alt.Chart(mean_line_data).mark_line(strokeDash=[5,3], opacity=0.5, strokeWidth=2).encode(
-            x=alt.X('x'),
-            y=alt.Y('y'),
-            color=alt.Color('color', scale=categorical_color_scale, legend=None)
+            x=alt.X('x:Q'),
+            y=alt.Y('y:Q'),
+            color=alt.Color('color:N', scale=categorical_color_scale, legend=None)
           )
           mean_text = alt.Chart(mean_line_data).mark_text(
             align='left',
@@ -444,25 +621,25 @@ class AltairRenderer:
             fontSize=20,
             dx=7
           ).encode(
-            x=alt.X('x'),
-            y=alt.Y('y'),
-            color=alt.Color('color', scale=categorical_color_scale, legend=None),
+            x=alt.X('x:Q'),
+            y=alt.Y('y:Q'),
+            color=alt.Color('color:N', scale=categorical_color_scale, legend=None),
             text=alt.value("mean = {0:.2f}".format(mean_value))
           ).transform_filter(
-            (datum.y > 0)
+            (alt.datum.y > 0)
           )
           if (len(vector_keys) == 1 or ('skip' not in spec.encodings[attr])): 
             charts.append(mean_line)
             charts.append(mean_text)
 
-          median_line_data = pd.DataFrame(data={
+          median_line_data = self.dataset(pd.DataFrame(data={
             'x': [median_x_location + 0.1, median_x_location + 0.1], 
             'y': [0, total_height * 0.8],
-            'color': ['median', 'median']})
+            'color': ['median', 'median']}))
           median_line = alt.Chart(median_line_data).mark_line(strokeDash=[5,3], opacity=0.5, strokeWidth=2).encode(
-            x=alt.X('x'),
-            y=alt.Y('y'),
-            color=alt.Color('color', scale=categorical_color_scale, legend=None)
+            x=alt.X('x:Q'),
+            y=alt.Y('y:Q'),
+            color=alt.Color('color:N', scale=categorical_color_scale, legend=None)
           )
           median_text = alt.Chart(median_line_data).mark_text(
             align='left',
@@ -470,12 +647,12 @@ class AltairRenderer:
             fontSize=20,
             dx=7
           ).encode(
-            x=alt.X('x'),
-            y=alt.Y('y'),
-            color=alt.Color('color', scale=categorical_color_scale, legend=None),
+            x=alt.X('x:Q'),
+            y=alt.Y('y:Q'),
+            color=alt.Color('color:N', scale=categorical_color_scale, legend=None),
             text=alt.value("median = {0:.2f}".format(median_value))
           ).transform_filter(
-            (datum.y > 0)
+            (alt.datum.y > 0)
           )
           if (len(vector_keys) == 1 or ('skip' not in spec.encodings[attr])):
             charts.append(median_line)
@@ -486,14 +663,14 @@ class AltairRenderer:
             scalar_key = scalar_keys[0]
             sqrt_val = np.sqrt(mean_value)
             # we draw a line on the mean chart
-            mean_sqrt_data = pd.DataFrame(data={
+            mean_sqrt_data = self.dataset(pd.DataFrame(data={
               'x': [mean_x_location - 0.1, mean_x_location - 0.1 + sqrt_val], 
               'y': [sqrt_val, sqrt_val],
-              'color': ['sqrt', 'sqrt']})
+              'color': ['sqrt', 'sqrt']}))
             mean_sqrt_line = alt.Chart(mean_sqrt_data).mark_line(opacity=1.0, strokeWidth=5).encode(
-              x=alt.X('x'),
-              y=alt.Y('y'),
-              color=alt.Color('color', scale=categorical_color_scale, legend=None)
+              x=alt.X('x:Q'),
+              y=alt.Y('y:Q'),
+              color=alt.Color('color:N', scale=categorical_color_scale, legend=None)
             )
             mean_sqrt_text = alt.Chart(mean_sqrt_data).mark_text(
               align='left',
@@ -501,12 +678,12 @@ class AltairRenderer:
               fontSize=20,
               dx=7
             ).encode(
-              x=alt.X('x'),
-              y=alt.Y('y'),
-              color=alt.Color('color', scale=categorical_color_scale, legend=None),
+              x=alt.X('x:Q'),
+              y=alt.Y('y:Q'),
+              color=alt.Color('color:N', scale=categorical_color_scale, legend=None),
               text=alt.value(scalar_key + " = {0:.2f}".format(sqrt_val))
             ).transform_filter(
-              (datum.x > mean_x_location)
+              (alt.datum.x > mean_x_location)
             )
             charts.append(mean_sqrt_line)
             charts.append(mean_sqrt_text)
@@ -514,8 +691,9 @@ class AltairRenderer:
     elif (spec.valid_chart == 'spacefilling'):
 
       if (len(vector_data.keys()) > 0):
-        # then, draw any vector encodings
-        sums = [np.sum(d) for (_,d) in vector_data.items()]
+        # then, draw any vector encodings, leaving out blanks
+        bars = [self.column(attr).compress() for attr in vector_data]
+        sums = [np.sum(values) for values in bars]
         max_total = max(sums)
 
         # We have a spacefilling visualization
@@ -525,35 +703,23 @@ class AltairRenderer:
         original_column_names = list(vector_data.keys())
         bar_width = 50
         bar_padding = 30
-        total_bar_data = []
-        for i in np.arange(num_bars):
-          colname = original_column_names[i]
-          offset = ((i + 1) * bar_padding) + (i * bar_width)
-
-          values = vector_data[colname]
-          total = np.sum(values)
-          bar_height = (total / max_total) * total_height
-          if 'ids' in self.data_dict:
-            ids = self.data_dict['ids']
-          else:
-            ids = range(0,len(values))
-          squares = squarify_within_bar(ids, values, bar_width, bar_height, pad=True)
-
-          bar_data = pd.DataFrame()
-          bar_data['__x__'] = squares['x'] + offset
-          bar_data['__x2__'] = squares['x'] + offset + squares['dx']
-          bar_data['__y__'] = squares['y']
-          bar_data['__y2__'] = squares['y'] + squares['dy']
-          bar_data['color'] = colname
-          total_bar_data.append(bar_data)
-
-        total_bar_df = pd.concat(total_bar_data)
-        ratio_plot = alt.Chart(total_bar_df).mark_rect(opacity=0.2).encode(
-          x=alt.X('__x__'),
-          y=alt.Y('__y__'),
+        bar_heights = (np.asarray(sums, dtype=float) / max_total) * total_height
+        squares = layout_cache.cached_squarify_bars(bars, bar_width, bar_heights, pad=True, cache=self.layout_cache)
+        bar = squares['bar']
+        offsets = ((np.arange(num_bars) + 1) * bar_padding) + (np.arange(num_bars) * bar_width)
+
+        total_bar_data = OrderedDict()
+        total_bar_data['__x__'] = squares['x'] + offsets[bar]
+        total_bar_data['__x2__'] = squares['x'] + offsets[bar] + squares['dx']
+        total_bar_data['__y__'] = squares['y']
+        total_bar_data['__y2__'] = squares['y'] + squares['dy']
+        total_bar_data['color'] = np.asarray(original_column_names, dtype=object)[bar]
+        ratio_plot = alt.Chart(self.dataset(total_bar_data)).mark_rect(opacity=0.2).encode(
+          x=alt.X('__x__:Q'),
+          y=alt.Y('__y__:Q'),
           x2=alt.X2('__x2__'),
           y2=alt.Y2('__y2__'),
-          color=alt.Color('color', scale=categorical_color_scale, legend=None)
+          color=alt.Color('color:N', scale=categorical_color_scale, legend=None)
         ).properties(width=total_width, height=total_height, title=title)
         charts.append(ratio_plot)
     elif spec.valid_chart == 'scatter_y_equals_x':
@@ -563,7 +729,9 @@ class AltairRenderer:
         vector_encodings = list(vector_data.keys())
         num_encodings = len(vector_encodings)
 
-        scatter_data = pd.DataFrame()
+        # columns of the scatter's dataset, as arrays
+        scatter_data = OrderedDict()
+        color = None
         dot_attrs = []
         line_attrs = []
         square_attrs = []
@@ -572,127 +740,145 @@ class AltairRenderer:
           if attr in vector_encodings:
             # First, check for points
             if (encodings['mark'] == 'point') and (encodings['preference'] == 'x'):
-              scatter_data['x'] = self.data_dict[attr]
+              scatter_data['x'] = self.column(attr).numbers()
               dot_attrs.append(attr)
-              scatter_data['color'] = attr
+              color = attr
             elif (encodings['mark'] == 'point') and (encodings['preference'] == 'y'):
-              scatter_data['y'] = self.data_dict[attr]
+              scatter_data['y'] = self.column(attr).numbers()
               dot_attrs.append(attr)
-              scatter_data['color'] = attr
+              color = attr
             elif (encodings['mark'] == 'line'):
               if len(vector_keys) > 1 and 'skip' in encodings:
-                scatter_data['color'] = attr # we keep the color but
-                scatter_data[attr] = self.data_dict[attr]
+                color = attr # we keep the color but
+                scatter_data[attr] = self.column(attr).numbers()
                 bar_attrs.append(attr)
                 pass # we don't want to blow out other encodings
               else:
-                scatter_data['linediff'] = self.data_dict[attr]
+                scatter_data['linediff'] = self.column(attr).numbers()
                 line_attrs.append(attr)
-                scatter_data['color'] = attr
+                color = attr
             elif (encodings['mark'] == 'square'):
               if 'skip' in encodings:
                 pass # we don't want to blow out other encodings
               else:
-                scatter_data['squarediff'] = np.sqrt(self.data_dict[attr])
+                scatter_data['squarediff'] = np.sqrt(self.column(attr).numbers())
                 square_attrs.append(attr)
-                scatter_data['color'] = attr
+                color = attr
 
           if (encodings['mark'] == 'bar-compare'):
             bar_attrs.append(attr)
-            scatter_data[attr] = self.data_dict[attr]
-            scatter_data['color-'+attr] = attr
+            scatter_data[attr] = self.column(attr).numbers()
 
         if 'ids' in self.data_dict:
-          scatter_data['id'] = self.data_dict['ids']
+          scatter_data['id'] = self.column('ids').filled()
         
         for input_var in self.input_vars:
-          scatter_data[input_var] = self.data_dict[input_var]
+          scatter_data[input_var] = self.column(input_var).filled()
+
+        num_points = len(scatter_data['x'])
+        scatter_data['color'] = [color] * num_points
+
+        # every layer draws from this one dataset, and works out its own
+        # positions from it with transforms
+        scatter_source = self.dataset(scatter_data)
 
         # Then, we build the charts
         # First, the dots
         title = "Comparison of {} and {}".format(dot_attrs[0], dot_attrs[1])
-        tooltip_columns = sorted(list(set(scatter_data.columns.values) & set(self.input_vars + ['id'])))
-        dot_plot = alt.Chart(scatter_data).mark_point().encode(
-          x=alt.X('x', axis=alt.Axis(title=dot_attrs[0]), scale=self.vector_scale),
-          y=alt.Y('y', axis=alt.Axis(title=dot_attrs[1]), scale=self.vector_scale),
-          color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color', scale=categorical_color_scale, legend=None)),
-          # color=alt.Color('color', scale=categorical_color_scale, legend=None),
+        tooltip_columns = [self.shorthand(scatter_data, col) for col in sorted(set(scatter_data) & set(self.input_vars + ['id']))]
+        dot_plot = alt.Chart(scatter_source).mark_point().encode(
+          x=alt.X('x:Q', axis=alt.Axis(title=dot_attrs[0]), scale=self.vector_scale),
+          y=alt.Y('y:Q', axis=alt.Axis(title=dot_attrs[1]), scale=self.vector_scale),
+          color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color:N', scale=categorical_color_scale, legend=None)),
+          # color=alt.Color('color:N', scale=categorical_color_scale, legend=None),
           tooltip=tooltip_columns
         ).properties(width=total_width, height=total_height, title=title)
         charts.append(dot_plot)
-        # realign the axes
-        max_pixel = scatter_data[['x', 'y']].max().max() * 1.1
-
 
         # Then, squares if they exist, or lines if they exist and squares don't
-        if 'squarediff' in scatter_data.columns.values:
-          scatter_data['squarex2'] = scatter_data['x'] + scatter_data['squarediff']
-          scatter_data['squarey2'] = scatter_data['y'] + scatter_data['squarediff']
+        if 'squarediff' in scatter_data:
           title = "Magnitudes of {}".format(square_attrs[0])
-          square_plot = alt.Chart(scatter_data).mark_rect(opacity=0.2).encode(
-            x=alt.X('x', axis=alt.Axis(title=dot_attrs[0]), scale=self.vector_scale),
-            y=alt.Y('y', axis=alt.Axis(title=dot_attrs[1]), scale=self.vector_scale),
+          square_plot = alt.Chart(scatter_source).transform_calculate(
+            squarex2='datum.x + datum.squarediff',
+            squarey2='datum.y + datum.squarediff'
+          ).mark_rect(opacity=0.2).encode(
+            x=alt.X('x:Q', axis=alt.Axis(title=dot_attrs[0]), scale=self.vector_scale),
+            y=alt.Y('y:Q', axis=alt.Axis(title=dot_attrs[1]), scale=self.vector_scale),
             x2=alt.X2('squarex2'),
             y2=alt.Y2('squarey2'),
             tooltip=tooltip_columns,
-            color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color', scale=categorical_color_scale, legend=None)),
+            color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color:N', scale=categorical_color_scale, legend=None)),
           ).properties(width=total_width, height=total_height, title=title).add_selection(crosslinker)
           charts.append(square_plot)
-          # realign the axes
-          max_pixel = scatter_data[['x', 'y', 'squarex2', 'squarey2']].max().max() * 1.1
 
-        elif ('linediff' in scatter_data.columns.values) and (len(bar_attrs) == 0):
-          scatter_data['liney2'] = scatter_data['y'] + scatter_data['linediff']
+        elif ('linediff' in scatter_data) and (len(bar_attrs) == 0):
           title = "Magnitudes of {}".format(line_attrs[0])
-          line_plot = alt.Chart(scatter_data).mark_line().encode(
-            x=alt.X('x', axis=alt.Axis(title=dot_attrs[0]), scale=self.vector_scale),
-            y=alt.Y('y', axis=alt.Axis(title=dot_attrs[1]), scale=self.vector_scale),
+          line_plot = alt.Chart(scatter_source).transform_calculate(
+            liney2='datum.y + datum.linediff'
+          ).mark_line().encode(
+            x=alt.X('x:Q', axis=alt.Axis(title=dot_attrs[0]), scale=self.vector_scale),
+            y=alt.Y('y:Q', axis=alt.Axis(title=dot_attrs[1]), scale=self.vector_scale),
             x2=alt.X2('x'),
             y2=alt.Y2('liney2'),
             tooltip=tooltip_columns,
-            color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color', scale=categorical_color_scale, legend=None)), # The diff is always the second operand
+            color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color:N', scale=categorical_color_scale, legend=None)), # The diff is always the second operand
           ).properties(width=total_width, height=total_height, title=title).add_selection(crosslinker)
           charts.append(line_plot)
-          # realign the axes
-          max_pixel = scatter_data[['x', 'y', 'liney2']].max().max() * 1.1
 
         if len(bar_attrs) > 0:
           # We need to do a little geometry here to put the lines in the most interpretable place
 
 
-          # we draw small bars at each point
+          # we draw small bars at each point, one per bar attribute, folded out
+          # of the scatter's own columns
           bar_width = 5
-          ratio_bar_dataframes = []
-          for i, bar_type in enumerate(bar_attrs):
-            ratio_bar_data = pd.DataFrame()
-            ratio_bar_data['x-ratio'] = scatter_data['x'] + (i*bar_width)
-            ratio_bar_data['x2-ratio'] = scatter_data['x'] + ((i+1)*bar_width)
-            ratio_bar_data['y-ratio'] = scatter_data['x']
-            ratio_bar_data['y2-ratio'] = scatter_data.apply(lambda d: (d['x'] - d[bar_type]) if ((d['x'] > d['y']) or (d[bar_type] == d['x'])) else (d['x'] + d[bar_type]), axis=1)
-            # ratio_bar_data['y-ratio'] = scatter_data['y']
-            # ratio_bar_data['y2-ratio'] = scatter_data['y'] - scatter_data[bar_type]
-            ratio_bar_data['color-ratio'] = bar_type
-            ratio_bar_data['id'] = self.data_dict['ids']
-            ratio_bar_dataframes.append(ratio_bar_data)
-
-          ratio_bar_data = pd.concat(ratio_bar_dataframes)
-          bar_plot = alt.Chart(ratio_bar_data).mark_rect(opacity=0.4).encode(
-            x=alt.X('x-ratio', scale=self.vector_scale),
-            y=alt.Y('y-ratio', scale=self.vector_scale),
+          bar_plot = alt.Chart(scatter_source).transform_fold(
+            bar_attrs, as_=['color-ratio', 'ratio-value']
+          ).transform_calculate(**{
+            'ratio-index': "indexof({}, datum['color-ratio'])".format(json.dumps(bar_attrs)),
+            'x-ratio': "datum.x + datum['ratio-index'] * {}".format(bar_width),
+            'x2-ratio': "datum.x + (datum['ratio-index'] + 1) * {}".format(bar_width),
+            'y-ratio': 'datum.x',
+            'y2-ratio': "(datum.x > datum.y || datum['ratio-value'] == datum.x) ? datum.x - datum['ratio-value'] : datum.x + datum['ratio-value']",
+            # 'y-ratio': 'datum.y',
+            # 'y2-ratio': "datum.y - datum['ratio-value']",
+          }).mark_rect(opacity=0.4).encode(
+            x=alt.X('x-ratio:Q', scale=self.vector_scale),
+            y=alt.Y('y-ratio:Q', scale=self.vector_scale),
             x2=alt.X2('x2-ratio'),
             y2=alt.Y2('y2-ratio'),
-            color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color-ratio', scale=categorical_color_scale, legend=None)), 
+            color=alt.condition(crosslinker, alt.value('yellow'), alt.Color('color-ratio:N', scale=categorical_color_scale, legend=None)), 
           ).properties(width=total_width, height=total_height, title=title
           ).add_selection(crosslinker)
           charts.append(bar_plot)
 
-      y_equals_x_data = pd.DataFrame(data={'x': self.vector_scale.domain, 'y': self.vector_scale.domain})
-      y_equals_x_chart = alt.Chart(y_equals_x_data).mark_line().encode(
-        x=alt.X('x'),
-        y=alt.Y('y')
+      y_equals_x_data = {'x': self.vector_scale.domain, 'y': self.vector_scale.domain}
+      y_equals_x_chart = alt.Chart(self.dataset(y_equals_x_data)).mark_line().encode(
+        x=alt.X('x:Q'),
+        y=alt.Y('y:Q')
       )
       charts.append(y_equals_x_chart)
 
     return charts
 
 
+class VegaLiteRenderer(AltairRenderer):
+  """
+  AltairRenderer that writes Vega-Lite dicts directly, through
+  specmetric.vegalite, instead of building Altair objects.  The specs are
+  the same, but are neither validated (unless to_dict(validate=True) asks)
+  nor deep copied as they are layered and concatenated.
+  """
+  alt = vegalite
+
+
+# The renderer of a process pool worker, see convert_to_charts
+_worker_renderer = None
+
+def _set_worker_renderer(renderer):
+  global _worker_renderer
+  _worker_renderer = renderer
+
+def _build_worker_chart(index, categorical_color_scale, crosslinker):
+  spec = _worker_renderer.resolved_specifications[index]
+  return _worker_renderer.build_chart(spec, categorical_color_scale, crosslinker)
@@ -0,0 +1,148 @@
+from specmetric import rules_config
+
+# Keys of an encoding template that say where and how to apply it, rather
+# than being part of the encoding
+_TEMPLATE_KEYS = ('data', 'index', 'inherit_child_mark', 'carry_child_encodings')
+
+_CHART_DATA = ('input', 'output', 'each_input')
+_MERGE_DATA = ('child_output', 'parent_output')
+
+
+class EncodingTemplate:
+  """
+  An encoding from compositions.yml, with the data it applies to resolved
+  ahead of time.
+  """
+  __slots__ = ('data', 'index', 'encoding', 'fresh_keys', 'inherit_child_mark', 'carry_child_encodings')
+
+  def __init__(self, config, valid_data):
+    self.data = config.get('data')
+    if self.data not in valid_data:
+      raise ValueError("Encoding template data must be one of {}, got {!r}".format(valid_data, self.data))
+    self.index = config.get('index')
+    self.inherit_child_mark = bool(config.get('inherit_child_mark', False))
+    self.carry_child_encodings = config.get('carry_child_encodings')
+    self.encoding = {k: v for (k, v) in config.items() if k not in _TEMPLATE_KEYS}
+    # values that have to be built per use: lists, so containers don't
+    # share them, and strings that refer to the data being encoded
+    self.fresh_keys = tuple(k for (k, v) in self.encoding.items() if isinstance(v, list) or (isinstance(v, str) and '{' in v))
+
+  def attributes(self, data):
+    """
+    The attribute names this template encodes, given the data it refers to
+    """
+    if self.data == 'each_input':
+      return data
+    if self.index is not None:
+      return (data[self.index],)
+    return (data,)
+
+  def build(self, names):
+    """
+    The encoding to apply, with any {child_output}/{parent_output}
+    references filled in from names
+    """
+    if not self.fresh_keys:
+      return self.encoding
+    encoding = dict(self.encoding)
+    for key in self.fresh_keys:
+      value = encoding[key]
+      encoding[key] = list(value) if isinstance(value, list) else value.format(**names)
+    return encoding
+
+
+class CompiledRules:
+  """
+  The grammar and composition rules compiled into dense lookup tables.
+
+  Chart types are interned to integer ids, with 0 standing for "no valid
+  chart", so every merge decision is a couple of list lookups:
+
+    merge_result[parent_id][child_id]    chart id after merging, 0 if the
+                                         charts can't be merged
+    merge_encodings[parent_id][child_id] encodings the merge adds
+    chart_encodings[chart_id]            encodings the chart type adds
+  """
+
+  def __init__(self, grammatical_expressions, compositions):
+    compositions = compositions or {}
+    charts = compositions.get('charts') or {}
+    merges = compositions.get('merges') or []
+
+    self.chart_names = [None]
+    self.chart_ids = {None: 0}
+    for name in charts:
+      self.intern_chart(name)
+    for merge in merges:
+      self.intern_chart(merge['parent'])
+      self.intern_chart(merge['child'])
+      self.intern_chart(merge['result'])
+
+    # function type -> chart id of its valid visualization
+    self.function_charts = {}
+    for (function_type, preferences) in (grammatical_expressions or {}).items():
+      chart = (preferences or {}).get('valid_visualization')
+      self.function_charts[function_type] = self.intern_chart(chart)
+
+    num_charts = len(self.chart_names)
+    self.chart_encodings = [()] * num_charts
+    self.requires_encoded_inputs = [False] * num_charts
+    for (name, config) in charts.items():
+      config = config or {}
+      chart_id = self.chart_ids[name]
+      self.chart_encodings[chart_id] = tuple(EncodingTemplate(e, _CHART_DATA) for e in config.get('encodings') or [])
+      self.requires_encoded_inputs[chart_id] = bool(config.get('requires_encoded_inputs', False))
+
+    self.merge_result = [[0] * num_charts for _ in range(num_charts)]
+    self.merge_encodings = [[()] * num_charts for _ in range(num_charts)]
+    for merge in merges:
+      parent_id = self.chart_ids[merge['parent']]
+      child_id = self.chart_ids[merge['child']]
+      if self.merge_result[parent_id][child_id]:
+        raise ValueError("Duplicate composition rule for {} into {}".format(merge['child'], merge['parent']))
+      self.merge_result[parent_id][child_id] = self.chart_ids[merge['result']]
+      self.merge_encodings[parent_id][child_id] = tuple(EncodingTemplate(e, _MERGE_DATA) for e in merge.get('encodings') or [])
+
+  def intern_chart(self, name):
+    chart_id = self.chart_ids.get(name)
+    if chart_id is None:
+      chart_id = self.chart_ids[name] = len(self.chart_names)
+      self.chart_names.append(name)
+    return chart_id
+
+  def chart_id(self, name):
+    return self.chart_ids.get(name, 0)
+
+  def function_chart(self, function_type):
+    return self.function_charts.get(function_type, 0)
+
+  def charts_mergeable(self, parent_chart, child_chart):
+    return self.merge_result[self.chart_id(parent_chart)][self.chart_id(child_chart)] != 0
+
+  def functions_mergeable(self, parent_type, child_type):
+    """
+    A child computation can be merged into a parent computation if either
+    has no valid visualization, or a rule exists to merge their charts
+    """
+    parent_id = self.function_chart(parent_type)
+    child_id = self.function_chart(child_type)
+    return (not parent_id) or (not child_id) or self.merge_result[parent_id][child_id] != 0
+
+
+_compiled_rules = {}
+
+def compile_rules(grammatical_expressions=None, compositions=None):
+  """
+  Returns the compiled tables for a rule set.  Rule sets are compiled once
+  per pair of dicts, so they should not be modified after they are first
+  used to parse.  By default, the rule sets of specmetric.rules_config.
+  """
+  grammatical_expressions = rules_config.grammatical_expressions if grammatical_expressions is None else grammatical_expressions
+  compositions = rules_config.compositions if compositions is None else compositions
+  key = (id(grammatical_expressions), id(compositions))
+  entry = _compiled_rules.get(key)
+  # we hold on to the dicts, so their ids can't be reused by other objects
+  if entry is None or entry[0] is not grammatical_expressions or entry[1] is not compositions:
+    entry = (grammatical_expressions, compositions, CompiledRules(grammatical_expressions, compositions))
+    _compiled_rules[key] = entry
+  return entry[2]
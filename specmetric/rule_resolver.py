@@ -1,25 +1,20 @@
-from specmetric.rules_config import compositions as _compositions
-from specmetric.rules_config import grammatical_expressions as _grammatical_expressions
+from specmetric.rule_compiler import compile_rules
+from specmetric import rules_config
 
 class VisualizationRule:
   """
   class responsible for determining what happens when we merge a new computation of "parent_type"
   with the existing set of preferences
   """
-  def __init__(self, additional_preferences, child_type, parent_type, compositions=_compositions, grammatical_expressions=_grammatical_expressions):
+  def __init__(self, additional_preferences, child_type, parent_type, compositions=None, grammatical_expressions=None):
     self.additional_preferences = additional_preferences
     self.child_type = child_type
     self.parent_type = parent_type
-    self.compositions = compositions
-    self.grammatical_expressions = grammatical_expressions
+    self.compositions = rules_config.compositions if compositions is None else compositions
+    self.grammatical_expressions = rules_config.grammatical_expressions if grammatical_expressions is None else grammatical_expressions
     self.valid = False
     self.resolve_parent_type()
 
   def resolve_parent_type(self):
-    child_preferences = self.grammatical_expressions[self.child_type]
-    parent_preferences = self.grammatical_expressions[self.parent_type]
-
-    child_compositions = self.compositions['child_rules'][self.child_type]
-    # First, check if data types work
-    
-    self.valid = ('any' in child_compositions) or (self.parent_type in child_compositions)
+    rules = compile_rules(self.grammatical_expressions, self.compositions)
+    self.valid = rules.functions_mergeable(self.parent_type, self.child_type)
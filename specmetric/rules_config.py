@@ -1,17 +1,115 @@
-import yaml
-try:
-    from importlib import resources as res
-except ImportError:
-    import importlib_resources as res
-
-grammatical_expressions = {}
-with res.open_binary('specmetric.rules', 'grammatical_expressions.yml') as fp:
-    grammatical_expressions = yaml.load(fp, Loader=yaml.Loader)['expressions']
-
-spreadsheet_grammatical_expressions = {}
-with res.open_binary('specmetric.rules', 'spreadsheet_grammatical_expressions.yml') as fp:
-    spreadsheet_grammatical_expressions = yaml.load(fp, Loader=yaml.Loader)['expressions']
-
-compositions = {}
-with res.open_binary('specmetric.rules', 'compositions.yml') as fp:
-    compositions = yaml.load(fp, Loader=yaml.Loader)['compositions']
+"""
+The grammar and composition rule sets.
+
+grammatical_expressions, spreadsheet_grammatical_expressions and compositions
+are loaded from the YAML files in specmetric.rules the first time they are
+used.  Parsed rules are cached on disk (under $SPECMETRIC_CACHE_DIR, or
+~/.cache/specmetric) next to the hash of the YAML they came from, so later
+processes can skip the YAML parser as long as the rules haven't changed.
+Setting SPECMETRIC_CACHE_DIR to an empty string turns the disk cache off.
+"""
+import hashlib
+import marshal
+import os
+import threading
+
+# Bump whenever the layout of cached rules changes
+CACHE_VERSION = 1
+
+# attribute -> (YAML file in specmetric.rules, top level key)
+RULE_FILES = {
+    'grammatical_expressions': ('grammatical_expressions.yml', 'expressions'),
+    'spreadsheet_grammatical_expressions': ('spreadsheet_grammatical_expressions.yml', 'expressions'),
+    'compositions': ('compositions.yml', 'compositions'),
+}
+
+_lock = threading.Lock()
+
+
+def cache_dir():
+    """
+    Directory for cached rules, or None if the disk cache is turned off
+    """
+    directory = os.environ.get('SPECMETRIC_CACHE_DIR')
+    if directory is None:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        directory = os.path.join(base, 'specmetric')
+    return directory or None
+
+
+def read_rules_file(filename):
+    path = os.path.join(os.path.dirname(__file__), 'rules', filename)
+    if os.path.isfile(path):
+        with open(path, 'rb') as fp:
+            return fp.read()
+    # installed somewhere without a plain directory, like a zip
+    try:
+        from importlib import resources as res
+    except ImportError:
+        import importlib_resources as res
+    with res.open_binary('specmetric.rules', filename) as fp:
+        return fp.read()
+
+
+def parse_rules(source, section):
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(source, Loader=loader)[section]
+
+
+def load_rules(filename, section, directory=None):
+    """
+    Returns the rules under section in filename, from the disk cache when it
+    holds rules parsed from the same YAML
+    """
+    source = read_rules_file(filename)
+    digest = hashlib.sha1(source).hexdigest()
+    directory = directory or cache_dir()
+    if directory is None:
+        return parse_rules(source, section)
+
+    # rules are plain dicts, lists and strings, which marshal loads much
+    # faster than pickle (or yaml) can be imported
+    path = os.path.join(directory, '{}.marshal'.format(os.path.splitext(filename)[0]))
+    header = (CACHE_VERSION, marshal.version, digest, section)
+    try:
+        with open(path, 'rb') as fp:
+            (cached_header, rules) = marshal.load(fp)
+        if tuple(cached_header) == header:
+            return rules
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    rules = parse_rules(source, section)
+    try:
+        import tempfile
+        os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first so readers never see half a cache
+        (fd, tmp_path) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                marshal.dump((header, rules), fp)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except (OSError, ValueError):
+        # the cache is only an optimization, and rules marshal can't write
+        # (YAML dates, say) are just parsed every time
+        pass
+    return rules
+
+
+def __getattr__(name):
+    if name not in RULE_FILES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    with _lock:
+        # another thread may have loaded it while we waited; rule sets are
+        # compared by identity, so every caller has to get the same dict
+        if name not in globals():
+            globals()[name] = load_rules(*RULE_FILES[name])
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(list(globals()) + list(RULE_FILES))
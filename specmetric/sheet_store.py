@@ -0,0 +1,350 @@
+"""
+A spreadsheet's cells, held column by column, so that the ranges a
+computation tree refers to (A1 style references, like 'A2:A2001' or 'E8')
+can go straight into a renderer's data_dict.
+
+A sheet is read from a CSV once, in chunks.  Each column is kept as
+  - numbers, a float array with NaN wherever a cell isn't a number
+  - codes, an int32 array with, for cells that are text, the position of
+    their text in strings, and -1 for the others
+so a range of numbers is a slice of an array rather than a copy.  With a
+directory, the arrays are written there as they are read, memory mapped
+back, and reused by later processes for as long as the CSV is unchanged.
+
+The first row of the CSV is row 1, as in the spreadsheet.  Cells that hold
+formulas (text starting with '=') have no value here, so ranges with
+formulas in them don't resolve.
+"""
+import hashlib
+import json
+import os
+import re
+
+from specmetric.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Bump whenever sheets are stored differently, so ones written to disk by an
+# older version are not reused
+SHEET_VERSION = 1
+
+_ADDRESS = re.compile(r"\A\s*(?:[^!]*!)?\$?([A-Za-z]+)\$?(\d+)\s*(?::\s*\$?([A-Za-z]+)\$?(\d+))?\s*\Z")
+
+
+def column_index(letters):
+  """
+  0 for 'A', 25 for 'Z', 26 for 'AA'
+  """
+  index = 0
+  for letter in letters.upper():
+    index = index * 26 + ord(letter) - ord('A') + 1
+  return index - 1
+
+def column_letters(index):
+  letters = ''
+  index += 1
+  while index:
+    (index, rest) = divmod(index - 1, 26)
+    letters = chr(ord('A') + rest) + letters
+  return letters
+
+def parse_address(address):
+  """
+  ((first column, first row), (last column, last row)) of an A1 style
+  reference, counting from 0, or None if address isn't one
+  """
+  match = _ADDRESS.match(address) if isinstance(address, str) else None
+  if match is None:
+    return None
+  (start_letters, start_row, stop_letters, stop_row) = match.groups()
+  start = (column_index(start_letters), int(start_row) - 1)
+  stop = start if stop_letters is None else (column_index(stop_letters), int(stop_row) - 1)
+  if start[1] < 0 or stop[1] < 0:
+    return None
+  return ((min(start[0], stop[0]), min(start[1], stop[1])), (max(start[0], stop[0]), max(start[1], stop[1])))
+
+
+class SheetColumn:
+  """
+  A column's numbers, codes and strings, see the module docstring
+  """
+
+  __slots__ = ('numbers', 'codes', 'strings', 'text_counts', 'formulas')
+
+  def __init__(self, numbers, codes, strings):
+    self.numbers = numbers
+    self.codes = codes
+    self.strings = strings
+    # text_counts[i] is the number of text cells before row i, so whether a
+    # range is all numbers takes two lookups
+    self.text_counts = np.concatenate(([0], np.cumsum(codes >= 0)))
+    self.formulas = np.array([s.startswith('=') for s in strings], dtype=bool)
+
+  def __len__(self):
+    return len(self.numbers)
+
+  def values(self, start, stop):
+    """
+    The cells of rows start to stop: a slice of numbers if they are all
+    numbers or blank, else an object array with text, numbers and None
+    """
+    stop = min(stop, len(self))
+    start = min(start, stop)
+    numbers = self.numbers[start:stop]
+    if self.text_counts[stop] == self.text_counts[start]:
+      return numbers
+    codes = self.codes[start:stop]
+    text = codes >= 0
+    if self.formulas[codes[text]].any():
+      raise KeyError("rows {} to {} hold formulas".format(start + 1, stop))
+    values = np.array(numbers, dtype=object)
+    values[np.isnan(numbers)] = None
+    values[text] = np.array(self.strings, dtype=object)[codes[text]]
+    return values
+
+  def cell(self, row):
+    if row >= len(self):
+      return None
+    code = self.codes[row]
+    if code >= 0:
+      if self.formulas[code]:
+        raise KeyError("row {} holds a formula".format(row + 1))
+      return self.strings[code]
+    number = float(self.numbers[row])
+    return None if np.isnan(number) else number
+
+
+class SheetStore:
+  """
+  A sheet's columns by letter, and the values of A1 style references into
+  them
+  """
+
+  def __init__(self, columns, digest=None):
+    self.columns = columns
+    self.digest = digest
+
+  @property
+  def rows(self):
+    return max((len(c) for c in self.columns.values()), default=0)
+
+  def column(self, letters):
+    return self.columns[letters.upper()]
+
+  def __contains__(self, address):
+    try:
+      self.resolve(address)
+      return True
+    except KeyError:
+      return False
+
+  def resolve(self, address):
+    """
+    The values of address: a single cell's value, or the cells of a range,
+    row by row.  Raises KeyError if address isn't an A1 style reference into
+    the sheet, or refers to formulas.
+    """
+    parsed = parse_address(address)
+    if parsed is None:
+      raise KeyError(address)
+    ((start_column, start_row), (stop_column, stop_row)) = parsed
+    letters = [column_letters(c) for c in range(start_column, stop_column + 1)]
+    if any(l not in self.columns for l in letters):
+      raise KeyError(address)
+    if (start_column, start_row) == (stop_column, stop_row) and ':' not in address:
+      return self.columns[letters[0]].cell(start_row)
+    values = [self.columns[l].values(start_row, stop_row + 1) for l in letters]
+    if len(values) == 1:
+      return values[0]
+    if any(v.dtype.kind == 'O' for v in values):
+      values = [v.astype(object) for v in values]
+    return np.column_stack(values).ravel()
+
+  def formula(self, address):
+    """
+    The formula in the cell at address, or None if it doesn't hold one
+    """
+    parsed = parse_address(address)
+    if parsed is None or parsed[0] != parsed[1] or ':' in address:
+      return None
+    (column, row) = parsed[0]
+    letters = column_letters(column)
+    if letters not in self.columns or row >= len(self.columns[letters]):
+      return None
+    sheet_column = self.columns[letters]
+    code = sheet_column.codes[row]
+    if code >= 0 and sheet_column.formulas[code]:
+      return sheet_column.strings[code]
+    return None
+
+  def key(self, address):
+    """
+    A name for the values of address that stays the same for as long as
+    the sheet does
+    """
+    parsed = parse_address(address)
+    return 'sheet-{}-{}'.format(self.digest, parsed if parsed is not None else address)
+
+  def data_dict(self, names):
+    """
+    The values of each of names that is a reference into the sheet
+    """
+    data = {}
+    for name in names:
+      try:
+        data[name] = self.resolve(name)
+      except KeyError:
+        pass
+    return data
+
+  @classmethod
+  def from_csv(cls, path, directory=None, chunksize=65536, **read_csv_options):
+    """
+    Reads the sheet in path (or a file object), chunksize rows at a time.
+    With a directory, keeps its columns there, see the module docstring.
+    """
+    digest = None
+    if isinstance(path, (str, os.PathLike)):
+      digest = _file_digest(path, read_csv_options)
+    if directory is None or digest is None:
+      return cls(_read_columns(path, None, chunksize, read_csv_options), digest)
+
+    target = os.path.join(directory, digest)
+    store = _load(target, digest)
+    if store is not None:
+      return store
+    import shutil
+    import tempfile
+    os.makedirs(directory, exist_ok=True)
+    # written to a directory of its own first, so readers never see half a sheet
+    building = tempfile.mkdtemp(dir=directory, suffix='.tmp')
+    try:
+      (rows, strings) = _read_columns(path, building, chunksize, read_csv_options)
+      manifest = {'version': SHEET_VERSION, 'rows': rows, 'columns': strings}
+      with open(os.path.join(building, 'manifest.json'), 'w', encoding='utf-8') as fp:
+        json.dump(manifest, fp)
+      if os.path.isdir(target) and _load(target, digest) is None:
+        # left by an older version, or a failed write
+        shutil.rmtree(target, ignore_errors=True)
+      try:
+        os.replace(building, target)
+      except OSError:
+        # another process got there first
+        pass
+    finally:
+      shutil.rmtree(building, ignore_errors=True)
+    return _load(target, digest)
+
+
+def _read_columns(path, directory, chunksize, read_csv_options):
+  """
+  Columns by letter, or with a directory, the number of rows and the
+  strings of each column, whose arrays were written there
+  """
+  builders = {}
+  rows = 0
+  reader = pd.read_csv(path, header=None, dtype=str, keep_default_na=False, na_filter=False, chunksize=chunksize, **read_csv_options)
+  for chunk in reader:
+    for (j, name) in enumerate(chunk.columns):
+      letters = column_letters(j)
+      if letters not in builders:
+        builders[letters] = _ColumnBuilder(directory, letters, rows)
+      builders[letters].add(chunk[name].to_numpy(dtype=object))
+    rows += len(chunk)
+  if directory is None:
+    return {letters: builder.finish(rows) for (letters, builder) in builders.items()}
+  return (rows, {letters: builder.close(rows) for (letters, builder) in builders.items()})
+
+
+class _ColumnBuilder:
+  """
+  Collects a column chunk by chunk, in memory or in files in directory
+  """
+
+  def __init__(self, directory, letters, rows_before):
+    self.directory = directory
+    self.letters = letters
+    self.string_codes = {}
+    self.numbers = []
+    self.codes = []
+    self.files = None
+    if directory is not None:
+      os.makedirs(directory, exist_ok=True)
+      self.files = (open(self._path('f8'), 'wb'), open(self._path('i4'), 'wb'))
+    if rows_before:
+      # a column that first shows up in a later chunk
+      self.add(np.full(rows_before, '', dtype=object))
+
+  def _path(self, suffix):
+    return os.path.join(self.directory, '{}.{}'.format(self.letters, suffix))
+
+  def add(self, text):
+    numbers = pd.to_numeric(pd.Series(text, copy=False), errors='coerce').to_numpy(dtype=float)
+    codes = np.full(len(text), -1, dtype=np.int32)
+    is_text = np.isnan(numbers) & (text != '')
+    if is_text.any():
+      (chunk_codes, uniques) = pd.factorize(text[is_text])
+      mapping = np.array([self.string_codes.setdefault(s, len(self.string_codes)) for s in uniques], dtype=np.int32)
+      codes[is_text] = mapping[chunk_codes]
+    if self.files is None:
+      self.numbers.append(numbers)
+      self.codes.append(codes)
+    else:
+      self.files[0].write(numbers.tobytes())
+      self.files[1].write(codes.tobytes())
+
+  def finish(self, rows):
+    numbers = np.concatenate(self.numbers) if self.numbers else np.empty(0)
+    codes = np.concatenate(self.codes) if self.codes else np.empty(0, dtype=np.int32)
+    # rows missing at the end of short lines are blank
+    if len(numbers) < rows:
+      numbers = np.concatenate((numbers, np.full(rows - len(numbers), np.nan)))
+      codes = np.concatenate((codes, np.full(rows - len(codes), -1, dtype=np.int32)))
+    return SheetColumn(numbers, codes, list(self.string_codes))
+
+  def close(self, rows):
+    (numbers, codes) = self.files
+    written = numbers.tell() // 8
+    if written < rows:
+      numbers.write(np.full(rows - written, np.nan).tobytes())
+      codes.write(np.full(rows - written, -1, dtype=np.int32).tobytes())
+    numbers.close()
+    codes.close()
+    return list(self.string_codes)
+
+
+def _map_column(directory, letters):
+  def mapped(suffix, dtype):
+    path = os.path.join(directory, '{}.{}'.format(letters, suffix))
+    if os.path.getsize(path) == 0:
+      return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+  return (mapped('f8', '<f8'), mapped('i4', '<i4'))
+
+
+def _load(directory, digest):
+  try:
+    with open(os.path.join(directory, 'manifest.json'), 'rb') as fp:
+      manifest = json.load(fp)
+    if manifest.get('version') != SHEET_VERSION:
+      return None
+    columns = {}
+    for (letters, strings) in manifest['columns'].items():
+      (numbers, codes) = _map_column(directory, letters)
+      if len(numbers) != manifest['rows'] or len(codes) != manifest['rows']:
+        return None
+      columns[letters] = SheetColumn(numbers, codes, strings)
+    return SheetStore(columns, digest)
+  except (OSError, ValueError, KeyError):
+    # read the CSV again
+    return None
+
+
+def _file_digest(path, read_csv_options):
+  digest = hashlib.blake2b(digest_size=16)
+  digest.update(repr((SHEET_VERSION, sorted(read_csv_options.items()))).encode('utf-8'))
+  with open(path, 'rb') as fp:
+    for block in iter(lambda: fp.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
@@ -0,0 +1,519 @@
+"""
+Vega-Lite specs as plain dicts, built through the parts of Altair's API that
+AltairRenderer uses (alt.Chart(...).mark_*().encode(...).properties(...),
+transforms, selections, + and |).
+
+VegaLiteRenderer builds its charts with this module in place of altair.
+Every call fills in a dict straight away: there is no schema machinery, no
+validation unless to_dict(validate=True) asks for it, and layering or
+concatenating charts copies lists of references rather than deep copying
+the charts.  The specs are the ones Altair would make, down to the names
+of the datasets, except for the names of selections, which are numbered
+separately.
+"""
+from functools import lru_cache
+import hashlib
+import itertools
+import json
+import re
+
+from specmetric.lazy_import import lazy_import
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+SCHEMA_URL = 'https://vega.github.io/schema/vega-lite/v4.17.0.json'
+
+# Altair's default theme
+def default_config():
+  return {'view': {'continuousWidth': 400, 'continuousHeight': 300}}
+
+TYPECODES = {'Q': 'quantitative', 'N': 'nominal', 'O': 'ordinal', 'T': 'temporal', 'G': 'geojson'}
+
+AGGREGATES = ['argmax', 'argmin', 'average', 'count', 'distinct', 'max', 'mean', 'median', 'min', 'missing', 'product', 'q1', 'q3', 'ci0', 'ci1', 'stderr', 'stdev', 'stdevp', 'sum', 'valid', 'values', 'variance', 'variancep']
+
+_SHORTHAND = re.compile(
+  r'\A(?:(?P<count>count)\(\)|(?P<aggregate>{})\((?P<aggregated>.*)\)|(?P<field>.*?))(?::(?P<type>{}))?\Z'.format(
+    '|'.join(AGGREGATES), '|'.join(list(TYPECODES) + list(TYPECODES.values()))),
+  re.DOTALL)
+
+
+@lru_cache(maxsize=4096)
+def _parse_shorthand(shorthand):
+  match = _SHORTHAND.match(shorthand)
+  attrs = {}
+  if match.group('count'):
+    attrs['aggregate'] = 'count'
+  elif match.group('aggregate'):
+    attrs['aggregate'] = match.group('aggregate')
+    attrs['field'] = match.group('aggregated')
+  else:
+    attrs['field'] = match.group('field')
+  if match.group('type'):
+    attrs['type'] = TYPECODES.get(match.group('type'), match.group('type'))
+  elif attrs == {'aggregate': 'count'}:
+    # counts are quantitative by default
+    attrs['type'] = 'quantitative'
+  return tuple(attrs.items())
+
+def parse_shorthand(shorthand):
+  """
+  'field:Q', 'count()' or 'mean(field):Q' as a dict of encoding attributes.
+  Unlike Altair, time units ('month(field)') are not parsed.
+  """
+  return dict(_parse_shorthand(shorthand))
+
+
+class _Utils:
+  """
+  Stands in for altair.utils
+  """
+
+  @staticmethod
+  def infer_vegalite_type(data):
+    typ = pd.api.types.infer_dtype(data, skipna=False)
+    if typ in ['floating', 'mixed-integer-float', 'integer', 'mixed-integer', 'complex']:
+      return 'quantitative'
+    if typ in ['datetime', 'datetime64', 'timedelta', 'timedelta64', 'date', 'time', 'period']:
+      return 'temporal'
+    return 'nominal'
+
+utils = _Utils()
+
+
+# Encoding channels
+
+class _Channel:
+  channel = None
+
+  def __init__(self, shorthand=None, **kwargs):
+    self.shorthand = shorthand
+    self.kwargs = kwargs
+
+  def to_dict(self):
+    attrs = parse_shorthand(self.shorthand) if self.shorthand else {}
+    attrs.update(self.kwargs)
+    return attrs
+
+def _channel_class(name, channel):
+  return type(name, (_Channel,), {'channel': channel})
+
+X = _channel_class('X', 'x')
+Y = _channel_class('Y', 'y')
+X2 = _channel_class('X2', 'x2')
+Y2 = _channel_class('Y2', 'y2')
+Color = _channel_class('Color', 'color')
+Size = _channel_class('Size', 'size')
+Opacity = _channel_class('Opacity', 'opacity')
+Text = _channel_class('Text', 'text')
+Tooltip = _channel_class('Tooltip', 'tooltip')
+
+def _encoding(value):
+  if isinstance(value, _Channel):
+    return value.to_dict()
+  if isinstance(value, str):
+    return parse_shorthand(value)
+  if isinstance(value, list):
+    return [_encoding(v) for v in value]
+  return value
+
+
+class _Properties(dict):
+  """
+  Keyword arguments that can be read back as attributes, like scale.domain
+  """
+
+  def __init__(self, **kwargs):
+    super().__init__(kwargs)
+
+  def __getattr__(self, name):
+    try:
+      return self[name]
+    except KeyError:
+      raise AttributeError(name)
+
+class Axis(_Properties):
+  pass
+
+class Scale(_Properties):
+  pass
+
+class Legend(_Properties):
+  pass
+
+def value(v, **kwargs):
+  return dict(kwargs, value=v)
+
+def condition(predicate, if_true, if_false):
+  """
+  if_true where the selection predicate holds, and if_false elsewhere
+  """
+  true = dict(_encoding(if_true))
+  true['selection'] = predicate.name
+  false = _encoding(if_false)
+  if isinstance(false, dict):
+    return dict(false, condition=true)
+  return {'condition': true, 'value': false}
+
+
+# Expressions
+
+def _js_repr(val):
+  if val is True:
+    return 'true'
+  if val is False:
+    return 'false'
+  if val is None:
+    return 'null'
+  return repr(val)
+
+class Expression:
+
+  def __init__(self, text):
+    self.text = text
+
+  def __repr__(self):
+    return self.text
+
+  def _binary(op):
+    def method(self, other):
+      return Expression('({} {} {})'.format(_js_repr(self), op, _js_repr(other)))
+    return method
+
+  __gt__ = _binary('>')
+  __ge__ = _binary('>=')
+  __lt__ = _binary('<')
+  __le__ = _binary('<=')
+  __eq__ = _binary('===')
+  __ne__ = _binary('!==')
+  __add__ = _binary('+')
+  __sub__ = _binary('-')
+  __mul__ = _binary('*')
+  __truediv__ = _binary('/')
+  __and__ = _binary('&&')
+  __or__ = _binary('||')
+  del _binary
+  __hash__ = object.__hash__
+
+def _expression(value):
+  return repr(value) if isinstance(value, Expression) else value
+
+class _Datum:
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return Expression('datum.' + name)
+
+  def __getitem__(self, name):
+    return Expression('datum[{}]'.format(json.dumps(name)))
+
+datum = _Datum()
+
+
+# Selections
+
+_selection_counter = itertools.count(1)
+
+class Selection:
+
+  def __init__(self, name, selection):
+    self.name = name
+    self.selection = selection
+
+def selection(name=None, type=None, **kwargs):
+  if name is None:
+    name = 'selector{:03d}'.format(next(_selection_counter))
+  selection = {'type': type} if type is not None else {}
+  selection.update(kwargs)
+  return Selection(name, selection)
+
+def selection_single(**kwargs):
+  return selection(type='single', **kwargs)
+
+def selection_multi(**kwargs):
+  return selection(type='multi', **kwargs)
+
+def selection_interval(**kwargs):
+  return selection(type='interval', **kwargs)
+
+
+# Charts
+
+class _TopLevel:
+  """
+  Conversion of a chart to a complete spec, with its inline data moved to
+  the top level datasets like Altair does
+  """
+
+  def to_dict(self, validate=False):
+    datasets = {}
+    spec = {'config': default_config()}
+    spec.update(self._to_dict(_DatasetNames(datasets)))
+    spec['$schema'] = SCHEMA_URL
+    if datasets:
+      spec['datasets'] = datasets
+    if validate:
+      from altair.vegalite.v4.schema.core import Root
+      Root.validate(json.loads(json.dumps(spec, default=_json_default)))
+    return spec
+
+  def to_json(self, indent=None, validate=False):
+    return json.dumps(self.to_dict(validate=validate), indent=indent, default=_json_default)
+
+  def save(self, fp, format=None, embed_options=None, validate=False):
+    """
+    Writes the spec to fp, a path or file, as 'json' or 'html' (going by
+    the file name when format is not given)
+    """
+    if format is None:
+      format = str(fp).rsplit('.', 1)[-1] if isinstance(fp, str) or hasattr(fp, '__fspath__') else 'json'
+    if format == 'json':
+      content = self.to_json(indent=2, validate=validate)
+    elif format == 'html':
+      import altair
+      from altair.utils.html import spec_to_html
+      content = spec_to_html(
+        json.loads(self.to_json(validate=validate)), mode='vega-lite',
+        vega_version=altair.VEGA_VERSION, vegaembed_version=altair.VEGAEMBED_VERSION,
+        vegalite_version=altair.VEGALITE_VERSION, embed_options=embed_options)
+    else:
+      raise ValueError("Can't save a chart as {!r}".format(format))
+    if hasattr(fp, 'write'):
+      fp.write(content)
+    else:
+      with open(fp, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+  def __or__(self, other):
+    return HConcatChart(hconcat=[self, other])
+
+
+class Chart(_TopLevel):
+
+  def __init__(self, data=None, **spec):
+    self.data = data
+    self.spec = spec
+
+  def _copy(self, **changes):
+    chart = Chart(self.data, **self.spec)
+    chart.spec.update(changes)
+    return chart
+
+  def _to_dict(self, names):
+    spec = {}
+    if self.data is not None:
+      spec['data'] = names.data(self.data)
+    spec.update(self.spec)
+    return spec
+
+  def _mark(self, mark, **kwargs):
+    return self._copy(mark=dict(type=mark, **kwargs) if kwargs else mark)
+
+  def mark_area(self, **kwargs):
+    return self._mark('area', **kwargs)
+
+  def mark_bar(self, **kwargs):
+    return self._mark('bar', **kwargs)
+
+  def mark_circle(self, **kwargs):
+    return self._mark('circle', **kwargs)
+
+  def mark_line(self, **kwargs):
+    return self._mark('line', **kwargs)
+
+  def mark_point(self, **kwargs):
+    return self._mark('point', **kwargs)
+
+  def mark_rect(self, **kwargs):
+    return self._mark('rect', **kwargs)
+
+  def mark_rule(self, **kwargs):
+    return self._mark('rule', **kwargs)
+
+  def mark_square(self, **kwargs):
+    return self._mark('square', **kwargs)
+
+  def mark_text(self, **kwargs):
+    return self._mark('text', **kwargs)
+
+  def mark_tick(self, **kwargs):
+    return self._mark('tick', **kwargs)
+
+  def encode(self, *args, **kwargs):
+    encoding = dict(self.spec.get('encoding', {}))
+    for channel in args:
+      encoding[channel.channel] = channel.to_dict()
+    for (name, channel) in kwargs.items():
+      encoding[name] = _encoding(channel)
+    return self._copy(encoding=encoding)
+
+  def properties(self, **kwargs):
+    return self._copy(**kwargs)
+
+  def _transform(self, transform):
+    return self._copy(transform=self.spec.get('transform', []) + [transform])
+
+  def transform_calculate(self, as_=None, calculate=None, **kwargs):
+    chart = self
+    if as_ is not None:
+      chart = chart._transform({'calculate': _expression(calculate), 'as': as_})
+    for (name, expression) in kwargs.items():
+      chart = chart._transform({'calculate': _expression(expression), 'as': name})
+    return chart
+
+  def transform_fold(self, fold, as_=None):
+    transform = {'fold': list(fold)}
+    if as_ is not None:
+      transform['as'] = list(as_)
+    return self._transform(transform)
+
+  def transform_filter(self, filter):
+    if isinstance(filter, Selection):
+      filter = {'selection': filter.name}
+    return self._transform({'filter': _expression(filter)})
+
+  def add_selection(self, *selections):
+    if not selections:
+      return self
+    selection = dict(self.spec.get('selection', {}))
+    for s in selections:
+      selection[s.name] = s.selection
+    return self._copy(selection=selection)
+
+  def __add__(self, other):
+    return LayerChart(layer=[self, other])
+
+
+def _combine_subchart_data(data, subcharts):
+  """
+  Moves data that every subchart shares up to the parent, as Altair does
+  (comparing data by identity)
+  """
+  def remove_data(subchart):
+    if subchart.data is None:
+      return subchart
+    copy = subchart._copy()
+    copy.data = None
+    return copy
+
+  if not subcharts:
+    pass
+  elif data is None:
+    subdata = subcharts[0].data
+    if subdata is not None and all(c.data is subdata for c in subcharts):
+      data = subdata
+      subcharts = [remove_data(c) for c in subcharts]
+  elif all(c.data is None or c.data is data for c in subcharts):
+    subcharts = [remove_data(c) for c in subcharts]
+  return data, subcharts
+
+
+class _Compound(_TopLevel):
+  key = None
+
+  def __init__(self, data=None, **spec):
+    self.spec = spec
+    (self.data, self.spec[self.key]) = _combine_subchart_data(data, list(spec[self.key]))
+
+  def _copy(self, **changes):
+    chart = type(self).__new__(type(self))
+    chart.data = self.data
+    chart.spec = dict(self.spec, **changes)
+    return chart
+
+  def _appended(self, other):
+    return type(self)(self.data, **dict(self.spec, **{self.key: self.spec[self.key] + [other]}))
+
+  def _to_dict(self, names):
+    spec = {self.key: [chart._to_dict(names) for chart in self.spec[self.key]]}
+    if self.data is not None:
+      spec['data'] = names.data(self.data)
+    for (key, value) in self.spec.items():
+      if key != self.key:
+        spec[key] = value
+    return spec
+
+  def properties(self, **kwargs):
+    return self._copy(**kwargs)
+
+
+class LayerChart(_Compound):
+  key = 'layer'
+
+  def __add__(self, other):
+    return self._appended(other)
+
+class HConcatChart(_Compound):
+  key = 'hconcat'
+
+  def __or__(self, other):
+    return self._appended(other)
+
+class ConcatChart(_Compound):
+  key = 'concat'
+
+  def __or__(self, other):
+    return self._appended(other)
+
+def layer(*charts, **kwargs):
+  return LayerChart(layer=list(charts), **kwargs)
+
+def hconcat(*charts, **kwargs):
+  return HConcatChart(hconcat=list(charts), **kwargs)
+
+def concat(*charts, **kwargs):
+  return ConcatChart(concat=list(charts), **kwargs)
+
+
+class Rows(tuple):
+  """
+  Rows of inline data, as AltairRenderer.dataset makes them: a tuple, since
+  Altair deep copies lists (but not tuples) whenever a chart changes, which
+  remembers its dataset's name once it has been worked out.  Charts kept by
+  a ChartCache write out the same datasets spec after spec, and this way
+  the name lives (and goes) with the rows.
+  """
+
+  name = None
+
+
+class _DatasetNames:
+  """
+  Names inline data by a hash of its values, as Altair does, collecting the
+  values in datasets.  Data shared by several charts is hashed once.
+  """
+
+  def __init__(self, datasets):
+    self.datasets = datasets
+    self.names = {}
+
+  def data(self, data):
+    if not isinstance(data, dict) or 'name' in data or 'values' not in data:
+      return data
+    values = data['values']
+    name = self.names.get(id(values))
+    if name is None:
+      name = getattr(values, 'name', None) if isinstance(values, Rows) else None
+      if name is None:
+        name = dataset_name(values)
+        if isinstance(values, Rows):
+          values.name = name
+      self.names[id(values)] = name
+      self.datasets[name] = values
+    named = {'name': name}
+    named.update((k, v) for (k, v) in data.items() if k != 'values')
+    return named
+
+
+def dataset_name(values):
+  if len(values) == 1 and values[0] == {}:
+    return 'empty'
+  values_json = json.dumps(values, sort_keys=True, default=_json_default)
+  return 'data-' + hashlib.md5(values_json.encode()).hexdigest()
+
+
+def _json_default(value):
+  # numpy scalars and arrays
+  if hasattr(value, 'tolist'):
+    return value.tolist()
+  raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
@@ -1,6 +1,6 @@
-from specmetric.rule_resolver import VisualizationRule
-from specmetric.rules_config import compositions as _compositions
-from specmetric.rules_config import grammatical_expressions as _grammatical_expressions
+from specmetric.rule_compiler import compile_rules
+from specmetric import rules_config
+import copy
 import json
 
 class VisualizationContainer:
@@ -11,16 +11,17 @@ class VisualizationContainer:
   its corresponding computation nodes.
   """  
 
-  def __init__(self, root_node, child_encodings={},compositions=_compositions, grammatical_expressions=_grammatical_expressions, lowest_depth=0):
+  def __init__(self, root_node, child_encodings={},compositions=None, grammatical_expressions=None, lowest_depth=0):
     self.root_node = root_node
     self.computation_nodes = [root_node]
     self.lowest_depth = lowest_depth
     self.valid_chart = None
     self.encodings = {}
     self.child_encodings = child_encodings
-    self.compositions = compositions
-    self.grammatical_expressions = grammatical_expressions
+    self.compositions = rules_config.compositions if compositions is None else compositions
+    self.grammatical_expressions = rules_config.grammatical_expressions if grammatical_expressions is None else grammatical_expressions
     self.matchedRule = False
+    self.rules = compile_rules(self.grammatical_expressions, self.compositions)
     self.parseDFTree_preferences(root_node, initial=True)
     self.parse_chart(self.valid_chart, self.root_node.input_data, self.root_node.output_data)
 
@@ -40,6 +41,35 @@ class VisualizationContainer:
     {}
     """.format(self.valid_chart, self.root_node.name, self.lowest_depth, [n.name for n in self.computation_nodes], json.dumps(self.encodings, indent=4)))
 
+  @classmethod
+  def from_template(cls, root_node, computation_nodes, lowest_depth, valid_chart, encodings, child_encodings, matchedRule, compositions=None, grammatical_expressions=None, rules=None):
+    """
+    Returns a container with the state a parse would have left it in,
+    without parsing its nodes again (see specmetric.parse_cache)
+    """
+    container = cls.__new__(cls)
+    container.root_node = root_node
+    container.computation_nodes = computation_nodes
+    container.lowest_depth = lowest_depth
+    container.valid_chart = valid_chart
+    container.encodings = encodings
+    container.child_encodings = child_encodings
+    container.compositions = rules_config.compositions if compositions is None else compositions
+    container.grammatical_expressions = rules_config.grammatical_expressions if grammatical_expressions is None else grammatical_expressions
+    container.matchedRule = matchedRule
+    container.rules = compile_rules(container.grammatical_expressions, container.compositions) if rules is None else rules
+    return container
+
+  def copy(self):
+    """
+    Returns a copy of this container that can be merged into a parent without
+    changing this one.
+    """
+    container = copy.copy(self)
+    container.computation_nodes = list(self.computation_nodes)
+    container.encodings = dict(self.encodings)
+    return container
+
   def get_function_preferences(self, function_type):
     return self.grammatical_expressions[function_type]
 
@@ -61,171 +91,23 @@ class VisualizationContainer:
 
   def parse_chart(self, chart_type, input_data, output_data):
     """
-    Adds the encodings for the selected chart type.  
+    Adds the encodings for the selected chart type, as given by its
+    encoding templates in compositions.yml
     """
-    if chart_type == 'spacefilling':
-      # input_data should be a vector name
-      # We should take input data's encoding.  We won't have that just yet.
-      # For now, I will just enforce that the child encoding gets squares
-      self.update_encoding(
-        input_data[0],
-        {
-          'mark': 'square',
-          'channels': 'vector-location'
-        }
-      )
-
-      # The actual calculations of the values are calculated by the renderer
-    elif chart_type == 'single_stacked_bar':
-      # input_data are scalars, output_data is a single scalar
-      # inputs are areas, output is area
-      self.update_encoding(
-        input_data[0],
-        {
-          'mark': 'area',
-          'channels': 'scalar-location'
-        }
-      )
-
-      self.update_encoding(
-        input_data[1],
-        {
-          'mark': 'area',
-          'channels': 'scalar-location'
-        }
-      )
-
-
-    elif chart_type == 'scatter_y_equals_x':
-      # Inputs are points on scatterplot
-      # outputs are lines
-      self.update_encoding(
-        input_data[0],
-        {
-          'mark': 'point',
-          'channels': 'vector-location',
-          'preference': 'x'
-        }
-      )
-      self.update_encoding(
-        input_data[1],
-        {
-          'mark': 'point',
-          'channels': 'vector-location',
-          'preference': 'y'
-        }
-      )
-      self.update_encoding(
-        output_data,
-        {
-          'mark': 'line',
-          'channels': 'vector-location'
-        }
-      )
-    elif chart_type == 'bar_chart_diff':
-      # inputs are scalars, output is scalar
-      # each is a bar with x and y value
-      self.update_encoding(
-        input_data[0],
-        {
-          'mark': 'line',
-          'channels': 'scalar-location'
-        }
-      )
-      self.update_encoding(
-        input_data[1],
-        {
-          'mark': 'line',
-          'channels': 'scalar-location'
-        }
-      )
-    elif chart_type == 'bar_chart_comp':
-      self.update_encoding(
-        input_data[0],
-        {
-          'mark': 'line',
-          'channels': 'scalar-location'
-        }
-      )
-      self.update_encoding(
-        input_data[1],
-        {
-          'mark': 'line',
-          'channels': 'scalar-location'
-        }
-      )
-    elif chart_type == 'dist_chart':
-      # Want to show the output values in a distribution
-      # greedily pick dots if no encoding is specified
-      self.update_encoding(
-          output_data,
-          {
-            'mark': 'line',
-            'channels': 'vector-location'          
-          }
-        )
-    elif chart_type == 'spacefilling_dot':
-      self.update_encoding(
-        input_data,
-        {
-          'mark': 'circle',
-          'channels': 'vector-location'
-        }
-      )
-    elif chart_type == 'factor_chart':
-      # print("IN FILTER CHART TYPE")
-      # print("INPUT DATA", input_data)
-      # print("OUTPUT DATA", output_data)
-      # format of input data is funky: ['A2:A2001', 'E8', 'C2:C2001', '"Yes"']
-      # it's in pairs of <vector_data, filter value>
-      datarange = ''
-      value = ''
-      # for (i, d) in enumerate(input_data):
-      #   if i % 2 == 0:
-      #     # starting a new pair
-      #     datarange = d
-      #   else:
-      #     # closing out a range
-      #     value = d
-      #     print("adding vector-location to ", datarange)
-      #     self.update_encoding(datarange,
-      #       { 
-      #         'mark': 'circle',
-      #         'channels': 'vector-location'
-      #       })
-      for d in input_data:
-        self.update_encoding(d,
-          { 
-            'mark': 'circle',
-            'channels': 'vector-location'
-          })
-    elif chart_type == 'mean_chart':
-      if input_data[0] not in self.child_encodings:
-        # Here, we arbitrarily choose lines if no encoding is specified
-        # Think of this as a greedy visualization presenter
-        self.update_encoding(
-          input_data[0],
-          {
-            'mark': 'line',
-            'channels': 'vector-location'
-          }
-          )
-      else:
-        input_data_encoding = self.child_encodings[input_data[0]]['mark']
-        self.update_encoding(
-          input_data[0],
-          {
-            'mark': input_data_encoding,
-            'channels': 'vector-location'
-          }
-        )
-        for key, encoding in self.child_encodings.items():
-          if 'skip' in encoding: # this was the bar encoding of previous one
-            self.update_encoding(
-              key,
-              encoding
-            )
-
+    data = {'input': input_data, 'output': output_data, 'each_input': input_data}
+    for template in self.rules.chart_encodings[self.rules.chart_id(chart_type)]:
+      encoding = template.build(data)
+      for attribute_name in template.attributes(data[template.data]):
+        if template.inherit_child_mark and attribute_name in self.child_encodings:
+          # reuse the mark the child already picked, along with any child
+          # encodings flagged to be carried over
+          self.update_encoding(attribute_name, encoding | {'mark': self.child_encodings[attribute_name]['mark']})
+          if template.carry_child_encodings:
+            for key, child_encoding in self.child_encodings.items():
+              if template.carry_child_encodings in child_encoding:
+                self.update_encoding(key, child_encoding)
+        else:
+          self.update_encoding(attribute_name, encoding)
 
   def update_encoding(self, attribute_name, encoding_config, overwrite=True):
     if attribute_name not in self.encodings:
@@ -243,31 +125,18 @@ class VisualizationContainer:
     3) They both do, but a rule exists to merge them.
 
     """
-    # get parent valid_chart
-    parent_preferences = self.get_function_preferences(parent_node.function_type)
-    parent_valid_chart = parent_preferences.get('valid_visualization')
+    rules = self.rules
+    parent_chart = rules.function_chart(parent_node.function_type)
+    child_chart = rules.chart_id(self.valid_chart)
 
-    # get self valid_chart
-    child_valid_chart = self.valid_chart
-
-    if not parent_valid_chart:
-    # check condition 1
-      return True
-    elif not child_valid_chart:
-    # check condition 2
-      return True
-    else:
-    # check condition 3
-      return self.charts_mergeable(parent_valid_chart, child_valid_chart)
+    # check conditions 1 and 2, then look up condition 3
+    return (not parent_chart) or (not child_chart) or rules.merge_result[parent_chart][child_chart] != 0
 
   def charts_mergeable(self, parent_chart, child_chart):
     """
     Returns true if there is a valid composition rule from child to parent, false otherwise
     """
-    # For now, we hardcode the matches here
-    return (((child_chart == 'spacefilling') and (parent_chart == 'bar_chart_comp')) 
-            or ((child_chart == 'spacefilling') and (parent_chart == 'single_stacked_bar')) 
-            or ((child_chart == 'spacefilling') and (parent_chart == 'bar_chart_diff')))
+    return self.rules.charts_mergeable(parent_chart, child_chart)
 
   def merge_chart_types(self, parent_node):
     """
@@ -275,66 +144,16 @@ class VisualizationContainer:
     1. Set's the valid chart variable
     2. Adds/modifies any additional encodings
     """
-
-    # For now, we hardcode the matches here
-    parent_preferences = self.get_node_preferences(parent_node)
-    child_encodings = self.encodings
-    parent_chart = parent_preferences.get('valid_visualization')
-    child_chart = self.valid_chart
-    if ((child_chart == 'spacefilling') and (parent_chart == 'bar_chart_comp')):
-      self.merge_spacefilling_bar_chart_comp(parent_node, self.root_node)
-    elif ((child_chart == 'spacefilling') and (parent_chart == 'single_stacked_bar')):
-      self.merge_spacefilling_single_stacked_bar(parent_node, self.root_node)
-    elif ((child_chart == 'spacefilling') and (parent_chart == 'bar_chart_diff')):
-      self.merge_spacefilling_bar_chart_diff(parent_node, self.root_node)
-
-  def merge_spacefilling_bar_chart_comp(self, bar_chart_node, spacefilling_node):
-    self.valid_chart = 'bar_chart_comp'
-    # building a more complicated bar chart comp
-    # The spacefilling areas need to get an offset so they appear in the barchart
-    spacefilling_var = spacefilling_node.output_data
-    bar_chart_var = bar_chart_node.output_data
-
-    self.update_encoding(
-      spacefilling_var,
-      {
-        'mark': 'area',
-        'channels': ['x', 'y', 'x2', 'y2'],
-        'offset': 'tied-' + bar_chart_var # i.e. offset position by the corresponding bar location.  To be handled by the renderer.
-      }
-    )
-
-  def merge_spacefilling_single_stacked_bar(self, bar_node, spacefilling_node):
-    self.valid_chart = 'single_stacked_bar'
-    
-    # The spacefilling areas need to get an offset so they appear in the single bar
-    spacefilling_var = spacefilling_node.output_data
-    bar_var = bar_node.output_data
-
-    self.update_encoding(
-      spacefilling_var,
-      {
-        'mark': 'area',
-        'channels': ['x', 'y', 'x2', 'y2'],
-        'offset': 'tied-' + bar_var # i.e. offset position by the corresponding bar location.  To be handled by the renderer.
-      }
-    )
-
-  def merge_spacefilling_bar_chart_diff(self, bar_chart_node, spacefilling_node):
-    self.valid_chart = 'bar_chart_diff'
-
-    # The spacefilling areas need to get an offset so they appear in the corresponding bars
-    spacefilling_var = spacefilling_node.output_data
-    bar_chart_var = bar_chart_node.output_data
-
-    self.update_encoding(
-      spacefilling_var,
-      {
-        'mark': 'area',
-        'channels': ['x', 'y', 'x2', 'y2'],
-        'offset': 'tied-' + bar_chart_var # i.e. offset position by the corresponding bar location.  To be handled by the renderer.
-      }
-    )
+    rules = self.rules
+    parent_chart = rules.function_chart(parent_node.function_type)
+    child_chart = rules.chart_id(self.valid_chart)
+    result = rules.merge_result[parent_chart][child_chart]
+    if not result:
+      return
+    self.valid_chart = rules.chart_names[result]
+    data = {'child_output': self.root_node.output_data, 'parent_output': parent_node.output_data}
+    for template in rules.merge_encodings[parent_chart][child_chart]:
+      self.update_encoding(data[template.data], template.build(data))
 
   def merge_parent(self, parent_node):
     """
@@ -387,8 +206,7 @@ class VisualizationContainer:
     # np.fill(), which we don't currently have a visual analog for.
     # Or if a chart only makes sense if you have a certain encoding for
     # the input data
-    parent_preferences = self.get_function_preferences(parent_node.function_type)
-    if ('valid_visualization' in parent_preferences) and parent_preferences['valid_visualization'] == 'mean_chart':
-      return all([((d in self.encodings) and (m in ['line', 'square'] for m in self.encodings[d]['mark'])) for d in parent_node.input_data])
+    if self.rules.requires_encoded_inputs[self.rules.function_chart(parent_node.function_type)]:
+      return all([(d in self.encodings) for d in parent_node.input_data])
     else:
       return True
\ No newline at end of file
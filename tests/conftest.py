@@ -0,0 +1,18 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# Tests keep their caches (rules, layouts, responses, sheets) in a directory
+# of their own rather than the developer's ~/.cache/specmetric.  This has to
+# happen before anything reads SPECMETRIC_CACHE_DIR.
+CACHE_DIR = tempfile.mkdtemp(prefix='specmetric-tests-')
+atexit.register(shutil.rmtree, CACHE_DIR, ignore_errors=True)
+os.environ['SPECMETRIC_CACHE_DIR'] = CACHE_DIR
+
+# The spreadsheet app's modules import each other as siblings (import
+# service, from columnar import ...), so they are tested the same way
+SPREADSHEET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'usecases', 'spreadsheet')
+if SPREADSHEET not in sys.path:
+  sys.path.insert(0, SPREADSHEET)
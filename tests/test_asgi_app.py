@@ -0,0 +1,208 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import asgi_app
+import service
+from render_store import RenderStore
+from response_cache import ResponseCache
+from columnar import UploadedColumns
+
+
+async def call(method, path, body=b'', headers=None):
+  """
+  status, headers and body of asgi_app.app's response to a request
+  """
+  messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+  async def receive():
+    if messages:
+      return messages.pop(0)
+    # the client never goes away
+    await asyncio.Event().wait()
+  sent = []
+  async def send(message):
+    sent.append(message)
+  scope = {
+    'type': 'http',
+    'method': method,
+    'path': path,
+    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for (k, v) in (headers or {}).items()],
+    'client': ('127.0.0.1', 5000),
+  }
+  await asgi_app.app(scope, receive, send)
+  return (sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:]))
+
+def post(value, session):
+  payload = {'nodes': [{'name': 'x', 'parent': None, 'function': 'scalar'}], 'datadict': {'x': value}, 'rootName': 'x'}
+  return call('POST', '/postSpecs', json.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json', 'X-Session-Id': session})
+
+async def until(condition, timeout=5.0):
+  for _ in range(int(timeout / 0.01)):
+    if condition():
+      return
+    await asyncio.sleep(0.01)
+  raise AssertionError("timed out")
+
+
+class FakeRenders:
+  """
+  Stands in for service.render_spec: each render runs until released,
+  stopping with Cancelled if it is told to first, like the real one does
+  between steps
+  """
+
+  def __init__(self):
+    self.release = threading.Event()
+    self.started = []
+    self.cancelled = []
+    self.lock = threading.Lock()
+
+  def __call__(self, nodes, datadict, rootName, cancelled=None):
+    value = datadict[rootName]
+    with self.lock:
+      self.started.append(value)
+    while not self.release.wait(0.01):
+      if cancelled is not None and cancelled():
+        with self.lock:
+          self.cancelled.append(value)
+        raise service.Cancelled()
+    return json.dumps({'value': value}).encode('utf-8')
+
+
+@pytest.fixture
+def renders(monkeypatch):
+  renders = FakeRenders()
+  monkeypatch.setattr(service, 'render_spec', renders)
+  responses = ResponseCache()
+  monkeypatch.setattr(service, 'response_cache', lambda: responses)
+  monkeypatch.setattr(service, 'uploaded_columns', UploadedColumns())
+  store = RenderStore()
+  monkeypatch.setattr(service, 'render_store', store)
+  monkeypatch.setattr(asgi_app, 'render_store', store)
+  yield renders
+  # let anything still running finish
+  renders.release.set()
+
+def use_scheduler(monkeypatch, **options):
+  scheduler = asgi_app.RenderScheduler(asgi_app._render, **options)
+  monkeypatch.setattr(asgi_app, 'scheduler', scheduler)
+  return scheduler
+
+
+def test_newer_request_of_a_session_cancels_its_render(monkeypatch, renders):
+  use_scheduler(monkeypatch, max_workers=1)
+
+  async def scenario():
+    first = asyncio.create_task(post(1, 'a'))
+    await until(lambda: renders.started == [1])
+    second = asyncio.create_task(post(2, 'a'))
+    # the running render is told to stop, and its request answered 409
+    (status, _, body) = await first
+    assert status == 409 and json.loads(body) == {'superseded': True}
+    assert renders.cancelled == [1]
+    renders.release.set()
+    (status, _, body) = await second
+    assert status == 200
+    render_id = json.loads(body)['renderId']
+
+    (status, _, body) = await call('GET', '/renders/{}.json'.format(render_id))
+    assert status == 200 and json.loads(body) == {'value': 2}
+    (status, _, body) = await call('GET', '/stats')
+    stats = json.loads(body)['scheduler']
+    assert (stats['completed'], stats['cancelled'], stats['running'], stats['waiting']) == (1, 1, 0, 0)
+
+  asyncio.run(scenario())
+
+def test_waiting_renders_are_superseded_without_starting(monkeypatch, renders):
+  scheduler = use_scheduler(monkeypatch, max_workers=1)
+
+  async def scenario():
+    running = asyncio.create_task(post(1, 'a'))
+    await until(lambda: renders.started == [1])
+    waiting = asyncio.create_task(post(2, 'b'))
+    await until(lambda: scheduler.stats()['waiting'] == 1)
+    latest = asyncio.create_task(post(3, 'b'))
+    assert (await waiting)[0] == 409
+    renders.release.set()
+    assert (await running)[0] == 200 and (await latest)[0] == 200
+    # the superseded request never rendered
+    assert renders.started == [1, 3]
+    assert scheduler.stats()['superseded'] == 1
+
+  asyncio.run(scenario())
+
+def test_full_queue_is_answered_503(monkeypatch, renders):
+  scheduler = use_scheduler(monkeypatch, max_workers=1, max_waiting=1)
+
+  async def scenario():
+    running = asyncio.create_task(post(1, 'a'))
+    await until(lambda: renders.started == [1])
+    waiting = asyncio.create_task(post(2, 'b'))
+    await until(lambda: scheduler.stats()['waiting'] == 1)
+    (status, headers, body) = await post(3, 'c')
+    assert status == 503 and headers[b'retry-after'] == b'1'
+    assert json.loads(body) == {'overloaded': True}
+    renders.release.set()
+    assert (await running)[0] == 200 and (await waiting)[0] == 200
+    assert scheduler.stats()['rejected'] == 1
+
+  asyncio.run(scenario())
+
+def test_shared_render_cancelled_by_one_session_completes_for_others(monkeypatch, renders):
+  use_scheduler(monkeypatch, max_workers=2)
+
+  async def scenario():
+    owner = asyncio.create_task(post(1, 'a'))
+    await until(lambda: renders.started == [1])
+    # the same request from another session waits for the first one's render
+    sharer = asyncio.create_task(post(1, 'b'))
+    await until(lambda: service.response_cache().stats()['shared'] == 1)
+    # session a moves on, so its render stops
+    moved_on = asyncio.create_task(post(2, 'a'))
+    assert (await owner)[0] == 409
+    # and b's request renders it again itself
+    await until(lambda: renders.started.count(1) == 2)
+    renders.release.set()
+    (status, _, body) = await sharer
+    assert status == 200
+    (_, _, spec) = await call('GET', '/renders/{}.json'.format(json.loads(body)['renderId']))
+    assert json.loads(spec) == {'value': 1}
+    assert (await moved_on)[0] == 200
+    assert renders.cancelled == [1]
+
+  asyncio.run(scenario())
+
+def test_unreadable_sheet_is_missing_columns(monkeypatch, renders):
+  use_scheduler(monkeypatch)
+  renders.release.set()
+  def unreadable():
+    raise OSError("no sheet")
+  monkeypatch.setattr(service, 'sheet_store', unreadable)
+
+  async def scenario():
+    payload = {'nodes': [{'name': 'B2:B4', 'parent': None, 'function': 'vector'}], 'datadict': {}, 'rootName': 'B2:B4'}
+    (status, _, body) = await call('POST', '/postSpecs', json.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json'})
+    assert status == 422 and json.loads(body) == {'missing': ['B2:B4']}
+    # sent along, the sheet isn't needed
+    payload['datadict'] = {'B2:B4': [1, 2, 3]}
+    (status, _, body) = await call('POST', '/postSpecs', json.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json'})
+    assert status == 200
+
+  asyncio.run(scenario())
+
+def test_bad_and_missing_columns(monkeypatch, renders):
+  use_scheduler(monkeypatch)
+  renders.release.set()
+
+  async def scenario():
+    (status, _, body) = await call('POST', '/postSpecs', b'{not json', {'Content-Type': 'application/json'})
+    assert status == 400
+    payload = {'nodes': [{'name': 'x', 'parent': None, 'function': 'scalar'}], 'datadict': {'x': {'ref': 'gone'}}, 'rootName': 'x'}
+    (status, _, body) = await call('POST', '/postSpecs', json.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json'})
+    assert status == 422 and json.loads(body) == {'missing': ['x']}
+    assert (await call('GET', '/nowhere'))[0] == 404
+    assert (await call('DELETE', '/stats'))[0] == 405
+
+  asyncio.run(scenario())
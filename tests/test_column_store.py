@@ -0,0 +1,48 @@
+from specmetric.column_store import ColumnStore, NpyColumn, CsvColumns
+from specmetric.renderer import AltairRenderer
+from specmetric.visualization_container import VisualizationContainer
+from specmetric.computation_tree import ComputationNode
+import numpy as np
+import pickle
+
+def test_renderer_loads_only_encoded_columns():
+  loaded = []
+  def loader(name):
+    def load():
+      loaded.append(name)
+      return np.arange(1, 101, dtype=float) * (1 + int(name[3:]))
+    return load
+  store = ColumnStore({'col{}'.format(i): loader('col{}'.format(i)) for i in range(200)})
+  assert len(store) == 200 and 'col7' in store and 'ids' not in store
+  assert loaded == []
+
+  vc = VisualizationContainer(ComputationNode('fake', None, 'scalar'))
+  vc.valid_chart = 'mean_chart'
+  vc.encodings = {'col7': {'mark': 'line', 'channels': 'vector-location'}}
+  AltairRenderer([vc], store).convert_to_charts()
+  assert loaded == ['col7']
+
+def test_memory_budget_evicts_least_recently_used():
+  store = ColumnStore({name: (lambda: np.zeros(100)) for name in 'abcd'}, memory_budget=2000)
+  for name in 'abca':
+    store[name]
+  # 800 bytes each, so only two fit
+  assert store.loaded() == ['c', 'a']
+  stats = store.stats()
+  assert (stats['loads'], stats['hits'], stats['evictions'], stats['bytes']) == (4, 0, 2, 1600)
+  store['a']
+  assert store.stats()['hits'] == 1
+
+  # a copy for another process starts with nothing loaded
+  assert pickle.loads(pickle.dumps(ColumnStore({'a': [1, 2]}))).loaded() == []
+
+def test_npy_and_csv_columns(tmp_path):
+  np.save(tmp_path / 'x.npy', np.arange(10.))
+  (tmp_path / 'sheet.csv').write_text('a,b,c\n1,x,4\n2,y,5\n3,z,6\n')
+  store = ColumnStore({'x': NpyColumn(str(tmp_path / 'x.npy'))}, providers=[CsvColumns(str(tmp_path / 'sheet.csv'), start=1)])
+  assert list(store) == ['x', 'a', 'b', 'c']
+  assert isinstance(store['x'], np.memmap)
+  # memory mapped columns don't count against the budget
+  assert store.stats()['bytes'] == 0
+  assert list(store['b']) == ['y', 'z']
+  assert list(store['c']) == [5, 6]
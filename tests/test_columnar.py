@@ -0,0 +1,143 @@
+import asyncio
+import json
+import struct
+
+import numpy as np
+import pytest
+
+import asgi_app
+from columnar import CONTENT_TYPE, BadRequest, MissingColumns, UploadedColumns, column_hash, decode_columns, decode_request
+from specmetric.sheet_store import SheetStore
+
+
+def columnar_body(header, data=b''):
+  header = json.dumps(header).encode('utf-8')
+  body = struct.pack('<I', len(header)) + header
+  return body + b'\0' * (-len(body) % 8) + data
+
+def header_of(**datadict):
+  return {'nodes': [], 'rootName': 'x', 'datadict': datadict}
+
+
+def test_decode_columns():
+  data = np.arange(4, dtype='<f8').tobytes() + np.array([7, 8], dtype='<i4').tobytes()
+  payload = decode_columns(columnar_body(header_of(
+    x={'dtype': '<f8', 'offset': 0, 'length': 4},
+    y={'dtype': '<i4', 'offset': 32, 'length': 2},
+    z=[1, 2]), data))
+  assert payload['rootName'] == 'x'
+  assert payload['datadict']['x'].tolist() == [0.0, 1.0, 2.0, 3.0]
+  assert payload['datadict']['y'].dtype == np.dtype('<i4') and payload['datadict']['y'].tolist() == [7, 8]
+  assert payload['datadict']['z'] == [1, 2]
+  assert decode_request(columnar_body(header_of(z=[1])), CONTENT_TYPE + '; charset=binary')['datadict'] == {'z': [1]}
+
+@pytest.mark.parametrize('column', [
+  {'dtype': '<f8', 'offset': 0, 'length': 5},
+  {'dtype': '<f8', 'offset': 8, 'length': 4},
+  {'dtype': '<f8', 'offset': 40, 'length': 0},
+  {'dtype': '<f8', 'offset': -8, 'length': 1},
+  {'dtype': '<f8', 'offset': 0, 'length': -1},
+  {'dtype': '<f8', 'offset': 0.5, 'length': 1},
+  {'dtype': '<f8', 'offset': 0, 'length': True},
+  {'dtype': '<f8', 'offset': 0},
+  {'dtype': 'O', 'offset': 0, 'length': 1},
+  {'dtype': '<U4', 'offset': 0, 'length': 1},
+])
+def test_decode_columns_rejects_bad_columns(column):
+  with pytest.raises(BadRequest):
+    decode_columns(columnar_body(header_of(x=column), np.zeros(4).tobytes()))
+
+@pytest.mark.parametrize('body', [b'', b'\1\0', struct.pack('<I', 100) + b'{}', struct.pack('<I', 2) + b'{}', columnar_body([1])])
+def test_decode_columns_rejects_bad_bodies(body):
+  with pytest.raises(BadRequest):
+    decode_columns(body)
+
+def test_column_hash():
+  assert column_hash([1, 2]) == column_hash(np.array([1, 2], dtype=object))
+  assert column_hash(np.array([1.0, 2.0])) == column_hash(np.array([1.0, 2.0]))
+  # by dtype as well as bytes
+  assert column_hash(np.zeros(2, dtype='<f8')) != column_hash(np.zeros(4, dtype='<f4'))
+  assert column_hash([1, 2]) != column_hash([2, 1])
+
+
+def test_references_to_sent_columns():
+  columns = UploadedColumns()
+  values = np.array([1.0, 2.0])
+  (resolved, hashes) = columns.resolve({'x': values, 'y': ['a', 'b']})
+  assert resolved['x'] is values
+  (resolved, again) = columns.resolve({'x': {'ref': hashes['x']}, 'y': {'ref': hashes['y']}})
+  assert resolved['x'] is values and resolved['y'] == ['a', 'b']
+  assert again == hashes
+  with pytest.raises(MissingColumns) as e:
+    columns.resolve({'x': {'ref': hashes['x']}, 'z': {'ref': 'nonesuch'}})
+  assert e.value.names == ['z']
+
+def test_ranges_by_session_then_sheet(tmp_path):
+  path = tmp_path / 'sheet.csv'
+  path.write_text('Major,Count\nA,1\nB,2\nC,3\n')
+  sheet = SheetStore.from_csv(str(path))
+  columns = UploadedColumns()
+  edited = [10, 20, 30]
+  (_, hashes) = columns.resolve({'B2:B4': edited}, session='s')
+
+  # the session's own column for the range, the sheet's for anyone else
+  (resolved, _) = columns.resolve({'B2:B4': {'range': 'B2:B4'}}, session='s', sheet=lambda: sheet)
+  assert resolved['B2:B4'] == edited
+  (resolved, other) = columns.resolve({'B2:B4': {'range': 'B2:B4'}}, session='t', sheet=lambda: sheet)
+  assert list(resolved['B2:B4']) == [1, 2, 3]
+  assert other['B2:B4'] == sheet.key('B2:B4') != hashes['B2:B4']
+
+  with pytest.raises(MissingColumns):
+    columns.resolve({'B2:B4': {'range': 'B2:B4'}}, session='t')
+  with pytest.raises(MissingColumns):
+    columns.resolve({'x': {'range': 'Z2:Z4'}}, session='t', sheet=lambda: sheet)
+
+def test_sheet_is_only_read_for_ranges_that_miss():
+  def unreadable():
+    raise OSError("no sheet")
+  columns = UploadedColumns()
+  columns.resolve({'B2:B4': [1, 2, 3], 'x': [4]}, session='s')
+  def fail():
+    raise AssertionError("the sheet should not have been read")
+  (resolved, _) = columns.resolve({'B2:B4': {'range': 'B2:B4'}, 'x': [4]}, session='s', sheet=fail)
+  assert resolved['B2:B4'] == [1, 2, 3]
+
+  # a sheet that can't be read leaves the range missing, for the client to send
+  with pytest.raises(MissingColumns) as e:
+    columns.resolve({'B2:B4': {'range': 'B2:B4'}}, session='t', sheet=unreadable)
+  assert e.value.names == ['B2:B4']
+
+def test_columns_are_evicted_by_bytes():
+  columns = UploadedColumns(max_bytes=100)
+  hashes = {}
+  for name in 'abc':
+    (_, sent) = columns.resolve({name: np.full(5, ord(name), dtype='<f8')})
+    hashes.update(sent)
+    assert columns.stats()['bytes'] <= 100
+  # a went to make room for c, 40 bytes each
+  assert columns.stats()['evictions'] == 1
+  # using b makes c the oldest
+  columns.resolve({'b': {'ref': hashes['b']}})
+  columns.resolve({'d': np.zeros(5)})
+  assert columns.stats()['bytes'] == 80
+  with pytest.raises(MissingColumns):
+    columns.resolve({'a': {'ref': hashes['a']}})
+  with pytest.raises(MissingColumns):
+    columns.resolve({'c': {'ref': hashes['c']}})
+  columns.resolve({'b': {'ref': hashes['b']}})
+
+  # a column over max_bytes on its own stays until the next one
+  columns.resolve({'e': np.zeros(50)})
+  assert columns.stats()['size'] == 1
+
+def test_missing_columns_are_answered_422():
+  sent = []
+  async def send(message):
+    sent.append(message)
+  messages = [{'type': 'http.request', 'body': columnar_body({'nodes': [{'name': 'x', 'parent': None, 'function': 'scalar'}], 'rootName': 'x', 'datadict': {'x': {'ref': 'nonesuch'}}}), 'more_body': False}]
+  async def receive():
+    return messages.pop(0)
+  scope = {'type': 'http', 'method': 'POST', 'path': '/postSpecs', 'headers': [(b'content-type', CONTENT_TYPE.encode('latin-1'))], 'client': None}
+  asyncio.run(asgi_app.app(scope, receive, send))
+  assert sent[0]['status'] == 422
+  assert json.loads(b''.join(m.get('body', b'') for m in sent[1:])) == {'missing': ['x']}
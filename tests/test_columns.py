@@ -0,0 +1,57 @@
+from specmetric.columns import column, all_valid
+import numpy as np
+import pytest
+import tracemalloc
+
+def test_blanks_from_every_kind_of_input():
+  from_list = column(['', 1, None, 2.5, float('nan')])
+  assert list(from_list.valid) == [False, True, False, True, False]
+  assert from_list.compress().dtype.kind == 'f'
+  assert list(column(['', 3, 4]).compress()) == [3, 4]
+  assert column(['', 3, 4]).compress().dtype.kind == 'i'
+
+  values = np.array([1., 2., 3., 4.])
+  masked = column(np.ma.array(values, mask=[0, 1, 0, 0]))
+  # the masked array's data, not a copy
+  assert np.shares_memory(masked.values, values)
+  assert list(masked.compress()) == [1., 3., 4.]
+  assert list(masked.rows(np.array([2, 0]))) == [3, 0]
+  filled = masked.filled()
+  assert filled[0] == 1. and np.isnan(filled[1])
+
+  plain = column(values)
+  assert plain.values is values and plain.valid is None
+  assert plain.compress() is values
+
+  strings = column(np.array(['a', '', 'b'], dtype=object))
+  assert list(strings.filled()) == ['a', None, 'b']
+
+def test_rows_line_up():
+  x = column([1, '', 3, 4])
+  y = column(np.ma.array([5, 6, 7, 8], mask=[0, 0, 0, 1]))
+  valid = all_valid(x, y)
+  assert list(x.compress(valid)) == [1, 3]
+  assert list(y.compress(valid)) == [5, 7]
+  assert all_valid(column([1, 2]), column(np.arange(2))) is None
+  with pytest.raises(ValueError):
+    all_valid(column([1, 2]), column([1, 2, 3]))
+
+def test_no_python_objects_per_value():
+  values = np.ma.array(np.arange(1000000, dtype=float), mask=np.arange(1000000) % 10 == 0)
+  tracemalloc.start()
+  c = column(values)
+  compressed = c.compress()
+  (_, peak) = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  assert len(compressed) == 900000
+  # the mask and the compressed values, but not a million floats
+  assert peak < 2 * values.data.nbytes
+
+def test_numbers():
+  numbers = column(['Major', '', 1, '2.5', None, 3]).numbers()
+  assert numbers.dtype == float
+  assert np.isnan(numbers[[0, 1, 4]]).all()
+  assert list(numbers[[2, 3, 5]]) == [1., 2.5, 3.]
+  values = np.arange(3, dtype=float)
+  assert column(values).numbers() is values
+  assert list(column(np.ma.array([1, 2], mask=[1, 0])).numbers()[1:]) == [2.]
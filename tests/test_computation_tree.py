@@ -1,6 +1,52 @@
-from specmetric.computation_tree import ComputationNode
+from specmetric.computation_tree import ComputationNode, ComputationGraph
+from specmetric.parser import ComputationTreeParser
 
 def test_uuid_initialization():
 	cn1 = ComputationNode(None, None, None)
 	cn2 = ComputationNode(None, None, None)
-	assert cn1.uuid != cn2.uuid
\ No newline at end of file
+	assert cn1.uuid != cn2.uuid
+
+def test_graph_from_records_any_order():
+	records = [
+		{'name': 'literal_b', 'parent': 'sum', 'function_type': 'scalar', 'output_data': 'b'},
+		{'name': 'sum', 'parent': None, 'function_type': 'scalar_sum', 'input_data': ['a', 'b'], 'output_data': 'aplusb'},
+		{'name': 'literal_a', 'parent': 'sum', 'function_type': 'scalar', 'output_data': 'a'},
+	]
+	graph = ComputationGraph.from_records(records)
+	root = graph.root()
+
+	assert len(graph) == 3
+	assert root.name == 'sum'
+	assert root.function_type == 'scalar_sum'
+	assert root.input_data == ['a', 'b']
+	# children keep the order of the records
+	assert [c.name for c in root.children] == ['literal_b', 'literal_a']
+	assert all(c.is_leaf() for c in root.children)
+	assert root.children[0].parent_node == root
+	# function types are interned
+	assert sorted(graph.function_types) == ['scalar', 'scalar_sum']
+
+def test_graph_from_edge_list():
+	by_id = ComputationGraph.from_edge_list(['sum', 'a', 'b'], ['scalar_sum', 'scalar', 'scalar'], [(0, 1), (0, 2)])
+	by_name = ComputationGraph.from_edge_list(['sum', 'a', 'b'], ['scalar_sum', 'scalar', 'scalar'], [('sum', 'a'), ('sum', 'b')])
+
+	for graph in [by_id, by_name]:
+		assert list(graph.children(0)) == [1, 2]
+		assert list(graph.roots()) == [0]
+		assert graph.function_type(2) == 'scalar'
+
+def test_graph_views_parse_like_nodes():
+	records = [
+		{'name': 'literal_a', 'parent': 'sum', 'function': 'scalar', 'output_data': 'a'},
+		{'name': 'literal_b', 'parent': 'sum', 'function': 'scalar', 'output_data': 'b'},
+		{'name': 'sum', 'parent': None, 'function': 'scalar_sum', 'input_data': ['a', 'b'], 'output_data': 'aplusb'},
+	]
+	graph = ComputationGraph.from_records(records, function_type='function')
+	parser = ComputationTreeParser(graph.root())
+	parser.visualizeDFG()
+	vis_containers = parser.visualization_containers
+
+	assert len(vis_containers) == 1
+	assert vis_containers[0].valid_chart == 'single_stacked_bar'
+	assert vis_containers[0].root_node == graph.root()
+	assert graph.node(1).uuid != graph.node(2).uuid
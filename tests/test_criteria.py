@@ -0,0 +1,56 @@
+from specmetric.criteria import Criterion, MaskCache, criteria_mask, criterion_value
+from specmetric.columns import column
+import numpy as np
+import pytest
+
+TEXT = column(['Major', 'A', 'b', 'Apple', '', None, 'A*', 7])
+NUMBERS = column(np.array([np.nan, 1.0, 5.0, 5.0, 10.0, 2.5, np.nan, 0.0]))
+
+def matches(criterion, values):
+  mask = Criterion(criterion).mask(values)
+  # the vectorized mask agrees with matching values one at a time
+  assert mask.tolist() == [Criterion(criterion).matches(v) for v in values.filled().tolist()]
+  return np.flatnonzero(mask).tolist()
+
+def test_criteria_match_like_spreadsheets():
+  assert matches('a', TEXT) == [1]
+  assert matches('A*', TEXT) == [1, 3, 6]
+  assert matches('A~*', TEXT) == [6]
+  assert matches('?', TEXT) == [1, 2]
+  assert matches('<>a', TEXT) == [0, 2, 3, 4, 5, 6, 7]
+  assert matches('>b', TEXT) == [0]
+  assert matches('', TEXT) == [4, 5]
+  assert matches('<>', TEXT) == [0, 1, 2, 3, 6, 7]
+  assert matches(7, TEXT) == [7]
+
+  assert matches(5, NUMBERS) == [2, 3]
+  assert matches('>=5', NUMBERS) == [2, 3, 4]
+  assert matches('<>5', NUMBERS) == [0, 1, 4, 5, 6, 7]
+  assert matches('<2.5', NUMBERS) == [1, 7]
+  assert matches('=', NUMBERS) == [0, 6]
+  assert matches('yes', NUMBERS) == []
+
+def test_described_in_words():
+  assert Criterion('Yes').describe('a') == 'a is "Yes"'
+  assert Criterion(5).describe('a') == 'a is 5'
+  assert Criterion('>=2.5').describe('a') == 'a >= 2.5'
+  assert Criterion('<>B*').describe('a') == 'a is not "B*"'
+  assert Criterion('').describe('a') == 'a is blank'
+  assert Criterion('<>').describe('a') == 'a is not blank'
+
+def test_masks_are_combined_and_cached():
+  data = {
+    'A2:A7': ['A', 'B', 'A', 'A', 'C', 'A'],
+    'C2:C7': ['Yes', 'Yes', 'no', 'YES', 'Yes', ''],
+    'E3': 'A',
+  }
+  cache = MaskCache()
+  fingerprints = {'A2:A7': 'a', 'C2:C7': 'c'}
+  def mask(pairs):
+    return criteria_mask(pairs, lambda name: column(data[name]), lambda name: criterion_value(name, data), fingerprints.get, cache)
+
+  assert np.flatnonzero(mask(['A2:A7', 'E3', 'C2:C7', '"Yes"'])).tolist() == [0, 3]
+  assert np.flatnonzero(mask(['C2:C7', '"Yes"'])).tolist() == [0, 1, 3, 4]
+  assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+  with pytest.raises(ValueError):
+    mask(['A2:A7', 'E3', 'C2:C7'])
@@ -0,0 +1,91 @@
+from specmetric.formula import compile_formula, compile_cells, FormulaCache, FormulaError
+from specmetric.computation_tree import ComputationGraph
+from specmetric.parser import ComputationTreeParser
+import pytest
+
+SHEET = {
+  'H3': '=G3/F3',
+  'G3': '=COUNTIFS(A2:A1001,E3,C2:C1001,"Yes")',
+  'F3': '=COUNTIF(A2:A1001, E3)',
+  'D9': '=100/(AVERAGE(C3:C7))',
+}
+
+def test_compiled_tree_matches_the_spreadsheet_app():
+  records = compile_cells('H3', SHEET.get, cache=FormulaCache())
+  assert [(r['name'], r['parent'], r['function'], r['input_data']) for r in records] == [
+    ('H3', None, 'scalar_ratio', ['G3', 'F3']),
+    ('G3', 'H3', 'filter', ['A2:A1001', 'C2:C1001']),
+    ('A2:A1001', 'G3', 'vector', []),
+    ('C2:C1001', 'G3', 'vector', []),
+    ('F3', 'H3', 'filter', ['A2:A1001']),
+    ('A2:A1001#2', 'F3', 'vector', []),
+  ]
+  assert records[-1]['output_data'] == 'A2:A1001'
+  assert records[1]['criteria'] == ['A2:A1001', 'E3', 'C2:C1001', '"Yes"']
+
+  graph = ComputationGraph.from_records(records, function_type='function')
+  parser = ComputationTreeParser(graph.node(graph.index(['H3'])[0]), isSpreadsheet=True)
+  parser.visualizeDFG()
+  assert {c.valid_chart for c in parser.visualization_containers} == {'bar_chart_comp', 'factor_chart', 'dist_chart'}
+
+  records = compile_cells('D9', SHEET.get, cache=FormulaCache())
+  assert [(r['name'], r['function'], r.get('value')) for r in records] == [
+    ('D9', 'scalar_ratio', None), ('100', 'scalar', 100.0), ('AVERAGE(C3:C7)', 'mean', None), ('C3:C7', 'vector', None)]
+
+def children_of(records):
+  graph = ComputationGraph.from_records(records, function_type='function')
+  node_ids = graph.index([r['name'] for r in records])
+  return {r['name']: sorted(graph.names[c] for c in graph.children(i)) for (r, i) in zip(records, node_ids)}
+
+def test_repeated_subexpressions_link_up_each_time():
+  records = compile_cells('C1', {'C1': '=SUM(A2:A5)/SUM(A2:A5)'}.get, cache=FormulaCache())
+  assert [(r['name'], r['output_data']) for r in records] == [
+    ('C1', 'C1'), ('SUM(A2:A5)', 'SUM(A2:A5)'), ('A2:A5', 'A2:A5'), ('SUM(A2:A5)#2', 'SUM(A2:A5)'), ('A2:A5#2', 'A2:A5')]
+  assert records[0]['input_data'] == ['SUM(A2:A5)', 'SUM(A2:A5)']
+  children = children_of(records)
+  assert children['C1'] == ['SUM(A2:A5)', 'SUM(A2:A5)#2']
+  assert children['SUM(A2:A5)'] == ['A2:A5'] and children['SUM(A2:A5)#2'] == ['A2:A5#2']
+
+  records = compile_cells('C1', {'C1': '=A2:A5-A2:A5'}.get, cache=FormulaCache())
+  assert children_of(records)['C1'] == ['A2:A5', 'A2:A5#2']
+
+def test_cells_used_by_several_formulas():
+  sheet = {'C1': '=A1+B1', 'A1': '=D1/2', 'B1': '=D1-3', 'D1': '=SUM(E1:E9)'}
+  calls = []
+  def formula_of(address):
+    calls.append(address)
+    return sheet.get(address)
+  records = compile_cells('C1', formula_of, cache=FormulaCache())
+  children = children_of(records)
+  assert children['C1'] == ['A1', 'B1']
+  assert children['A1'] == ['2', 'D1'] and children['B1'] == ['3', 'D1#2']
+  # D1 is a subtree under each, compiled once
+  assert children['D1'] == ['E1:E9'] and children['D1#2'] == ['E1:E9#2']
+  assert sorted(calls) == ['A1', 'B1', 'C1', 'D1']
+
+  records = compile_cells('C1', {'C1': '=B1+B1'}.get, cache=FormulaCache())
+  assert children_of(records)['C1'] == ['B1', 'B1#2']
+
+def test_filled_down_formulas_share_a_template():
+  cache = FormulaCache()
+  templates = {compile_formula('=B{0}-C{0}'.format(row), 'D{}'.format(row), cache) for row in range(2, 1002)}
+  assert len(templates) == 1
+  assert cache.stats()['misses'] == 1 and cache.stats()['hits'] == 999
+  (records, cells) = templates.pop().records('D7')
+  assert records[0]['input_data'] == ['B7', 'C7'] and cells == [('B7', 'D7'), ('C7', 'D7')]
+
+  # absolute references stay put
+  assert compile_formula('=$B$2-C3', 'D3', cache).records('D9')[0][0]['input_data'] == ['B2', 'C9']
+
+def test_unsupported_formulas():
+  cache = FormulaCache()
+  for formula in ('=B2*C2', '=VLOOKUP(A2, B2:C9, 2)', '=SUM(', '=COUNTIF(A2:A9)'):
+    with pytest.raises(FormulaError):
+      compile_formula(formula, 'D2', cache)
+  # the errors are cached too
+  with pytest.raises(FormulaError):
+    compile_formula('=B3*C3', 'D3', cache)
+  assert cache.stats()['hits'] == 1
+  # and such cells are leaves
+  assert compile_cells('D2', {'D2': '=B2*C2'}.get, cache=cache) == [
+    {'name': 'D2', 'parent': None, 'function': 'scalar', 'input_data': [], 'output_data': 'D2'}]
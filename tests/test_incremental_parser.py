@@ -0,0 +1,92 @@
+from specmetric.parser import ComputationTreeParser
+from specmetric.incremental_parser import IncrementalParser
+from specmetric.computation_tree import ComputationNode
+from specmetric.rules_config import grammatical_expressions
+import random
+import pytest
+
+def summarize(containers):
+    return [(c.valid_chart, c.root_node, c.lowest_depth, c.encodings, list(c.computation_nodes)) for c in containers]
+
+def full_parse(root):
+    parser = ComputationTreeParser(root, share_subexpressions=False, cache=None)
+    parser.visualizeDFG()
+    return summarize(parser.visualization_containers)
+
+def all_nodes(root):
+    nodes = [root]
+    for node in nodes:
+        nodes.extend(node.children)
+    return nodes
+
+def test_incremental_parser_matches_full_parse():
+    function_types = sorted(grammatical_expressions.keys())
+    names = ['v{}'.format(i) for i in range(6)]
+    for seed in range(30):
+        rng = random.Random(seed)
+
+        def make_node(parent=None):
+            return ComputationNode('n{}'.format(rng.randrange(10 ** 6)), parent, rng.choice(function_types), input_data=rng.sample(names, 2), output_data=rng.choice(names))
+
+        root = make_node()
+        nodes = [root]
+        for _ in range(rng.randint(0, 40)):
+            nodes.append(make_node(rng.choice(nodes)))
+
+        parser = IncrementalParser(root)
+        parser.visualizeDFG()
+        assert summarize(parser.visualization_containers) == full_parse(root)
+
+        for _ in range(20):
+            node = rng.choice(all_nodes(parser.computation_tree))
+            edit = rng.randrange(4)
+            if edit == 0:
+                parser.set_function_type(node, rng.choice(function_types))
+            elif edit == 1:
+                parser.replace_node(node, make_node())
+            elif edit == 2:
+                child = make_node()
+                for _ in range(rng.randrange(3)):
+                    make_node(child)
+                parser.add_child(node, child, rng.randint(0, len(node.children)))
+            elif node.children:
+                parser.remove_child(node, rng.choice(node.children))
+            parser.visualizeDFG()
+            assert summarize(parser.visualization_containers) == full_parse(parser.computation_tree)
+
+def test_incremental_parser_only_resolves_edited_path():
+    ratio = ComputationNode('ratio', None, 'scalar_ratio', input_data=['ss_res', 'ss_tot'], output_data='ratio')
+    ss_res = ComputationNode('ss_res', ratio, 'vector_sum', input_data=['res'], output_data='ss_res')
+    ss_tot = ComputationNode('ss_tot', ratio, 'vector_sum', input_data=['tot'], output_data='ss_tot')
+    ComputationNode('literal_res', ss_res, 'vector', output_data='res')
+    literal_tot = ComputationNode('literal_tot', ss_tot, 'vector', output_data='tot')
+
+    parser = IncrementalParser(ratio)
+    parser.visualizeDFG()
+    assert [c.valid_chart for c in parser.visualization_containers] == ['bar_chart_comp']
+    res_heap = parser.resolved[ss_res]
+
+    parser.set_function_type(ratio, 'scalar_diff')
+    assert parser.dirty == {ratio}
+    parser.visualizeDFG()
+    assert [c.valid_chart for c in parser.visualization_containers] == ['bar_chart_diff']
+    # the untouched subtree was not resolved again
+    assert parser.resolved[ss_res] is res_heap
+
+    vector_tot = ComputationNode('vector_tot', None, 'vector', output_data='tot')
+    parser.replace_node(literal_tot, vector_tot)
+    assert ss_tot.children == [vector_tot]
+    assert parser.dirty == {vector_tot, ss_tot, ratio}
+    parser.visualizeDFG()
+    assert summarize(parser.visualization_containers) == full_parse(ratio)
+
+def test_incremental_parser_rejects_shared_nodes():
+    root = ComputationNode('root', None, 'scalar_sum', input_data=['a', 'b'], output_data='c')
+    leaf = ComputationNode('leaf', root, 'scalar', output_data='a')
+    root.add_child(leaf)
+    with pytest.raises(ValueError):
+        IncrementalParser(root)
+
+    parser = IncrementalParser(ComputationNode('root', None, 'scalar_sum', input_data=['a', 'b'], output_data='c'))
+    with pytest.raises(ValueError):
+        parser.add_child(parser.computation_tree, parser.computation_tree)
@@ -0,0 +1,69 @@
+from specmetric.position_calculators.layout_cache import LayoutCache, cached_squarify_bars
+from specmetric.position_calculators.treemap import squarify_bars
+import numpy as np
+import os
+
+def test_cached_layouts_match_and_hit():
+  cache = LayoutCache(maxsize=2)
+  bars = [np.array([5., 1., 3.]), np.array([2, 7, 7, 1])]
+  expected = squarify_bars(bars, 50, [100, 80])
+  assert np.array_equal(cached_squarify_bars(bars, 50, [100, 80], cache=cache), expected)
+  assert cache.stats()['misses'] == 2
+
+  # an unchanged bar is a hit, even in a new array; a changed one is not
+  bars = [np.array([5., 1., 3.]), np.array([2, 7, 8, 1])]
+  rects = cached_squarify_bars(bars, 50, [100, 80], cache=cache)
+  assert np.array_equal(rects, squarify_bars(bars, 50, [100, 80]))
+  stats = cache.stats()
+  assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 3, 1)
+  assert stats['hit_rate'] == 0.25
+
+  # so is the same bar in another rectangle
+  cached_squarify_bars(bars[:1], 50, 90, cache=cache)
+  assert cache.stats()['misses'] == 4
+
+def test_disk_tier_survives_and_is_bounded(tmp_path):
+  bars = [np.arange(1, 101, dtype=float), np.arange(1, 51)]
+  expected = squarify_bars(bars, 50, 100)
+  cached_squarify_bars(bars, 50, 100, cache=LayoutCache(directory=str(tmp_path)))
+  assert len(os.listdir(tmp_path)) == 2
+
+  # a new cache, as after a restart, reads them back
+  cache = LayoutCache(directory=str(tmp_path))
+  assert np.array_equal(cached_squarify_bars(bars, 50, 100, cache=cache), expected)
+  assert cache.stats()['disk_hits'] == 2
+
+  # a corrupt file is just a miss
+  for name in os.listdir(tmp_path):
+    (tmp_path / name).write_bytes(b'not a layout')
+  cache = LayoutCache(directory=str(tmp_path), max_disk_bytes=6000)
+  assert np.array_equal(cached_squarify_bars(bars, 50, 100, cache=cache), expected)
+  assert cache.stats()['misses'] == 2
+
+  # the oldest layouts are removed to stay under max_disk_bytes
+  cached_squarify_bars([np.arange(1, 101)], 50, 100, cache=cache)
+  assert cache.stats()['disk_evictions'] >= 1
+  assert sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)) <= 6000
+
+def test_memory_tier_is_bounded_by_bytes():
+  bars = [np.arange(1, 11, dtype=float), np.arange(1, 21, dtype=float), np.arange(1, 31, dtype=float)]
+  sizes = [squarify_bars([bar], 50, 100).nbytes for bar in bars]
+  cache = LayoutCache(max_bytes=sizes[1] + sizes[2])
+  for bar in bars:
+    cached_squarify_bars([bar], 50, 100, cache=cache)
+    assert cache.stats()['bytes'] <= cache.max_bytes
+  stats = cache.stats()
+  assert (stats['size'], stats['bytes'], stats['evictions']) == (2, sizes[1] + sizes[2], 1)
+
+  # the first bar went, the others are still hits
+  cached_squarify_bars(bars[1:], 50, 100, cache=cache)
+  assert cache.stats()['hits'] == 2
+  cached_squarify_bars(bars[:1], 50, 100, cache=cache)
+  assert cache.stats()['misses'] == 4
+
+  # a layout over max_bytes on its own is kept until the next one
+  cache = LayoutCache(max_bytes=1)
+  cached_squarify_bars(bars[:1], 50, 100, cache=cache)
+  assert cache.stats()['bytes'] == sizes[0]
+  cache.clear()
+  assert cache.stats()['bytes'] == 0
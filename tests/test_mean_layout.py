@@ -0,0 +1,32 @@
+from specmetric.position_calculators.mean_layout import MeanLayout, square_offsets
+import numpy as np
+
+def test_mean_layout_places_mean_and_median():
+  layout = MeanLayout([[5, 1, 3, 3], [2, 2, 2, 2]])
+  assert layout.num_values == 4
+
+  # 1 3 3 mean=3 median=3 5
+  assert list(layout.values[0]) == [1, 3, 3, 3, 3, 5]
+  assert list(layout.order[0][[0, 3, 4, 5]]) == [1, 4, 5, 0]
+  assert sorted(layout.order[0][[1, 2]]) == [2, 3]
+  assert (layout.mean_index[0], layout.median_index[0]) == (3, 4)
+  assert list(layout.colors(0, 'a')) == ['a', 'a', 'a', 'mean', 'median', 'a']
+
+  assert (layout.mean_index[1], layout.median_index[1]) == (4, 5)
+  assert list(layout.take(1, ['w', 'x', 'y', 'z'])[4:]) == [-1, -2]
+
+  # mean=3.5 goes after the median=3
+  layout = MeanLayout([1, 3, 3, 7])
+  assert list(layout.values[0]) == [1, 3, 3, 3, 3.5, 7]
+  assert (layout.mean_index[0], layout.median_index[0]) == (4, 3)
+  assert list(layout.take(0, [10, 20, 30, 40], 'm', 'M')[3:5]) == ['M', 'm']
+
+def test_square_offsets_match_running_sum():
+  values = np.random.default_rng(0).exponential(10, 1000)
+  (offsets, sides) = square_offsets(values, padding=3)
+  expected = 0.
+  for i in range(1, len(values)):
+    expected = expected + np.sqrt(values[i - 1]) + 3
+    assert offsets[i] == expected
+  assert offsets[0] == 0
+  assert np.array_equal(sides, np.sqrt(values))
@@ -1,7 +1,10 @@
 from specmetric.parser import ComputationTreeParser
 from specmetric.computation_tree import ComputationNode
+from specmetric.parse_cache import ParseCache
+from specmetric.visualization_container import VisualizationContainer
 from sklearn import datasets, linear_model
 import numpy as np
+import pytest
 
 def test_parser_leaf():
     leaf_node = ComputationNode('leaf_test', None, 'test')
@@ -157,3 +160,175 @@ def test_parser_r2():
     assert 'one' in container.encodings
     assert 'ss_res_ss_tot_ratio' in container.encodings
 
+
+def test_parser_deep_chain():
+    # deeper than the default recursion limit
+    root = ComputationNode('square_0', None, 'vector_square', input_data=['v'], output_data='v')
+    node = root
+    for i in range(1, 5000):
+        node = ComputationNode('square_{}'.format(i), node, 'vector_square', input_data=['v'], output_data='v')
+
+    parser = ComputationTreeParser(root)
+    parser.visualizeDFG()
+    vis_containers = parser.visualization_containers
+
+    # Nothing has a valid visualization, so the whole chain is one container
+    assert len(vis_containers) == 1
+    assert len(vis_containers[0].computation_nodes) == 5000
+    assert vis_containers[0].root_node == root
+
+def test_parser_wide():
+    sum_node = ComputationNode('sum', None, 'scalar_sum', input_data=['s0', 's1'], output_data='total')
+    for i in range(2000):
+        ComputationNode('literal_{}'.format(i), sum_node, 'scalar', output_data='s{}'.format(i))
+
+    parser = ComputationTreeParser(sum_node)
+    parser.visualizeDFG()
+    vis_containers = parser.visualization_containers
+
+    assert len(vis_containers) == 1
+    container = vis_containers[0]
+    assert container.valid_chart == 'single_stacked_bar'
+    assert container.root_node == sum_node
+    # the first child comes first, the parent last
+    assert [n.name for n in container.computation_nodes] == ['literal_{}'.format(i) for i in range(2000)] + ['sum']
+
+def residual_squares_subtree(parent):
+    square_residuals = ComputationNode('square_residuals', parent, 'vector_square', input_data=['y_i_minus_y_hat_i'], output_data='y_i_minus_y_hat_i_squared')
+    vector_difference_residuals = ComputationNode('vector_difference_residuals', square_residuals, 'vector_diff', input_data=['y_i', 'y_hat_i'], output_data='y_i_minus_y_hat_i')
+    ComputationNode('literal_yi', vector_difference_residuals, 'vector', output_data='y_i')
+    ComputationNode('literal_yhat', vector_difference_residuals, 'vector', output_data='y_hat_i')
+    return square_residuals
+
+def test_parser_shared_subexpressions():
+    # ss_res and mse both consume a copy of the squared residuals
+    minus_scalar = ComputationNode('minus_scalar', None, 'scalar_diff', input_data=['ss_res', 'mse'], output_data='diff')
+    ss_res = ComputationNode('ss_res', minus_scalar, 'vector_sum', input_data=['y_i_minus_y_hat_i_squared'], output_data='ss_res')
+    mse = ComputationNode('mse', minus_scalar, 'mean', input_data=['y_i_minus_y_hat_i_squared'], output_data='mse')
+    residual_squares_subtree(ss_res)
+    residual_squares_subtree(mse)
+
+    parser = ComputationTreeParser(minus_scalar, share_subexpressions=False)
+    parser.visualizeDFG()
+    assert [c.valid_chart for c in parser.visualization_containers].count('scatter_y_equals_x') == 2
+
+    parser = ComputationTreeParser(minus_scalar)
+    parser.visualizeDFG()
+    vis_containers = parser.visualization_containers
+    # the residual scatterplot is only resolved and shown once
+    assert [c.valid_chart for c in vis_containers].count('scatter_y_equals_x') == 1
+    assert len(vis_containers) == 3
+
+def test_parser_dag():
+    # the same node object consumed by two parents
+    minus_scalar = ComputationNode('minus_scalar', None, 'scalar_diff', input_data=['ss_res', 'mse'], output_data='diff')
+    ss_res = ComputationNode('ss_res', minus_scalar, 'vector_sum', input_data=['y_i_minus_y_hat_i_squared'], output_data='ss_res')
+    mse = ComputationNode('mse', minus_scalar, 'mean', input_data=['y_i_minus_y_hat_i_squared'], output_data='mse')
+    square_residuals = residual_squares_subtree(ss_res)
+    mse.add_child(square_residuals)
+
+    parser = ComputationTreeParser(minus_scalar, share_subexpressions=False)
+    parser.visualizeDFG()
+    vis_containers = parser.visualization_containers
+    scatters = [c for c in vis_containers if c.valid_chart == 'scatter_y_equals_x']
+
+    assert len(vis_containers) == 3
+    assert len(scatters) == 1
+    assert 'y_i_minus_y_hat_i_squared' in scatters[0].encodings
+
+def test_parser_keeps_unnamed_leaves_apart():
+    # two constants with nothing but their names to tell them apart
+    diff = ComputationNode('diff', None, 'scalar_diff', input_data=['a', 'b'], output_data='d')
+    a = ComputationNode('a', diff, 'scalar')
+    b = ComputationNode('b', diff, 'scalar')
+
+    parser = ComputationTreeParser(diff)
+    (root_id, nodes, children) = parser.canonicalize()
+    assert len(nodes) == 3
+    assert [nodes[i] for i in children[root_id]] == [a, b]
+
+    # while leaves with the same output are still shared
+    diff = ComputationNode('diff', None, 'scalar_diff', input_data=['a', 'a'], output_data='d')
+    ComputationNode('a', diff, 'scalar', output_data='a')
+    ComputationNode('a_again', diff, 'scalar', output_data='a')
+    (root_id, nodes, children) = ComputationTreeParser(diff).canonicalize()
+    assert len(nodes) == 2 and children[root_id] == [0, 0]
+
+def test_parser_cycle():
+    a = ComputationNode('a', None, 'vector_square', input_data=['b'], output_data='a')
+    b = ComputationNode('b', a, 'vector_square', input_data=['a'], output_data='b')
+    b.add_child(a)
+
+    parser = ComputationTreeParser(a)
+    with pytest.raises(ValueError):
+        parser.visualizeDFG()
+
+def test_parser_cache_rebinds_names():
+    cache = ParseCache(maxsize=4)
+
+    def ratio_tree(suffix):
+        ratio = ComputationNode('ratio', None, 'scalar_ratio', input_data=['ss_res' + suffix, 'ss_tot' + suffix], output_data='ratio' + suffix)
+        ss_res = ComputationNode('ss_res', ratio, 'vector_sum', input_data=['res' + suffix], output_data='ss_res' + suffix)
+        ss_tot = ComputationNode('ss_tot', ratio, 'vector_sum', input_data=['tot' + suffix], output_data='ss_tot' + suffix)
+        ComputationNode('literal_res', ss_res, 'vector', output_data='res' + suffix)
+        ComputationNode('literal_tot', ss_tot, 'vector', output_data='tot' + suffix)
+        return ratio
+
+    first = ComputationTreeParser(ratio_tree('_a'), cache=cache)
+    first.visualizeDFG()
+    assert cache.stats()['misses'] == 1
+
+    root = ratio_tree('_b')
+    second = ComputationTreeParser(root, cache=cache)
+    second.visualizeDFG()
+    assert cache.stats()['hits'] == 1
+
+    uncached = ComputationTreeParser(ratio_tree('_b'), cache=None)
+    uncached.visualizeDFG()
+
+    assert len(second.visualization_containers) == len(uncached.visualization_containers) == 1
+    container = second.visualization_containers[0]
+    assert container.valid_chart == 'bar_chart_comp'
+    assert container.encodings == uncached.visualization_containers[0].encodings
+    assert list(container.encodings) == ['res_b', 'ss_res_b', 'tot_b', 'ss_tot_b']
+    # containers are bound to the nodes of the tree that was parsed
+    assert container.root_node == root
+    assert type(container) is VisualizationContainer
+    assert vars(container).keys() == vars(uncached.visualization_containers[0]).keys()
+
+def test_parser_compositions_add_chart_type():
+    grammatical_expressions = {
+        'vector': {'input_data_type': 'any', 'output_data_type': 'vector'},
+        'vector_max': {'input_data_type': 'vector', 'output_data_type': 'scalar', 'valid_visualization': 'max_chart'},
+        'scalar_diff': {'input_data_type': 'scalar', 'output_data_type': 'scalar', 'valid_visualization': 'bar_chart_diff'},
+    }
+    compositions = {
+        'charts': {
+            'max_chart': {'encodings': [{'data': 'input', 'index': 0, 'mark': 'tick', 'channels': 'vector-location'}]},
+        },
+        'merges': [
+            {
+                'parent': 'bar_chart_diff',
+                'child': 'max_chart',
+                'result': 'bar_chart_diff',
+                'encodings': [{'data': 'child_output', 'mark': 'area', 'channels': ['x', 'y'], 'offset': 'tied-{parent_output}'}],
+            },
+        ],
+    }
+    diff = ComputationNode('diff', None, 'scalar_diff', input_data=['max_a', 'max_b'], output_data='d')
+    max_a = ComputationNode('max_a', diff, 'vector_max', input_data=['a'], output_data='max_a')
+    max_b = ComputationNode('max_b', diff, 'vector_max', input_data=['b'], output_data='max_b')
+    ComputationNode('literal_a', max_a, 'vector', output_data='a')
+    ComputationNode('literal_b', max_b, 'vector', output_data='b')
+
+    parser = ComputationTreeParser(diff, compositions=compositions, grammatical_expressions=grammatical_expressions, cache=None)
+    parser.visualizeDFG()
+    vis_containers = parser.visualization_containers
+
+    # both max charts merge into the diff through the new composition rule
+    assert len(vis_containers) == 1
+    container = vis_containers[0]
+    assert container.valid_chart == 'bar_chart_diff'
+    assert container.encodings['a'] == {'mark': 'tick', 'channels': 'vector-location'}
+    assert container.encodings['max_a'] == {'mark': 'area', 'channels': ['x', 'y'], 'offset': 'tied-d'}
+    assert container.encodings['max_b'] == {'mark': 'area', 'channels': ['x', 'y'], 'offset': 'tied-d'}
@@ -0,0 +1,81 @@
+import asyncio
+import gzip
+import json
+
+import asgi_app
+from render_store import RenderStore
+
+
+SPEC = json.dumps({'mark': 'bar', 'data': {'values': [{'a': 1}]}})
+
+def serve(render, kind, headers=None):
+  """
+  status, headers and body of asgi_app.send_render's response
+  """
+  sent = []
+  async def send(message):
+    sent.append(message)
+  request_headers = {k.lower().encode('latin-1'): v.encode('latin-1') for (k, v) in (headers or {}).items()}
+  asyncio.run(asgi_app.send_render(send, request_headers, render, kind))
+  return (sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:]))
+
+
+def test_render_id_is_a_hash_of_the_spec():
+  store = RenderStore()
+  render = store.add_json(SPEC)
+  assert store.add_json(SPEC) is render
+  assert render.etag == render.render_id
+  assert store.add_json(SPEC.replace('bar', 'point')).render_id != render.render_id
+  assert store.get(render.render_id) is render
+  assert store.get('nonesuch') is None
+
+def test_old_renders_are_evicted():
+  store = RenderStore(maxsize=2)
+  (a, b) = (store.add_json('{"a": 1}'), store.add_json('{"b": 1}'))
+  # using a again makes b the oldest
+  store.add_json('{"a": 1}')
+  c = store.add_json('{"c": 1}')
+  assert store.get(b.render_id) is None
+  assert store.get(a.render_id) is a and store.get(c.render_id) is c
+  assert store.latest() is c
+
+def test_etag_and_not_modified():
+  render = RenderStore().add_json(SPEC)
+  (status, headers, body) = serve(render, 'json')
+  assert status == 200 and json.loads(body) == json.loads(SPEC)
+  etag = headers[b'etag'].decode('latin-1')
+  assert etag == '"{}"'.format(render.render_id)
+  assert b'immutable' in headers[b'cache-control']
+
+  (status, headers, body) = serve(render, 'json', {'If-None-Match': etag})
+  assert (status, body) == (304, b'')
+  assert headers[b'etag'].decode('latin-1') == etag
+  assert serve(render, 'json', {'If-None-Match': '"other", ' + etag})[0] == 304
+  assert serve(render, 'json', {'If-None-Match': '*'})[0] == 304
+  assert serve(render, 'json', {'If-None-Match': '"other"'})[0] == 200
+
+def test_gzip_only_when_accepted():
+  render = RenderStore().add_json(SPEC)
+  (status, headers, body) = serve(render, 'json', {'Accept-Encoding': 'gzip, deflate'})
+  assert status == 200 and headers[b'content-encoding'] == b'gzip'
+  assert headers[b'vary'] == b'Accept-Encoding'
+  assert gzip.decompress(body) == SPEC.encode('utf-8')
+  # compressed once
+  assert render.gzipped('json') is render.gzipped('json')
+
+  (status, headers, body) = serve(render, 'json', {'Accept-Encoding': 'identity'})
+  assert b'content-encoding' not in headers and body == SPEC.encode('utf-8')
+
+def test_html_page():
+  render = RenderStore().add_json(SPEC)
+  (status, headers, body) = serve(render, 'html', {'Accept-Encoding': 'gzip'})
+  assert status == 200 and headers[b'content-type'].startswith(b'text/html')
+  page = gzip.decompress(body).decode('utf-8')
+  assert '<html' in page and '"mark": "bar"' in page
+
+def test_archive(tmp_path):
+  store = RenderStore(archive_directory=str(tmp_path))
+  render = store.add_json(SPEC)
+  store._archiver.shutdown(wait=True)
+  [name] = [path.name for path in tmp_path.iterdir()]
+  assert name.endswith('_{}.html'.format(render.render_id))
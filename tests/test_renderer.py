@@ -1,4 +1,7 @@
-from specmetric.renderer import AltairRenderer
+import json
+import re
+import numpy as np
+from specmetric.renderer import AltairRenderer, VegaLiteRenderer
 from specmetric.visualization_container import VisualizationContainer
 from specmetric.computation_tree import ComputationNode
 from altair import Chart
@@ -184,6 +187,41 @@ def test_scatter_y_equals_x():
   # chart = charts[2]
   # assert chart.mark == 'rect'
 
+def test_scatter_of_columns_with_headers():
+  specs = [
+    {
+      'valid_chart': 'scatter_y_equals_x',
+      'encodings': {
+        "a": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'x'
+        },
+        "b": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'y'
+        },
+        "bline": {
+          "mark": "line",
+          "channels": "vector-location"
+        }
+      }
+    }
+  ]
+  # whole spreadsheet columns, header included
+  data_dict = {
+    'a': ['Before', 1, 1, 3],
+    'b': ['After', 2, 1, 0],
+    'bline': ['Change', 1, 0, -3]
+  }
+  vc = helper_containers_from_specs(specs)
+  chart = AltairRenderer(vc, data_dict).convert_to_charts()
+  spec = chart.to_dict()
+  [values] = [dataset for dataset in spec['datasets'].values() if 'linediff' in dataset[0]]
+  assert [row['x'] for row in values[1:]] == [1, 1, 3]
+  assert values[0]['x'] is None and values[0]['linediff'] is None
+
 def test_spacefilling():
   specs = [
     {
@@ -208,3 +246,337 @@ def test_spacefilling():
 
 
 
+
+def test_layers_share_one_dataset():
+  specs = [
+    {
+      'valid_chart': 'scatter_y_equals_x',
+      'encodings': {
+        "a": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'x'
+        },
+        "b": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'y'
+        },
+        "bsquare": {
+          "mark": "square",
+          "channels": "vector-location"
+        },
+        "r1": {
+          "mark": "bar-compare",
+          "channels": "vector-location",
+          "skip": True
+        },
+        "r2": {
+          "mark": "bar-compare",
+          "channels": "vector-location",
+          "skip": True
+        }
+      }
+    }
+  ]
+  n = 2000
+  data_dict = {
+    'a': [i % 97 for i in range(n)],
+    'b': [i % 89 for i in range(n)],
+    'bsquare': [i % 13 for i in range(n)],
+    'r1': [i % 7 for i in range(n)],
+    'r2': [i % 5 for i in range(n)],
+    'ids': ['row{}'.format(i) for i in range(n)]
+  }
+  vc = helper_containers_from_specs(specs)
+  r = AltairRenderer(vc, data_dict)
+  spec = r.convert_to_charts().to_dict()
+
+  # the dots, squares and both sets of ratio bars all draw from one dataset
+  datasets = spec['datasets']
+  large = [name for name, values in datasets.items() if len(values) == n]
+  assert len(large) == 1
+  assert sum(len(values) for values in datasets.values()) < n + 10
+
+  # so the whole spec is barely bigger than a single copy of the data
+  spec_bytes = len(json.dumps(spec))
+  data_bytes = len(json.dumps(datasets[large[0]]))
+  assert spec_bytes < 1.1 * data_bytes
+
+def test_dataset_from_columns():
+  r = AltairRenderer([], {})
+  data = r.dataset({
+    'x': np.array([1.5, np.nan, 3.0]),
+    'label': ['a', 2, None],
+    'id': range(3)
+  })
+  assert list(data['values']) == [
+    {'x': 1.5, 'label': 'a', 'id': 0},
+    {'x': None, 'label': 2, 'id': 1},
+    {'x': 3.0, 'label': None, 'id': 2}
+  ]
+  assert type(data['values'][0]['x']) is float
+  assert r.shorthand({'x': [1.5, 2.0]}, 'x') == 'x:Q'
+  assert r.shorthand({'label': ['a', 'b']}, 'label') == 'label:N'
+
+def test_parallel_charts_match_serial():
+  specs = [
+    {
+      'valid_chart': 'scatter_y_equals_x',
+      'encodings': {
+        "a": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'x'
+        },
+        "b": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'y'
+        }
+      }
+    },
+    {
+      'valid_chart': 'mean_chart',
+      'encodings': {
+        "a": {
+          "mark": "line",
+          "channels": "vector-location"
+        }
+      }
+    },
+    {
+      'valid_chart': 'spacefilling',
+      'encodings': {
+        "b": {
+          "mark": "square",
+          "channels": "vector-location"
+        }
+      }
+    }
+  ]
+  n = 500
+  data_dict = {
+    'a': [i % 97 for i in range(n)],
+    'b': [1 + i % 89 for i in range(n)],
+    'ids': ['row{}'.format(i) for i in range(n)]
+  }
+  vc = helper_containers_from_specs(specs)
+  r = AltairRenderer(vc, data_dict)
+  expected = r.convert_to_charts().to_dict()
+
+  def without_selection_names(spec):
+    # every call makes a new crosslinker, with a new name
+    return json.loads(re.sub(r'selector\d+', 'crosslinker', json.dumps(spec)))
+
+  expected = without_selection_names(expected)
+  assert without_selection_names(r.convert_to_charts(executor='thread', max_workers=3).to_dict()) == expected
+  assert without_selection_names(r.convert_to_charts(executor='process', max_workers=2).to_dict()) == expected
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(2) as pool:
+    assert without_selection_names(r.convert_to_charts(executor=pool).to_dict()) == expected
+
+def test_blank_rows_left_out_together():
+  specs = [
+    {
+      'valid_chart': 'factor_chart',
+      'encodings': {
+        "a": {
+          "mark": "point",
+          "channels": "vector-location"
+        },
+        "b": {
+          "mark": "point",
+          "channels": "vector-location"
+        }
+      }
+    }
+  ]
+  data_dict = {
+    'a': np.ma.array([0., 1., 2., 3., 4.], mask=[1, 0, 0, 1, 0]),
+    'b': np.array([np.nan, 5., np.nan, 7., 8.])
+  }
+  vc = helper_containers_from_specs(specs)
+  spec = AltairRenderer(vc, data_dict).convert_to_charts().to_dict()
+  assert [list(values) for values in spec['datasets'].values()] == [[{'values_x': 1.0, 'values_y': 5.0}, {'values_x': 4.0, 'values_y': 8.0}]]
+
+def test_vegalite_renderer_matches_altair():
+  specs = [
+    {
+      'valid_chart': 'scatter_y_equals_x',
+      'encodings': {
+        "a": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'x'
+        },
+        "b": {
+          "mark": "point",
+          "channels": "vector-location",
+          "preference": 'y'
+        },
+        "c": {
+          "mark": "bar-compare",
+          "channels": "vector-location",
+          "skip": True
+        },
+        "d": {
+          "mark": "bar-compare",
+          "channels": "vector-location",
+          "skip": True
+        }
+      }
+    },
+    {
+      'valid_chart': 'mean_chart',
+      'encodings': {
+        "a": {
+          "mark": "square",
+          "channels": "vector-location"
+        }
+      }
+    },
+    {
+      'valid_chart': 'factor_chart',
+      'encodings': {
+        "a": {
+          "mark": "point",
+          "channels": "vector-location"
+        },
+        "label": {
+          "mark": "point",
+          "channels": "vector-location"
+        }
+      }
+    },
+    {
+      'valid_chart': 'spacefilling',
+      'encodings': {
+        "b": {
+          "mark": "square",
+          "channels": "vector-location"
+        }
+      }
+    }
+  ]
+  n = 200
+  data_dict = {
+    'a': [i % 97 for i in range(n)],
+    'b': [1 + i % 89 for i in range(n)],
+    'c': [1 + i % 7 for i in range(n)],
+    'd': [2 + i % 5 for i in range(n)],
+    'label': ['abc'[i % 3] for i in range(n)],
+    'ids': ['row{}'.format(i) for i in range(n)]
+  }
+  vc = helper_containers_from_specs(specs)
+
+  def without_selection_names(spec):
+    return json.loads(re.sub(r'selector\d+', 'crosslinker', spec))
+
+  expected = AltairRenderer(vc, data_dict).convert_to_charts().to_json()
+  chart = VegaLiteRenderer(vc, data_dict).convert_to_charts()
+  assert without_selection_names(chart.to_json()) == without_selection_names(expected)
+  chart.to_dict(validate=True)
+
+def test_charts_wrapped_into_columns():
+  specs = [
+    {
+      'valid_chart': 'mean_chart',
+      'encodings': {
+        name: {
+          "mark": "line",
+          "channels": "vector-location"
+        }
+      }
+    }
+    for name in ['a', 'b', 'c']
+  ]
+  data_dict = {
+    'a': [1, 2, 3],
+    'b': [4, 5, 6],
+    'c': [7, 8, 9]
+  }
+  vc = helper_containers_from_specs(specs)
+  side_by_side = AltairRenderer(vc, data_dict).convert_to_charts().to_dict()
+  wrapped = AltairRenderer(vc, data_dict, columns=2).convert_to_charts().to_dict()
+  assert wrapped['columns'] == 2
+  assert len(wrapped['concat']) == 3
+  # every call makes a new crosslinker, with a new name
+  assert re.sub(r'selector\d+', 'crosslinker', json.dumps(wrapped['concat'])) == re.sub(r'selector\d+', 'crosslinker', json.dumps(side_by_side['hconcat']))
+
+def test_unchanged_containers_reuse_cached_charts():
+  from specmetric.chart_cache import ChartCache
+  specs = [
+    {
+      'valid_chart': 'mean_chart',
+      'encodings': {
+        name: {
+          "mark": "line",
+          "channels": "vector-location"
+        }
+      }
+    }
+    for name in ['a', 'b', 'c']
+  ]
+  data_dict = {
+    'a': [1, 2, 3],
+    'b': [4, 5, 6],
+    'c': [7, 8, 9]
+  }
+  vc = helper_containers_from_specs(specs)
+  cache = ChartCache(maxsize=4)
+  AltairRenderer(vc, data_dict, chart_cache=cache).convert_to_charts()
+  assert cache.stats()['misses'] == 3
+
+  data_dict['b'] = [4, 5, 7]
+  chart = AltairRenderer(vc, data_dict, chart_cache=cache).convert_to_charts()
+  assert (cache.stats()['hits'], cache.stats()['misses'], cache.stats()['evictions']) == (2, 4, 0)
+  fresh = AltairRenderer(vc, data_dict, chart_cache=ChartCache()).convert_to_charts()
+  assert chart.to_dict() == fresh.to_dict()
+
+  # a blank where there was none is a change too
+  data_dict['c'] = [7, 8, None]
+  AltairRenderer(vc, data_dict, chart_cache=cache).convert_to_charts()
+  assert (cache.stats()['misses'], cache.stats()['evictions'], len(cache)) == (5, 1, 4)
+
+def test_factor_chart_marks_rows_meeting_criteria():
+  specs = [
+    {
+      'valid_chart': 'factor_chart',
+      'encodings': {
+        "a": {
+          "mark": "circle",
+          "channels": "vector-location"
+        }
+      }
+    }
+  ]
+  data = {
+    'a': ['Major', 'A', 'B', 'A', 'C', 'A', 'B'],
+    'b': ['', 'Yes', 'No', 'No', 'Yes', 'Yes', 'Yes'],
+    'E3': 'A',
+  }
+  criteria = {'fake': ['a', 'E3', 'b', '"Yes"']}
+  chart = AltairRenderer(helper_containers_from_specs(specs), data, criteria=criteria).convert_to_charts().to_dict()
+  assert chart['title'] == 'Frequency of Values in a (2 matching a is "A", b is "Yes")'
+  assert chart['encoding']['color']['field'] == 'criteria'
+  (values,) = chart['datasets'].values()
+  counts = {(v['val'], v['criteria']): v['amt'] for v in values}
+  assert counts == {('Major', 'not matching'): 1, ('A', 'matching'): 2, ('A', 'not matching'): 1, ('B', 'not matching'): 2, ('C', 'not matching'): 1}
+
+  # the same chart either way
+  vegalite = VegaLiteRenderer(helper_containers_from_specs(specs), data, criteria=criteria).convert_to_charts().to_dict()
+  assert re.sub(r'selector\d+', 'crosslinker', json.dumps(vegalite, sort_keys=True)) == re.sub(r'selector\d+', 'crosslinker', json.dumps(chart, sort_keys=True))
+
+def test_dataset_rows_remember_their_name(monkeypatch):
+  from specmetric import vegalite
+  specs = [{'valid_chart': 'spacefilling', 'encodings': {"a": {"mark": "square", "channels": "vector-location"}}}]
+  chart = VegaLiteRenderer(helper_containers_from_specs(specs), {'a': [1, 1, 3, 1, 2]}).convert_to_charts()
+  first = chart.to_dict()
+  rows = chart.data['values']
+  assert isinstance(rows, vegalite.Rows) and rows.name in first['datasets']
+  # a spec written out again names its datasets without hashing them again
+  def fail(values):
+    raise AssertionError("dataset hashed again")
+  monkeypatch.setattr(vegalite, 'dataset_name', fail)
+  assert chart.to_dict() == first
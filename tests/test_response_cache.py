@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+from response_cache import ResponseCache, request_key
+
+
+def test_request_key_ignores_key_order():
+  assert request_key({'a': 1, 'b': [1, 2]}) == request_key({'b': [1, 2], 'a': 1})
+  assert request_key({'a': 1}) != request_key({'a': 2})
+
+def test_identical_requests_in_flight_compute_once():
+  cache = ResponseCache()
+  release = threading.Event()
+  calls = []
+  def compute():
+    calls.append(1)
+    release.wait(5)
+    return b'x' * 100
+
+  num_threads = 8
+  results = [None] * num_threads
+  def request(i):
+    results[i] = cache.get_or_compute('key', compute)
+  threads = [threading.Thread(target=request, args=(i,)) for i in range(num_threads)]
+  for thread in threads:
+    thread.start()
+  # everyone but the first waits for the first one's response
+  deadline = time.monotonic() + 5
+  while cache.stats()['shared'] < num_threads - 1 and time.monotonic() < deadline:
+    time.sleep(0.01)
+  release.set()
+  for thread in threads:
+    thread.join(5)
+
+  assert len(calls) == 1
+  assert all(result is results[0] for result in results)
+  stats = cache.stats()
+  assert (stats['misses'], stats['shared'], stats['size']) == (1, num_threads - 1, 1)
+  assert cache.get_or_compute('key', compute) is results[0] and len(calls) == 1
+
+def test_failed_compute_is_not_cached():
+  cache = ResponseCache()
+  def fail():
+    raise RuntimeError("render failed")
+  try:
+    cache.get_or_compute('key', fail)
+    assert False, "expected the compute's error"
+  except RuntimeError:
+    pass
+  assert cache.get_or_compute('key', lambda: b'ok') == b'ok'
+
+def test_eviction_and_disk_reads_stay_within_max_bytes(tmp_path):
+  directory = str(tmp_path / 'responses')
+  cache = ResponseCache(max_bytes=250, directory=directory, max_disk_bytes=150)
+  responses = {key: key.encode('ascii') * 100 for key in 'abc'}
+  calls = []
+  def compute(key):
+    calls.append(key)
+    return responses[key]
+
+  for key in 'abc':
+    cache.get_or_compute(key, lambda key=key: compute(key))
+    assert cache.stats()['bytes'] <= 250
+  # a went to disk to make room for c
+  assert cache.stats()['evictions'] == 1
+  assert os.listdir(directory) == ['a.response']
+
+  # and comes back from there, pushing b out in turn
+  assert cache.get_or_compute('a', lambda: compute('a')) == responses['a']
+  assert calls == ['a', 'b', 'c']
+  stats = cache.stats()
+  assert (stats['disk_hits'], stats['size']) == (1, 2)
+  assert stats['bytes'] <= 250
+  assert os.listdir(directory) == ['b.response']
+
+  # the disk tier keeps to max_disk_bytes too, oldest spilled out first
+  cache.get_or_compute('d', lambda: b'd' * 100)
+  assert os.listdir(directory) == ['c.response']
+  assert cache.stats()['disk_evictions'] == 1
+  assert cache.get_or_compute('b', lambda: compute('b')) == responses['b']
+  assert calls == ['a', 'b', 'c', 'b']
+
+def test_newest_response_stays_even_over_max_bytes():
+  cache = ResponseCache(max_bytes=10)
+  cache.get_or_compute('a', lambda: b'a' * 5)
+  cache.get_or_compute('b', lambda: b'b' * 50)
+  stats = cache.stats()
+  assert (stats['size'], stats['bytes'], stats['evictions']) == (1, 50, 1)
+
+def test_maxsize():
+  cache = ResponseCache(maxsize=2)
+  for key in 'abc':
+    cache.get_or_compute(key, lambda key=key: key.encode('ascii'))
+  assert cache.stats()['size'] == 2
+  assert cache.get_or_compute('a', lambda: b'again') == b'again'
@@ -0,0 +1,60 @@
+import marshal
+import os
+import subprocess
+import sys
+
+from specmetric import rules_config
+
+def test_rules_cache_round_trip(tmp_path, monkeypatch):
+    rules = rules_config.load_rules('grammatical_expressions.yml', 'expressions', directory=str(tmp_path))
+    assert os.path.exists(tmp_path / 'grammatical_expressions.marshal')
+    assert rules == rules_config.grammatical_expressions
+
+    # a warm cache never touches the YAML parser
+    def fail(source, section):
+        raise AssertionError("rules should have come from the cache")
+    monkeypatch.setattr(rules_config, 'parse_rules', fail)
+    assert rules_config.load_rules('grammatical_expressions.yml', 'expressions', directory=str(tmp_path)) == rules
+
+def test_rules_cache_invalidated_by_yaml_hash(tmp_path):
+    path = tmp_path / 'compositions.marshal'
+    header = (rules_config.CACHE_VERSION, marshal.version, 'stale digest', 'compositions')
+    with open(path, 'wb') as fp:
+        marshal.dump((header, {'charts': {}}), fp)
+
+    rules = rules_config.load_rules('compositions.yml', 'compositions', directory=str(tmp_path))
+    assert rules == rules_config.compositions
+    assert 'spacefilling' in rules['charts']
+
+    # a corrupt cache is rebuilt too
+    with open(path, 'wb') as fp:
+        fp.write(b'not marshal')
+    assert rules_config.load_rules('compositions.yml', 'compositions', directory=str(tmp_path)) == rules
+
+def test_import_defers_heavy_dependencies():
+    code = (
+        "import sys\n"
+        "import specmetric.parser, specmetric.renderer, specmetric.computation_tree\n"
+        "print(','.join(m for m in ('pandas', 'altair', 'squarify', 'numpy') if m in sys.modules))\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == ''
+
+def test_unmarshallable_rules_are_not_cached(tmp_path, monkeypatch):
+    rules = {'when': object()}
+    monkeypatch.setattr(rules_config, 'parse_rules', lambda source, section: rules)
+    assert rules_config.load_rules('compositions.yml', 'compositions', directory=str(tmp_path)) is rules
+    assert os.listdir(tmp_path) == []
+
+def test_import_defers_loading_rules():
+    code = (
+        "import specmetric.parser, specmetric.incremental_parser, specmetric.rule_resolver\n"
+        "from specmetric import rules_config\n"
+        "print(','.join(name for name in rules_config.RULE_FILES if name in vars(rules_config)))\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == ''
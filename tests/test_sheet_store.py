@@ -0,0 +1,43 @@
+from specmetric.sheet_store import SheetStore, parse_address, column_letters, column_index
+import numpy as np
+import pytest
+
+CSV = '''Major,Enrolled,Count,Share
+C,2006-2010,1,=C2/C5
+B,2011-2015,2.5,
+A,2006-2010,,x
+,,4,
+'''
+
+def test_addresses():
+  assert parse_address('A2:A2001') == ((0, 1), (0, 2000))
+  assert parse_address(' A2: A2001') == ((0, 1), (0, 2000))
+  assert parse_address('Sheet1!$E$8') == ((4, 7), (4, 7))
+  assert parse_address('"Yes"') is None
+  assert [column_letters(i) for i in (0, 25, 26, 701, 702)] == ['A', 'Z', 'AA', 'ZZ', 'AAA']
+  assert column_index('AB') == 27
+
+def test_ranges_resolve_to_slices(tmp_path):
+  path = tmp_path / 'sheet.csv'
+  path.write_text(CSV)
+  for directory in (None, tmp_path / 'cache', tmp_path / 'cache'):
+    # two rows at a time, so values and strings span several chunks
+    sheet = SheetStore.from_csv(str(path), directory=directory and str(directory), chunksize=2)
+    assert sheet.rows == 5
+
+    counts = sheet.resolve('C2:C5')
+    assert np.shares_memory(counts, sheet.column('C').numbers)
+    np.testing.assert_array_equal(counts, [1, 2.5, np.nan, 4])
+    assert list(sheet.resolve('A1:A5')) == ['Major', 'C', 'B', 'A', None]
+    assert list(sheet.resolve('A2:B3')) == ['C', '2006-2010', 'B', '2011-2015']
+    assert sheet.resolve('C3') == 2.5 and sheet.resolve('B2') == '2006-2010' and sheet.resolve('D3') is None
+
+    # formulas have no value here
+    with pytest.raises(KeyError):
+      sheet.resolve('D2:D5')
+    assert 'D2' not in sheet and 'Z2' not in sheet and ' E3' not in sheet
+    assert sheet.formula('D2') == '=C2/C5' and sheet.formula('C2') is None and sheet.formula('D2:D3') is None
+    assert sheet.data_dict(['C2:C5', 'D2:D5', '"Yes"']).keys() == {'C2:C5'}
+    assert sheet.key('C2:C5') == sheet.key('C2: C5')
+  # the second time round, from the arrays kept on disk
+  assert isinstance(sheet.column('C').numbers, np.memmap)
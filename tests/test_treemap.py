@@ -0,0 +1,28 @@
+from specmetric.position_calculators.treemap import squarify_bars
+from specmetric.position_calculators.squarifier import squarify_within_bar
+import numpy as np
+import squarify
+
+def test_squarify_bars_matches_squarify():
+  rng = np.random.default_rng(0)
+  bars = [rng.integers(1, 20, 200), np.round(rng.exponential(10, 500), 1) + 0.1, [3]]
+  heights = [100, 250.5, 40]
+  rects = squarify_bars(bars, 50, heights)
+  assert list(np.bincount(rects['bar'])) == [200, 500, 1]
+
+  for (bar, values) in enumerate(bars):
+    values = np.asarray(values)
+    actual = rects[rects['bar'] == bar]
+    # largest first, equal values in their original order
+    assert list(actual['index']) == list(np.argsort(-values, kind='stable'))
+    sizes = squarify.normalize_sizes(values[actual['index']], 50, heights[bar])
+    expected = squarify.padded_squarify(sizes, 0, 0, 50, heights[bar])
+    for column in ['x', 'y', 'dx', 'dy']:
+      assert list(actual[column]) == [rect[column] for rect in expected]
+
+def test_squarify_within_bar():
+  squares = squarify_within_bar(['a', 'b', 'c'], [1, 6, 3], 10, 10, pad=False)
+  assert list(squares.index) == ['b', 'c', 'a']
+  assert np.isclose((squares['dx'] * squares['dy']).sum(), 100)
+  padded = squarify_within_bar(['a', 'b', 'c'], [1, 6, 3], 10, 10)
+  assert list(padded.loc['b']) == [1, 1, 4, 8]
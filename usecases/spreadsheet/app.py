@@ -1,25 +1,8 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import glob
-import os
-import sys
-from pathlib import Path
-module_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(''))))
+from flask import Flask, render_template, request, jsonify, send_file, abort, make_response
 
-if module_path not in sys.path:
-    sys.path.append(module_path)
-
-# Create experimental setup folder
-import datetime
-current_directory = os.getcwd()
-timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-final_directory = os.path.join(current_directory, 'experimental_images', timestamp)
-if not os.path.exists(final_directory):
-    os.makedirs(final_directory)
-
-# Load up specmetric
-from specmetric.parser import ComputationTreeParser
-from specmetric.computation_tree import ComputationNode
-from specmetric.renderer import AltairRenderer
+# Load up specmetric, and the caches renders go through
+from service import render_store, post_specs
+from columnar import decode_request, BadRequest, MissingColumns
 
 app = Flask(__name__)
 
@@ -27,12 +10,45 @@ app = Flask(__name__)
 def index():
     return render_template("index.html")
 
+def send_render(render, kind):
+    """
+    A render's page or spec, gzipped if the client takes it, or 304 if the
+    client has it already
+    """
+    if request.if_none_match.contains(render.etag):
+        response = make_response('', 304)
+    elif request.accept_encodings['gzip']:
+        response = make_response(render.gzipped(kind))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(render.body(kind))
+    response.mimetype = 'text/html' if kind == 'html' else 'application/json'
+    response.set_etag(render.etag)
+    response.vary.add('Accept-Encoding')
+    # ids are hashes of the spec, so a render never changes
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+@app.route("/renders/<render_id>.<any(html, json):kind>")
+def rendered_chart(render_id, kind):
+    render = render_store.get(render_id)
+    if render is None:
+        abort(404)
+    return send_render(render, kind)
+
 @app.route("/chart.html")
 def chart():
-    list_of_files = glob.glob(os.path.join(final_directory, '*')) 
-    latest_file = max(list_of_files, key=os.path.getctime)
-    print(latest_file)
-    return send_file(latest_file)
+    # the most recent render of any client; clients should follow the url
+    # /postSpecs gives them instead
+    render = render_store.latest()
+    if render is None:
+        abort(404)
+    response = send_render(render, 'html')
+    response.cache_control.max_age = 0
+    response.cache_control.immutable = False
+    return response
 
 @app.route("/berkeley.csv")
 def berkeley():
@@ -40,47 +56,14 @@ def berkeley():
 
 @app.route("/postSpecs", methods = ["POST"])
 def getSpecs():
-    nodes = request.get_json()['nodes']
-    datadict = request.get_json()['datadict']
-    rootName = request.get_json()['rootName']
-
-    print("nodes: ", nodes)
-    print("datadict:", datadict)
-    # print("rootName:", rootName)
-
-    specmetric_nodes = {}
-    for n in nodes:
-        parent = None
-        if n['parent']:
-            parent = specmetric_nodes[n['parent']]
-        name = n['name']
-        if len(name) == 1:
-            name = name[0]
-        else:
-            print("NAME IS ", name)
-        sn = ComputationNode(
-            name, # name
-            parent, # parent
-            n['function'], # matched grammar rule
-            input_data=n['input_data'],
-            output_data=n['output_data']
-            )
-
-        specmetric_nodes[name] = sn
-
-    root = specmetric_nodes[rootName]
-    print("here, root is ", root)
-    parser = ComputationTreeParser(root, isSpreadsheet=True)
-    parser.visualizeDFG()
-    vis_containers = parser.visualization_containers
-    print("vis_containers is ", vis_containers)
-    r = AltairRenderer(vis_containers, datadict)
-    charts = r.convert_to_charts()
-    chart_timestamp_path = datetime.datetime.now().strftime("%Y%m%d_%H%M%S.html")
-    outpath = os.path.join(final_directory, chart_timestamp_path)
-    charts.save(outpath, embed_options={'renderer':'svg'})
-
-    return {'reload': True}
+    try:
+        payload = decode_request(request.get_data(), request.content_type)
+        return post_specs(payload, session=request.headers.get('X-Session-Id'))
+    except BadRequest as e:
+        return {'error': str(e)}, 400
+    except MissingColumns as e:
+        # the client should send these columns again
+        return {'missing': e.names}, 422
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""
+The spreadsheet app as an ASGI application, for interactive use under load.
+
+    uvicorn asgi_app:app
+
+It serves the same routes as app.py, but renders for /postSpecs are
+scheduled by a RenderScheduler:
+  - at most max_workers renders run at a time, on threads
+  - each session (the X-Session-Id header, or else the client's address)
+    has at most one render waiting: a newer request supersedes it, and the
+    older request is answered 409 straight away
+  - a session's running render is told to stop when a newer request comes
+    in, and stops at its next step (see service.render_spec)
+  - with max_waiting renders already waiting, new requests are answered
+    503 with a Retry-After, rather than queued behind them
+So while a user drags across cells, only the latest selection waits, and
+renders of selections they have moved on from don't hold up the workers.
+"""
+import asyncio
+from collections import OrderedDict
+import concurrent.futures
+import json
+import os
+import threading
+
+import service
+from service import render_store, post_specs, Cancelled
+from columnar import decode_request, BadRequest, MissingColumns
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Superseded(Exception):
+    """
+    A newer request of the same session took a render's place
+    """
+
+class Overloaded(Exception):
+    """
+    Too many renders are waiting already
+    """
+
+
+class _Job:
+
+    def __init__(self, session, payload, future):
+        self.session = session
+        self.payload = payload
+        self.future = future
+        self.cancelled = threading.Event()
+        self.started = False
+
+
+class RenderScheduler:
+    """
+    Runs render(payload, cancelled, session) for requests of many sessions,
+    see the module docstring.  Its methods are called from the event loop.
+    """
+
+    def __init__(self, render, max_workers=2, max_waiting=16):
+        self.render = render
+        self.max_workers = max_workers
+        self.max_waiting = max_waiting
+        self.completed = 0
+        self.superseded = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='render')
+        self._waiting = OrderedDict()
+        self._latest = {}
+        self._running = 0
+
+    async def submit(self, session, payload):
+        """
+        The result of rendering payload.  Raises Superseded if a newer
+        request of session comes in first, and Overloaded if there is no
+        room to wait.
+        """
+        previous = self._latest.get(session)
+        if previous is not None:
+            self._supersede(previous)
+        if len(self._waiting) >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded()
+
+        job = _Job(session, payload, asyncio.get_running_loop().create_future())
+        self._latest[session] = job
+        self._waiting[id(job)] = job
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # the client went away
+            self._supersede(job)
+            raise
+        finally:
+            if self._latest.get(session) is job:
+                del self._latest[session]
+
+    def stats(self):
+        return {
+            'completed': self.completed,
+            'superseded': self.superseded,
+            'cancelled': self.cancelled,
+            'rejected': self.rejected,
+            'waiting': len(self._waiting),
+            'running': self._running,
+            'max_workers': self.max_workers,
+            'max_waiting': self.max_waiting
+        }
+
+    def _supersede(self, job):
+        job.cancelled.set()
+        if self._waiting.pop(id(job), None) is not None:
+            # never started, so it is done with now
+            self.superseded += 1
+            if not job.future.done():
+                job.future.set_exception(Superseded())
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._running < self.max_workers and self._waiting:
+            (_, job) = self._waiting.popitem(last=False)
+            job.started = True
+            self._running += 1
+            done = loop.run_in_executor(self._executor, self.render, job.payload, job.cancelled.is_set, job.session)
+            done.add_done_callback(lambda done, job=job: self._finished(job, done))
+
+    def _finished(self, job, done):
+        self._running -= 1
+        error = done.exception()
+        if isinstance(error, Cancelled) and job.cancelled.is_set():
+            self.cancelled += 1
+            error = Superseded()
+        elif error is None:
+            self.completed += 1
+        if not job.future.done():
+            if error is None:
+                job.future.set_result(done.result())
+            else:
+                job.future.set_exception(error)
+        self._dispatch()
+
+
+def _render(payload, cancelled, session):
+    while True:
+        try:
+            return post_specs(payload, cancelled, session)
+        except Cancelled:
+            if cancelled():
+                raise
+            # another session's identical request was rendering this, and
+            # was cancelled; render it for this one
+            continue
+
+scheduler = RenderScheduler(_render, max_workers=int(os.environ.get('SPECMETRIC_RENDER_WORKERS', 2)))
+
+
+# HTTP
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def respond(send, status, body=b'', content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(body)).encode('latin-1'))] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def respond_json(send, status, value, headers=()):
+    await respond(send, status, json.dumps(value).encode('utf-8'), headers=headers)
+
+async def send_file(send, filename, content_type):
+    with open(os.path.join(HERE, filename), 'rb') as fp:
+        body = fp.read()
+    await respond(send, 200, body, content_type)
+
+async def send_render(send, request_headers, render, kind, immutable=True):
+    """
+    A render's page or spec, gzipped if the client takes it, or 304 if the
+    client has it already
+    """
+    etag = '"{}"'.format(render.etag)
+    headers = [
+        (b'etag', etag.encode('latin-1')),
+        (b'vary', b'Accept-Encoding'),
+        # ids are hashes of the spec, so a render never changes
+        (b'cache-control', b'public, max-age=31536000, immutable' if immutable else b'no-cache'),
+    ]
+    content_type = 'text/html; charset=utf-8' if kind == 'html' else 'application/json'
+    if_none_match = request_headers.get(b'if-none-match', b'').decode('latin-1')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        await respond(send, 304, b'', content_type, headers)
+    elif b'gzip' in request_headers.get(b'accept-encoding', b''):
+        await respond(send, 200, render.gzipped(kind), content_type, headers + [(b'content-encoding', b'gzip')])
+    else:
+        await respond(send, 200, render.body(kind), content_type, headers)
+
+def session_of(scope, request_headers):
+    session = request_headers.get(b'x-session-id')
+    if session:
+        return session.decode('latin-1')
+    client = scope.get('client')
+    return client[0] if client else None
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    method = scope['method']
+    request_headers = dict(scope['headers'])
+
+    if path == '/postSpecs' and method == 'POST':
+        try:
+            payload = decode_request(await read_body(receive), request_headers.get(b'content-type', b'').decode('latin-1'))
+            response = await scheduler.submit(session_of(scope, request_headers), payload)
+        except BadRequest as e:
+            return await respond_json(send, 400, {'error': str(e)})
+        except MissingColumns as e:
+            # the client should send these columns again
+            return await respond_json(send, 422, {'missing': e.names})
+        except Superseded:
+            return await respond_json(send, 409, {'superseded': True})
+        except Overloaded:
+            return await respond_json(send, 503, {'overloaded': True}, headers=[(b'retry-after', b'1')])
+        return await respond_json(send, 200, response)
+
+    if method not in ('GET', 'HEAD'):
+        return await respond_json(send, 405, {'error': 'method not allowed'})
+    if path == '/':
+        return await send_file(send, os.path.join('templates', 'index.html'), 'text/html; charset=utf-8')
+    if path == '/berkeley.csv':
+        return await send_file(send, 'berkeley_with_calculations.csv', 'text/csv')
+    if path == '/chart.html':
+        # the most recent render of any client; clients should follow the
+        # url /postSpecs gives them instead
+        render = render_store.latest()
+        if render is None:
+            return await respond_json(send, 404, {'error': 'nothing rendered yet'})
+        return await send_render(send, request_headers, render, 'html', immutable=False)
+    if path.startswith('/renders/'):
+        (render_id, _, kind) = path[len('/renders/'):].partition('.')
+        render = render_store.get(render_id)
+        if render is None or kind not in ('html', 'json'):
+            return await respond_json(send, 404, {'error': 'no such render'})
+        return await send_render(send, request_headers, render, kind)
+    if path == '/stats':
+        return await respond_json(send, 200, {'scheduler': scheduler.stats(), 'responses': service.response_cache().stats(), 'charts': service.chart_cache.stats(), 'columns': service.uploaded_columns.stats(), 'formulas': service.default_formula_cache.stats(), 'masks': service.default_mask_cache.stats()})
+    return await respond_json(send, 404, {'error': 'not found'})
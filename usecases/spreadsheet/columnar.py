@@ -0,0 +1,243 @@
+"""
+Columns of /postSpecs requests: sent as typed arrays rather than JSON
+lists, and kept by the server so later requests can refer to them instead
+of sending them again.
+
+A request's datadict maps names to columns, each of which is one of
+  - a JSON list (or a single value), as before
+  - {"ref": hash}, a column sent earlier, by the hash the server gave it
+  - {"range": address}, the column this session last sent for a range, or
+    else the range's cells in the server's own copy of the sheet
+and, in a columnar body (CONTENT_TYPE),
+  - {"dtype": "<f8", "offset": offset, "length": length}, length values of
+    dtype at offset bytes into the body's data
+A columnar body is the length of its header (a little-endian uint32), the
+header itself (JSON, {"nodes": ..., "rootName": ..., "datadict": ...}), and
+then the data, starting at the next multiple of 8 bytes.  Typed arrays are
+used where they are, without a copy.
+
+Bodies can also be Arrow IPC streams (ARROW_CONTENT_TYPE, needs pyarrow),
+with one column per datadict entry and the rest of the header as JSON in
+the schema's b'specmetric' metadata.
+
+Every response says which hash each column got, so clients know what they
+can refer to.  A request referring to columns the server no longer has
+gets MissingColumns, and should be sent again with them.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import struct
+import threading
+
+import numpy as np
+
+CONTENT_TYPE = 'application/x-specmetric-columns'
+ARROW_CONTENT_TYPE = 'application/vnd.apache.arrow.stream'
+
+DTYPES = {'<f8', '<f4', '<i1', '<i2', '<i4', '<i8', '<u1', '<u2', '<u4', '<u8', '|b1', '|i1', '|u1'}
+
+
+class BadRequest(ValueError):
+    """
+    A body that can't be read
+    """
+
+class MissingColumns(KeyError):
+    """
+    A request refers to columns the server doesn't have (anymore)
+    """
+
+    def __init__(self, names):
+        super().__init__(names)
+        self.names = names
+
+
+def decode_request(body, content_type):
+    """
+    The payload of a /postSpecs body, by its content type
+    """
+    content_type = (content_type or '').split(';')[0].strip()
+    if content_type == CONTENT_TYPE:
+        return decode_columns(body)
+    if content_type == ARROW_CONTENT_TYPE:
+        return decode_arrow(body)
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise BadRequest("body isn't JSON: {}".format(e))
+
+
+def decode_columns(body):
+    body = memoryview(body)
+    try:
+        (header_length,) = struct.unpack_from('<I', body, 0)
+        if 4 + header_length > len(body):
+            raise BadRequest("header runs past the end of the body")
+        header = json.loads(bytes(body[4:4 + header_length]))
+        data_start = (4 + header_length + 7) // 8 * 8
+        data_length = max(len(body) - data_start, 0)
+        datadict = {}
+        for (name, column) in header['datadict'].items():
+            if isinstance(column, dict) and 'dtype' in column:
+                if column['dtype'] not in DTYPES:
+                    raise BadRequest("columns can't be of type {!r}".format(column['dtype']))
+                (offset, length) = (column['offset'], column['length'])
+                if not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in (offset, length)):
+                    raise BadRequest("column {!r} needs a whole offset and length, not {!r} and {!r}".format(name, offset, length))
+                if offset + length * np.dtype(column['dtype']).itemsize > data_length:
+                    raise BadRequest("column {!r} runs past the end of the body".format(name))
+                datadict[name] = np.frombuffer(body, dtype=column['dtype'], count=length, offset=data_start + offset)
+            else:
+                datadict[name] = column
+    except (struct.error, ValueError, KeyError, TypeError) as e:
+        if isinstance(e, BadRequest):
+            raise
+        raise BadRequest("not a columnar body: {}".format(e))
+    header['datadict'] = datadict
+    return header
+
+
+def decode_arrow(body):
+    import pyarrow as pa
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+        header = json.loads(table.schema.metadata[b'specmetric'])
+    except (pa.ArrowInvalid, KeyError, TypeError, ValueError) as e:
+        raise BadRequest("not an Arrow stream with a specmetric header: {}".format(e))
+    datadict = dict(header.get('datadict', {}))
+    for name in table.column_names:
+        datadict[name] = table.column(name)
+    header['datadict'] = datadict
+    return header
+
+
+def column_hash(values):
+    """
+    Hash of a column: a numeric array by its dtype and bytes, anything else
+    by its JSON.  So the same numbers hash differently sent as a typed array
+    and as a JSON list, or as arrays of different dtypes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        values = np.ascontiguousarray(values)
+        digest.update(values.dtype.str.encode('utf-8'))
+        digest.update(values.data)
+    else:
+        if hasattr(values, 'to_pylist'):
+            values = values.to_pylist()
+        elif hasattr(values, 'tolist'):
+            values = values.tolist()
+        digest.update(b'json')
+        digest.update(json.dumps(values, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _column_bytes(values):
+    size = getattr(values, 'nbytes', None)
+    return int(size) if size is not None else 32 * (len(values) if isinstance(values, list) else 1)
+
+
+class UploadedColumns:
+    """
+    Columns sent by clients, by hash, least recently used first out once
+    they add up to more than max_bytes.  For each of up to max_sessions
+    sessions, also the hash of the column it last sent for each range.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_sessions=1024):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self.hits = 0
+        self.uploads = 0
+        self.misses = 0
+        self.evictions = 0
+        self._columns = OrderedDict()
+        self._bytes = 0
+        self._ranges = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, datadict, session=None, sheet=None):
+        """
+        datadict with references replaced by the columns they refer to, and
+        the hash of every column.  Ranges that weren't sent are looked up in
+        sheet(), a specmetric.sheet_store.SheetStore, which is only called
+        for them.  Raises MissingColumns naming the entries whose columns
+        aren't here.
+        """
+        resolved = {}
+        hashes = {}
+        missing = []
+        for (name, column) in datadict.items():
+            if isinstance(column, dict) and ('ref' in column or 'range' in column):
+                key = column.get('ref') or self._range_hash(session, column['range'])
+                values = self._get(key)
+                if values is None and 'range' in column and sheet is not None:
+                    try:
+                        store = sheet()
+                        values = store.resolve(column['range'])
+                        key = store.key(column['range'])
+                    except (KeyError, OSError):
+                        # a range the sheet doesn't have, or a sheet that
+                        # can't be read, is missing like any other column
+                        pass
+                if values is None:
+                    missing.append(name)
+                    continue
+            else:
+                values = column
+                key = column_hash(values)
+                self._put(key, values)
+            resolved[name] = values
+            hashes[name] = key
+        if missing:
+            raise MissingColumns(missing)
+        if session is not None:
+            self._remember_ranges(session, hashes)
+        return (resolved, hashes)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'uploads': self.uploads,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._columns),
+            'bytes': self._bytes,
+            'sessions': len(self._ranges)
+        }
+
+    def _get(self, key):
+        with self._lock:
+            values = self._columns.get(key) if key is not None else None
+            if values is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._columns.move_to_end(key)
+            return values
+
+    def _put(self, key, values):
+        with self._lock:
+            self.uploads += 1
+            if key not in self._columns:
+                self._columns[key] = values
+                self._bytes += _column_bytes(values)
+            self._columns.move_to_end(key)
+            # the column just sent stays, even if it is over max_bytes on its own
+            while self._bytes > self.max_bytes and len(self._columns) > 1:
+                (_, evicted) = self._columns.popitem(last=False)
+                self._bytes -= _column_bytes(evicted)
+                self.evictions += 1
+
+    def _range_hash(self, session, address):
+        with self._lock:
+            return self._ranges.get(session, {}).get(address)
+
+    def _remember_ranges(self, session, hashes):
+        with self._lock:
+            ranges = self._ranges.setdefault(session, {})
+            ranges.update(hashes)
+            self._ranges.move_to_end(session)
+            while len(self._ranges) > self.max_sessions:
+                self._ranges.popitem(last=False)
@@ -0,0 +1,122 @@
+"""
+Rendered charts of the spreadsheet app, kept in memory and served by id.
+
+A render's id is a hash of its spec, so it doubles as its ETag: the same
+spec always has the same id, and a browser that has it already gets a 304.
+Pages and specs are gzipped once, the first time a client that accepts gzip
+asks for them.  Renders can also be archived as HTML files, which is done
+on a background thread so requests don't wait for the disk.
+"""
+from collections import OrderedDict
+import concurrent.futures
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+
+class Render:
+    """
+    A chart's spec, as JSON, and the page that shows it
+    """
+
+    def __init__(self, render_id, spec_json, embed_options=None):
+        self.render_id = render_id
+        self.spec_json = spec_json
+        self.embed_options = embed_options
+        self._html = None
+        self._gzipped = {}
+
+    @property
+    def etag(self):
+        return self.render_id
+
+    def body(self, kind):
+        """
+        The spec ('json') or page ('html'), as bytes
+        """
+        if kind == 'json':
+            return self.spec_json.encode('utf-8')
+        if self._html is None:
+            self._html = spec_html(self.spec_json, self.embed_options).encode('utf-8')
+        return self._html
+
+    def gzipped(self, kind):
+        body = self._gzipped.get(kind)
+        if body is None:
+            body = gzip.compress(self.body(kind), compresslevel=6)
+            self._gzipped[kind] = body
+        return body
+
+
+def spec_html(spec_json, embed_options=None):
+    """
+    A standalone page showing a Vega-Lite spec, like Chart.save makes
+    """
+    import altair
+    from altair.utils.html import spec_to_html
+    return spec_to_html(
+        json.loads(spec_json), mode='vega-lite',
+        vega_version=altair.VEGA_VERSION, vegaembed_version=altair.VEGAEMBED_VERSION,
+        vegalite_version=altair.VEGALITE_VERSION, embed_options=embed_options)
+
+
+class RenderStore:
+    """
+    The maxsize most recent renders, by id.  With an archive_directory, every
+    render's page is also written there, in the background.
+    """
+
+    def __init__(self, maxsize=64, archive_directory=None, embed_options=None):
+        self.maxsize = maxsize
+        self.archive_directory = archive_directory
+        self.embed_options = embed_options
+        self._renders = OrderedDict()
+        self._latest = None
+        self._lock = threading.Lock()
+        self._archiver = None
+        if archive_directory is not None:
+            os.makedirs(archive_directory, exist_ok=True)
+            # one thread, so pages are written in the order they were made
+            self._archiver = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive')
+
+    def add(self, chart):
+        """
+        Keeps chart (anything with to_json()) and returns its Render
+        """
+        return self.add_json(chart.to_json())
+
+    def add_json(self, spec_json):
+        """
+        Keeps a spec, given as JSON, and returns its Render
+        """
+        render_id = hashlib.blake2b(spec_json.encode('utf-8'), digest_size=16).hexdigest()
+        with self._lock:
+            render = self._renders.get(render_id)
+            if render is None:
+                render = Render(render_id, spec_json, self.embed_options)
+                self._renders[render_id] = render
+            self._renders.move_to_end(render_id)
+            while len(self._renders) > self.maxsize:
+                self._renders.popitem(last=False)
+            self._latest = render
+        if self._archiver is not None:
+            self._archiver.submit(self._archive, render, datetime.datetime.now())
+        return render
+
+    def get(self, render_id):
+        with self._lock:
+            return self._renders.get(render_id)
+
+    def latest(self):
+        return self._latest
+
+    def _archive(self, render, time):
+        path = os.path.join(self.archive_directory, '{}_{}.html'.format(time.strftime("%Y%m%d_%H%M%S"), render.render_id))
+        try:
+            with open(path, 'wb') as fp:
+                fp.write(render.body('html'))
+        except OSError as e:
+            print("couldn't archive render {}: {}".format(render.render_id, e))
@@ -0,0 +1,188 @@
+"""
+Responses of /postSpecs, by a hash of the request.
+
+Clicking back and forth between cells sends the same requests over and
+over, so the spec each one rendered to is kept: in memory up to maxsize
+entries and max_bytes, least recently used first out, and with a
+directory, spilled to disk from there.  Identical requests that arrive
+while the first is still rendering wait for it rather than rendering too.
+"""
+from collections import OrderedDict
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+
+# Bump whenever the same request would render differently, so responses
+# spilled to disk by an older version are not reused
+RESPONSE_VERSION = 2
+
+
+def request_key(payload):
+    """
+    Hash of a request's JSON payload, the same whatever order its keys came
+    in
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(RESPONSE_VERSION).encode('utf-8'))
+    digest.update(canonical.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Responses (bytes) by key, see the module docstring
+    """
+
+    def __init__(self, maxsize=256, max_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=256 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        The response for key, from the cache, from an identical request in
+        flight, or else from compute()
+        """
+        owner = False
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return response
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.shared += 1
+            else:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+                owner = True
+        if not owner:
+            return future.result()
+
+        try:
+            response = self._load(key)
+            with self._lock:
+                if response is None:
+                    self.misses += 1
+                else:
+                    self.disk_hits += 1
+            if response is None:
+                response = compute()
+            spilled = self._put(key, response)
+            future.set_result(response)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        for (spilled_key, spilled_response) in spilled:
+            self._save(spilled_key, spilled_response)
+        return response
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'evictions': self.evictions,
+            'disk_evictions': self.disk_evictions,
+            'size': len(self._entries),
+            'bytes': self._bytes,
+            'hit_rate': ((self.hits + self.disk_hits) / lookups) if lookups else 0.0
+        }
+
+    def _put(self, key, response):
+        """
+        Keeps response in memory, and returns what was evicted to make room
+        """
+        evicted = []
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = response
+                self._bytes += len(response)
+            self._entries.move_to_end(key)
+            # the newest response stays, even if it is over max_bytes on its own
+            while len(self._entries) > 1 and (len(self._entries) > self.maxsize or self._bytes > self.max_bytes):
+                (evicted_key, evicted_response) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_response)
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_response))
+        return evicted
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.response')
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as fp:
+                response = fp.read()
+            # a spilled response goes back to memory, so it's no longer spilled
+            os.unlink(self._path(key))
+            return response
+        except OSError:
+            return None
+
+    def _save(self, key, response):
+        if self.directory is None:
+            return
+        try:
+            import tempfile
+            os.makedirs(self.directory, exist_ok=True)
+            # write to a temporary file first so readers never see half a response
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(response)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            with self._disk_lock:
+                self._trim()
+        except OSError:
+            # the disk tier is only an optimization
+            pass
+
+    def _trim(self):
+        # oldest spilled first
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.response'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+        total = sum(size for (_, _, size) in files)
+        for (_, path, size) in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                self.disk_evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
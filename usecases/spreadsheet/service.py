@@ -0,0 +1,178 @@
+"""
+The rendering behind the spreadsheet app, shared by app.py (Flask) and
+asgi_app.py: the caches, and turning a /postSpecs request into a render.
+"""
+import os
+import sys
+module_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(''))))
+
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+# Renders are served from memory.  Set SPECMETRIC_ARCHIVE_CHARTS to also
+# keep every chart in an experimental setup folder, written in the background.
+import datetime
+import logging
+import threading
+final_directory = None
+if os.environ.get('SPECMETRIC_ARCHIVE_CHARTS'):
+    current_directory = os.getcwd()
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    final_directory = os.path.join(current_directory, 'experimental_images', timestamp)
+
+# Load up specmetric
+from specmetric.parser import ComputationTreeParser
+from specmetric.computation_tree import ComputationGraph
+from specmetric.renderer import AltairRenderer
+from specmetric.position_calculators.layout_cache import LayoutCache
+from specmetric.chart_cache import ChartCache
+from specmetric.rules_config import cache_dir
+from specmetric.sheet_store import SheetStore, parse_address
+from specmetric.formula import compile_cells, default_formula_cache
+from specmetric.criteria import default_mask_cache
+from render_store import RenderStore
+from response_cache import ResponseCache, request_key
+from columnar import UploadedColumns
+
+# charts of containers that are unchanged since an earlier request
+chart_cache = ChartCache()
+render_store = RenderStore(archive_directory=final_directory, embed_options={'renderer':'svg'})
+# columns clients sent, which later requests can refer to by hash or range
+uploaded_columns = UploadedColumns()
+
+SHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'berkeley_with_calculations.csv')
+
+# Caches with a disk tier are made the first time they are needed, so
+# importing this module neither reads SPECMETRIC_CACHE_DIR nor touches it
+_disk_caches = {}
+# one lock each, so reading the sheet doesn't hold up responses
+_disk_cache_locks = {name: threading.Lock() for name in ('layouts', 'responses', 'sheets')}
+
+def _disk_cache(name, make):
+    with _disk_cache_locks[name]:
+        if name not in _disk_caches:
+            directory = cache_dir()
+            _disk_caches[name] = make(os.path.join(directory, name) if directory else None)
+        return _disk_caches[name]
+
+def layout_cache():
+    """
+    Treemap layouts, kept on disk too so they survive restarts
+    """
+    return _disk_cache('layouts', lambda directory: LayoutCache(directory=directory))
+
+def response_cache():
+    """
+    Responses to requests seen before, spilled to disk when they don't fit
+    """
+    return _disk_cache('responses', lambda directory: ResponseCache(directory=directory))
+
+def sheet_store():
+    """
+    The server's copy of the sheet the page shows, read the first time it is
+    needed (and kept on disk next to the other caches)
+    """
+    return _disk_cache('sheets', lambda directory: SheetStore.from_csv(SHEET_PATH, directory=directory))
+
+
+logger = logging.getLogger(__name__)
+
+def _size(values):
+    return len(values) if hasattr(values, '__len__') and not isinstance(values, str) else 1
+
+
+class Cancelled(Exception):
+    """
+    Raised by a render that was told to stop
+    """
+
+
+def render_spec(nodes, datadict, rootName, cancelled=None):
+    """
+    Parses and renders a request, returning the spec as JSON bytes.  If
+    cancelled() turns true, stops (between steps) with Cancelled.
+    """
+    def check():
+        if cancelled is not None and cancelled():
+            raise Cancelled()
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("rendering %s: %d nodes, columns %s", rootName, len(nodes), {name: _size(values) for (name, values) in datadict.items()})
+
+    # nodes can arrive in any order, the graph links them up in one pass
+    graph = ComputationGraph.from_records(nodes, function_type='function')
+    root = graph.node(graph.index([rootName])[0])
+    parser = ComputationTreeParser(root, isSpreadsheet=True)
+    parser.visualizeDFG()
+    vis_containers = parser.visualization_containers
+    logger.debug("%d visualization containers", len(vis_containers))
+    check()
+    # the range and criterion pairs of COUNTIF(S) nodes compiled from formulas
+    criteria = {node['name']: node['criteria'] for node in nodes if 'criteria' in node}
+    r = AltairRenderer(vis_containers, datadict, layout_cache=layout_cache(), chart_cache=chart_cache, criteria=criteria)
+    charts = r.convert_to_charts()
+    check()
+    return charts.to_json().encode('utf-8')
+
+
+def compile_nodes(rootName, formulas):
+    """
+    The nodes of the tree rooted at rootName, compiled from formulas (cell
+    address to formula text, or None for cells without one).  Cells not in
+    formulas have the formulas of the server's copy of the sheet.
+    """
+    def formula_of(address):
+        if address in formulas:
+            return formulas[address]
+        return sheet_store().formula(address)
+    return compile_cells(rootName, formula_of)
+
+
+def post_specs(payload, cancelled=None, session=None):
+    """
+    The /postSpecs response for a payload: nodes, or formulas to compile
+    into them, see compile_nodes (and columnar for what its datadict can
+    hold)
+    """
+    rootName = payload['rootName']
+    datadict = dict(payload['datadict'])
+    if 'nodes' in payload:
+        nodes = payload['nodes']
+    else:
+        nodes = compile_nodes(rootName, payload.get('formulas', {}))
+    for node in nodes:
+        # columns go by a node's output, its text; compiled nodes' names are
+        # made unique, so a repeated subexpression has several
+        output = node.get('output_data') or node['name']
+        if 'value' in node:
+            datadict.setdefault(output, node['value'])
+        # cells and ranges the client left out are the sheet's own (and
+        # formula cells it left out are missing, the sheet has no values
+        # for them)
+        elif output not in datadict and parse_address(output) is not None:
+            datadict[output] = {'range': output}
+        # and so are the cells of criteria
+        for name in node.get('criteria', ())[1::2]:
+            if name not in datadict and parse_address(name) is not None:
+                datadict[name] = {'range': name}
+    (datadict, hashes) = uploaded_columns.resolve(datadict, session, sheet=sheet_store)
+
+    # the same request (in any key order, and however its columns were
+    # sent) renders to the same spec, so it is only rendered once
+    key = request_key({'nodes': nodes, 'columns': hashes, 'rootName': rootName})
+    spec_json = response_cache().get_or_compute(key, lambda: render_spec(nodes, datadict, rootName, cancelled))
+    render = render_store.add_json(spec_json.decode('utf-8'))
+    return render_response(render, hashes)
+
+
+def render_response(render, hashes):
+    """
+    The /postSpecs response for render, of columns with hashes
+    """
+    return {
+        'reload': True,
+        'renderId': render.render_id,
+        'url': '/renders/{}.html'.format(render.render_id),
+        'specUrl': '/renders/{}.json'.format(render.render_id),
+        'columns': hashes,
+    }